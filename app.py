@@ -5,7 +5,13 @@ Modern Streamlit UI — light theme, card layout, animations.
 """
 
 import streamlit as st
+import functools
+import html
+import json
+import os
 import time
+import uuid
+from collections import deque
 from datetime import date, datetime
 
 # ─── Must be first Streamlit call ───────────────────────────────────────────────
@@ -17,26 +23,86 @@ st.set_page_config(
 )
 
 from utils.data_manager import (
-    init_storage, create_user, authenticate,
-    register_ngo, get_approved_ngos, get_pending_ngos, get_all_ngos,
-    get_ngo_by_id, admin_decision,
-    get_donations_by_donor, get_donations_by_ngo,
-    create_donation, create_receipt, get_receipt_by_donation,
-    add_allocation, get_allocations_by_ngo,
-    record_outcome, get_outcomes_by_ngo,
+    init_storage, authenticate,
+    get_pending_ngos, get_all_ngos, get_ngo_by_id,
+    get_receipt_by_donation,
     get_ngo_impact_summary, get_platform_stats,
     UNIT_COST_DEFAULTS
 )
-from utils.ai_engine import run_ngo_analysis, predict_impact
+from utils.store import (
+    create_user, register_ngo, create_donation, create_receipt,
+    add_allocation, record_outcome, admin_decision_if_unchanged, admin_decisions,
+    run_ngo_analysis, ngo_version, ngo_versions, pending as parked_writes
+)
+from utils.partitions import (
+    get_donations_by_donor, get_donations_by_ngo, get_allocations_by_ngo, get_outcomes_by_ngo
+)
+from utils.ai_engine import predict_impact
 from utils.chatbot import chat
+from utils.payment_guard import PaymentGuard
+from utils.receipts import render_receipt_text
+from utils.snapshot import get_snapshot
+from utils.records import NGORecord, DonationRecord, AllocationRecord
+from utils import leaderboard
+from utils import recommender
+from utils.recommender import recommend_for_donor
+from utils.facets import get_index, FACETS
+from utils import deadlines
+from utils import ledger
+from utils.sessions import SessionRegistry, append_chat
+from utils.warmup import CacheWarmer, record_view
+from utils import score_history
+from utils.forecast import forecast, available as forecast_available
+from utils import cost_sketch
+from utils import changefeed  # noqa: F401 — registers the change-feed producers
+from utils import ratelimit
+from utils import archive
+from utils import fragments
+from utils.bulk_import import (
+    iter_rows, import_allocations, import_outcomes, template_csv,
+    ALLOCATION_COLUMNS, OUTCOME_COLUMNS
+)
 
 init_storage()
 
+
+@st.cache_resource
+def payment_guard():
+    """Duplicate/velocity guard; its state lives in DATA_DIR, so every replica shares it."""
+    return PaymentGuard()
+
+
+@st.cache_resource
+def deadline_scheduler():
+    """Background thread that flags allocations as their outcome dates pass."""
+    return deadlines.scheduler.start()
+
+
+@st.cache_resource
+def recommendations_build():
+    """Recommendation build and change-feed refresh, in the background — never inside a donor's page."""
+    return recommender.start()
+
+
+deadline_scheduler()
+recommendations_build()
+
+
+@st.cache_resource
+def session_registry():
+    """Memory accounting and idle eviction for every session on this server."""
+    return SessionRegistry()
+
+
+def session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # GLOBAL CSS
 # ═══════════════════════════════════════════════════════════════════════════════
-st.markdown("""
-<style>
+GLOBAL_CSS = """
 /* ── Google Font ── */
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
 
@@ -236,8 +302,27 @@ div.stSelectbox > div > div {
     font-weight: 800;
     text-align: center;
 }
-</style>
-""", unsafe_allow_html=True)
+"""
+
+
+def inject_css():
+    """Once per session: the stylesheet goes into the page's <head>, so later reruns send none of it."""
+    if st.session_state.get("_css_injected"):
+        return
+    import streamlit.components.v1 as components
+    components.html(f"""<script>
+        const doc = window.parent.document;
+        if (!doc.getElementById("nsitn-css")) {{
+            const style = doc.createElement("style");
+            style.id = "nsitn-css";
+            style.textContent = {json.dumps(GLOBAL_CSS)};
+            doc.head.appendChild(style);
+        }}
+    </script>""", height=0)
+    st.session_state._css_injected = True
+
+
+inject_css()
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -258,38 +343,138 @@ ss("show_chatbot", False)
 # ═══════════════════════════════════════════════════════════════════════════════
 # HELPERS
 # ═══════════════════════════════════════════════════════════════════════════════
+PROFILE = os.environ.get("NSITN_PROFILE") == "1"
+
+def profiled(fn):
+    """With NSITN_PROFILE=1, record the last 20 run times (ms) of fn in the session."""
+    if not PROFILE:
+        return fn
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings = st.session_state.setdefault("_timings", {})
+            timings.setdefault(fn.__name__, deque(maxlen=20)).append((time.perf_counter() - t0) * 1000)
+    return wrapper
+
+def render_timings():
+    timings = st.session_state.get("_timings")
+    if not timings:
+        return
+    with st.expander("⏱️ Render timings (ms)"):
+        for name, runs in sorted(timings.items()):
+            ordered = sorted(runs)
+            st.markdown(f"`{name}` — median {ordered[len(ordered)//2]:.1f} · last {runs[-1]:.1f} · n={len(runs)}")
+
 def nav(page):
     st.session_state.page = page
     st.rerun()
 
 def score_color(score):
-    score = float(score)
     if score >= 70: return "chip-green"
     if score >= 45: return "chip-yellow"
     return "chip-red"
 
 def risk_color(risk):
-    risk = float(risk)
     if risk < 30: return "chip-green"
     if risk < 50: return "chip-yellow"
     return "chip-red"
 
 def score_emoji(score):
-    score = float(score)
     if score >= 70: return "🟢"
     if score >= 45: return "🟡"
     return "🔴"
 
+@st.cache_data(max_entries=2000, show_spinner=False)
+def cached_analysis(ngo_id, version):
+    """run_ngo_analysis, re-run only when the NGO's row version moves."""
+    return run_ngo_analysis(ngo_id)
+
+@st.cache_resource
+def cache_warmer():
+    """Preload hot read paths once per server boot, in the background."""
+    return CacheWarmer().start()
+
+cache_warmer()
+
+def render_score_trend(ngo_id, days=90):
+    """Transparency / risk over time from the score history, plus the 30-day change."""
+    import pandas as pd
+
+    h = score_history.history(ngo_id, time.time() - days * 86400)
+    if len(h["at"]) < 2:
+        return
+    st.markdown('<div class="section-title">📈 Score Trend</div>', unsafe_allow_html=True)
+    now, delta = score_history.change(ngo_id, "transparency_score", 30)
+    _, risk_delta = score_history.change(ngo_id, "risk_percent", 30)
+    c1, c2 = st.columns(2)
+    c1.metric("Transparency (30-day change)", f"{now:.1f}",
+              f"{delta:+.1f}" if delta is not None else None)
+    c2.metric("Risk (30-day change)", f"{h['risk_percent'][-1]:.1f}%",
+              f"{risk_delta:+.1f}" if risk_delta is not None else None, delta_color="inverse")
+    st.line_chart(pd.DataFrame({"Transparency": h["transparency_score"], "Risk %": h["risk_percent"]},
+                               index=pd.to_datetime(list(h["at"]), unit="s")))
+
 def render_score_bar(label, value, max_val=100, color="#6C63FF"):
     pct = min(float(value) / max_val * 100, 100)
     st.markdown(f"**{label}** — `{value}`")
     st.progress(pct / 100)
 
+def render_recommendations(user, title, n=3):
+    """Precomputed "NGOs like the ones you support", or the overall top list for new donors."""
+    snap = get_snapshot()
+    ids  = [i for i, _ in recommend_for_donor(user["user_id"], n)] or \
+           [r["ngo_id"] for r in leaderboard.top("overall", n)]
+    picks = [snap.by_id[i] for i in ids if i in snap.by_id]
+    if not picks:
+        return
+    st.markdown(f'<div class="section-title">{title}</div>', unsafe_allow_html=True)
+    for col, ngo in zip(st.columns(len(picks)), picks):
+        with col:
+            st.markdown(f"""
+            <div class="card" style="min-height:130px">
+                <div style="font-weight:700">{ngo['name']}</div>
+                <div style="color:#718096;font-size:0.82rem">🎯 {ngo['cause'].title()} · 📍 {ngo['location']}</div>
+                <span class="stat-chip {score_color(ngo.transparency_score)}">{ngo.transparency_score:.1f}%</span>
+            </div>""", unsafe_allow_html=True)
+            if st.button("📊 Details", key=f"rec_{title}_{ngo['ngo_id']}", use_container_width=True):
+                st.session_state.selected_ngo = ngo["ngo_id"]
+                nav("ngo_detail")
+
 def card(content_fn, *args, **kwargs):
     st.markdown('<div class="card">', unsafe_allow_html=True)
     content_fn(*args, **kwargs)
     st.markdown('</div>', unsafe_allow_html=True)
 
+def render_bulk_import(kind, ngo):
+    """CSV/XLSX upload for many allocations or outcomes — one re-score at the end."""
+    columns  = ALLOCATION_COLUMNS if kind == "allocations" else OUTCOME_COLUMNS
+    importer = import_allocations if kind == "allocations" else import_outcomes
+    with st.expander(f"📤 Bulk import {kind} (CSV / XLSX)"):
+        st.markdown(f"Columns: `{', '.join(columns)}`")
+        st.download_button("⬇️ CSV template", data=template_csv(columns),
+                           file_name=f"nsitn_{kind}_template.csv", mime="text/csv",
+                           key=f"tpl_{kind}")
+        upload = st.file_uploader("Upload file", type=["csv", "xlsx"], key=f"up_{kind}")
+        if upload and st.button(f"🚀 Import {kind}", use_container_width=True, key=f"imp_{kind}"):
+            try:
+                with st.spinner("Importing…"):
+                    report = importer(ngo["ngo_id"], iter_rows(upload, upload.name))
+            except RuntimeError as e:
+                st.error(str(e)); return
+            if report["inserted"]:
+                st.success(f"✅ Imported {report['inserted']} {kind}.")
+            if report["errors"]:
+                st.warning(f"⚠️ {len(report['errors'])} row(s) skipped:")
+                rows = "".join(f"<tr><td>{r}</td><td>{html.escape(msg)}</td></tr>" for r, msg in report["errors"])
+                st.markdown(f"""
+                <table class="custom-table">
+                    <tr><th>Row</th><th>Problem</th></tr>
+                    {rows}
+                </table>""", unsafe_allow_html=True)
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # SIDEBAR
@@ -336,6 +521,7 @@ def render_sidebar():
             if st.button("💬 Chatbot", use_container_width=True): nav("chatbot")
 
         st.markdown("---")
+        render_timings()
         st.markdown("<small>NSITN v2.0 · Hackathon Edition</small>", unsafe_allow_html=True)
 
 
@@ -351,7 +537,7 @@ def page_home():
     </div>
     """, unsafe_allow_html=True)
 
-    stats = get_platform_stats()
+    stats = get_snapshot().stats
     c1, c2, c3, c4 = st.columns(4)
     metrics = [
         (c1, "✅ NGOs Verified", stats["total_ngos"]),
@@ -386,6 +572,10 @@ def page_home():
                 <div style="font-size:0.82rem;color:#718096">{desc}</div>
             </div>""", unsafe_allow_html=True)
 
+    user = st.session_state.user
+    if user and user["role"] == "donor":
+        render_recommendations(user, "💡 Recommended for You")
+
     st.markdown("---")
     if not st.session_state.user:
         c1, c2, c3 = st.columns([1,2,1])
@@ -427,7 +617,13 @@ def page_signup():
                 if not all([name, email, pwd]):
                     st.error("Please fill all fields.")
                 else:
-                    user, msg = create_user(name, email, pwd, role)
+                    # Validated first, so an incomplete form never spends a token
+                    allowed, msg = ratelimit.check("signup", session=session_id(), email=email)
+                    user = None
+                    if allowed:
+                        with ratelimit.admit("signup") as admitted:
+                            user, msg = (create_user(name, email, pwd, role) if admitted
+                                         else (None, ratelimit.BUSY_MSG))
                     if user:
                         if role == "ngo":
                             ngo, nmsg = register_ngo(
@@ -456,6 +652,20 @@ def page_signup():
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: LOGIN
 # ═══════════════════════════════════════════════════════════════════════════════
+def attempt_login(email, pwd):
+    """(user, "") or (None, message) — fields checked first, then the rate limit, then load."""
+    if not (email and pwd):
+        return None, "Please enter your email and password."
+    allowed, limit_msg = ratelimit.check("login", session=session_id(), email=email)
+    if not allowed:
+        return None, limit_msg
+    with ratelimit.admit("login") as admitted:
+        if not admitted:
+            return None, ratelimit.BUSY_MSG
+        user = authenticate(email, pwd)
+    return (user, "") if user else (None, "Invalid email or password.")
+
+
 def page_login():
     c1, c2, c3 = st.columns([1, 1.2, 1])
     with c2:
@@ -468,7 +678,7 @@ def page_login():
         pwd   = st.text_input("Password", type="password")
 
         if st.button("Login →", use_container_width=True):
-            user = authenticate(email, pwd)
+            user, msg = attempt_login(email, pwd)
             if user:
                 st.session_state.user = user
                 st.success(f"Welcome back, {user['name']}!")
@@ -476,7 +686,7 @@ def page_login():
                 dest = {"donor":"home","ngo":"ngo_dashboard","admin":"admin_panel"}.get(user["role"],"home")
                 nav(dest)
             else:
-                st.error("Invalid email or password.")
+                st.error(msg)
 
         if st.button("📝 Create Account", use_container_width=True):
             nav("signup")
@@ -485,9 +695,46 @@ def page_login():
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: BROWSE NGOs (Donor)
 # ═══════════════════════════════════════════════════════════════════════════════
+def ngo_state(n, version):
+    """
+    Card version: the NGO's row version (from ngo_versions(), one query per page)
+    plus the fields a scoring run rewrites without bumping it. Both come from
+    the row being rendered, so every replica rebuilds a re-scored card.
+    """
+    return (version, n.status, n.transparency_score, n.risk_percent, n.outcome_accuracy, n.trust_dna)
+
+
+def ngo_card_html(n):
+    ts   = n.transparency_score
+    risk = n.risk_percent
+    sc   = score_color(ts)
+    rc   = risk_color(risk)
+    return f"""
+    <div class="card fade-in">
+        <div style="display:flex;justify-content:space-between;align-items:flex-start;flex-wrap:wrap;gap:10px">
+            <div>
+                <div style="font-size:1.15rem;font-weight:700;color:#2D3748">{n['name']}</div>
+                <div style="color:#718096;font-size:0.88rem;margin-top:2px">
+                    📍 {n['location']} &nbsp;|&nbsp; 🎯 {n['cause'].title()} &nbsp;|&nbsp; Est. {n['founded_year']}
+                </div>
+            </div>
+            <div style="text-align:right">
+                <span class="dna-badge">{n['trust_dna']}</span>
+            </div>
+        </div>
+        <div style="margin:12px 0 6px">
+            <span class="stat-chip {sc}">Transparency: {ts:.1f}%</span>
+            <span class="stat-chip {rc}">Risk: {risk:.1f}%</span>
+            <span class="stat-chip">Accuracy: {n['outcome_accuracy']}%</span>
+        </div>
+        <div style="font-size:0.88rem;color:#4A5568;margin-top:6px">{n['description'][:160]}{'...' if len(n.get('description',''))>160 else ''}</div>
+    </div>"""
+
+
 def page_browse_ngos():
     st.markdown('<div class="section-title">🔍 Browse Verified NGOs</div>', unsafe_allow_html=True)
-    ngos = get_approved_ngos()
+    snap = get_snapshot()
+    ngos = snap.ngos
 
     if not ngos:
         st.info("No approved NGOs yet. Check back soon!")
@@ -500,43 +747,43 @@ def page_browse_ngos():
     with c2:
         sort_by = st.selectbox("Sort by", ["Transparency Score ↓", "Risk % ↑", "Name A-Z"])
 
+    # Pre-sorted per snapshot version; search only filters, keeping the order
+    order = {"Transparency Score ↓": "transparency", "Risk % ↑": "risk"}.get(sort_by, "name")
+    ngos = snap.orders[order]
     if search:
         ngos = [n for n in ngos if search.lower() in n["name"].lower()
                 or search.lower() in n["cause"].lower()]
 
-    if sort_by == "Transparency Score ↓":
-        ngos = sorted(ngos, key=lambda x: float(x["transparency_score"]), reverse=True)
-    elif sort_by == "Risk % ↑":
-        ngos = sorted(ngos, key=lambda x: float(x["risk_percent"]))
-    else:
-        ngos = sorted(ngos, key=lambda x: x["name"])
+    # Facets — counts use last run's selections, held in the widgets' session keys.
+    # The index is built from this same snapshot, so counts and cards always agree.
+    index   = get_index(snap)
+    listed  = ["cause", "location", "founded", "trust_dna"]
+    filters = {f: st.session_state.get(f"facet_{f}", []) for f in listed}
+    for f in ("transparency", "risk"):
+        lo, hi = st.session_state.get(f"facet_{f}", (0, 100))
+        if (lo, hi) != (0, 100):
+            filters[f] = (lo, hi)       # exact closed range
+    counts = index.counts(filters)
+    with st.expander("🎛️ Filters"):
+        for col, f in zip(st.columns(len(listed)), listed):
+            with col:
+                options = sorted(set(counts[f]) | set(filters[f]))
+                st.multiselect(FACETS[f], options, key=f"facet_{f}",
+                               format_func=lambda v, f=f: f"{v[:1].upper() + v[1:]} ({counts[f].get(v, 0)})")
+        c1, c2 = st.columns(2)
+        with c1:
+            st.slider(FACETS["transparency"], 0, 100, (0, 100), step=10, key="facet_transparency")
+        with c2:
+            st.slider(FACETS["risk"], 0, 100, (0, 100), step=10, key="facet_risk")
+    if any(filters.values()):
+        mask = index.mask(filters)
+        ngos = [n for n in ngos if index.matches(mask, n.ngo_id)]
+        st.markdown(f"<small>{len(ngos)} NGO(s) match the selected filters</small>", unsafe_allow_html=True)
 
     for n in ngos:
-        ts   = float(n["transparency_score"])
-        risk = float(n["risk_percent"])
-        sc   = score_color(ts)
-        rc   = risk_color(risk)
-
-        st.markdown(f"""
-        <div class="card fade-in">
-            <div style="display:flex;justify-content:space-between;align-items:flex-start;flex-wrap:wrap;gap:10px">
-                <div>
-                    <div style="font-size:1.15rem;font-weight:700;color:#2D3748">{n['name']}</div>
-                    <div style="color:#718096;font-size:0.88rem;margin-top:2px">
-                        📍 {n['location']} &nbsp;|&nbsp; 🎯 {n['cause'].title()} &nbsp;|&nbsp; Est. {n['founded_year']}
-                    </div>
-                </div>
-                <div style="text-align:right">
-                    <span class="dna-badge">{n['trust_dna']}</span>
-                </div>
-            </div>
-            <div style="margin:12px 0 6px">
-                <span class="stat-chip {sc}">Transparency: {ts:.1f}%</span>
-                <span class="stat-chip {rc}">Risk: {risk:.1f}%</span>
-                <span class="stat-chip">Accuracy: {n['outcome_accuracy']}%</span>
-            </div>
-            <div style="font-size:0.88rem;color:#4A5568;margin-top:6px">{n['description'][:160]}{'...' if len(n.get('description',''))>160 else ''}</div>
-        </div>""", unsafe_allow_html=True)
+        # Snapshot rows are immutable, so the published version is the card's version
+        st.markdown(fragments.html("ngo_card", n.ngo_id, snap.published_at, lambda: ngo_card_html(n)),
+                    unsafe_allow_html=True)
 
         c1, c2, c3 = st.columns([2, 1, 1])
         with c2:
@@ -561,13 +808,18 @@ def page_ngo_detail():
     if not ngo_id:
         nav("browse_ngos")
         return
-    n = get_ngo_by_id(ngo_id)
+    # Approved NGOs come from the published snapshot; anything else is read live
+    record_view(ngo_id)
+    n = get_snapshot().by_id.get(ngo_id)
     if not n:
-        st.error("NGO not found.")
-        return
+        row = get_ngo_by_id(ngo_id)
+        if not row:
+            st.error("NGO not found.")
+            return
+        n = NGORecord.from_row(row)
 
-    ts   = float(n["transparency_score"])
-    risk = float(n["risk_percent"])
+    ts   = n.transparency_score
+    risk = n.risk_percent
 
     st.markdown(f"""
     <div class="card-accent fade-in">
@@ -591,16 +843,16 @@ def page_ngo_detail():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("**📊 Transparency Breakdown**")
         render_score_bar("Transparency Score",     ts)
-        render_score_bar("Allocation Efficiency",  float(n["allocation_efficiency"]))
-        render_score_bar("Outcome Accuracy",       float(n["outcome_accuracy"]))
-        render_score_bar("Timeliness",             float(n["timeliness_score"]))
-        render_score_bar("Donation Consistency",   float(n["donation_consistency"]))
+        render_score_bar("Allocation Efficiency",  n.allocation_efficiency)
+        render_score_bar("Outcome Accuracy",       n.outcome_accuracy)
+        render_score_bar("Timeliness",             n.timeliness_score)
+        render_score_bar("Donation Consistency",   n.donation_consistency)
         st.markdown("</div>", unsafe_allow_html=True)
 
     with c2:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("**📈 Impact Summary**")
-        impact = get_ngo_impact_summary(ngo_id)
+        impact = n.get("impact") or get_ngo_impact_summary(ngo_id)
         st.metric("Total Raised",       f"₹{impact['total_raised']:,.0f}")
         st.metric("Total Allocated",    f"₹{impact['total_allocated']:,.0f}")
         st.metric("Beneficiaries",      impact["total_beneficiaries"])
@@ -608,21 +860,14 @@ def page_ngo_detail():
         st.metric("Activities Run",     impact["num_activities"])
         st.markdown("</div>", unsafe_allow_html=True)
 
+    render_score_trend(ngo_id)
+
     # Impact Prediction
     st.markdown('<div class="section-title">🔮 Impact Prediction</div>', unsafe_allow_html=True)
-    st.markdown('<div class="card">', unsafe_allow_html=True)
-    pred_amt = st.number_input("Enter donation amount to predict impact (₹)", min_value=100, value=1000, step=100)
-    pred = predict_impact(ngo_id, pred_amt)
-    st.markdown(f"""
-    <div style="background:#EBF4FF;border-radius:10px;padding:16px;margin-top:8px">
-        <span style="font-size:1.1rem">💡 <b>₹{pred_amt:,.0f}</b> could support 
-        <b style="color:#6C63FF">{pred['predicted_beneficiaries']} beneficiaries</b> 
-        via <b>{pred['top_activity']}</b></span>
-    </div>""", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    impact_estimator(ngo_id)
 
     # Past outcomes
-    outcomes = get_outcomes_by_ngo(ngo_id)
+    outcomes = n["recent_outcomes"] if "recent_outcomes" in n else archive.recent(ngo_id, "outcomes", 8)
     if outcomes:
         st.markdown('<div class="section-title">📋 Past Outcomes</div>', unsafe_allow_html=True)
         rows = "".join([
@@ -646,6 +891,31 @@ def page_ngo_detail():
         nav("browse_ngos")
 
 
+@st.fragment
+@profiled
+def impact_estimator(ngo_id):
+    """Reruns alone when the amount changes — the NGO, summary and outcomes aren't re-fetched."""
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    pred_amt = st.number_input("Enter donation amount to predict impact (₹)", min_value=100, value=1000, step=100)
+    pred = predict_impact(ngo_id, pred_amt)
+    st.markdown(f"""
+    <div style="background:#EBF4FF;border-radius:10px;padding:16px;margin-top:8px">
+        <span style="font-size:1.1rem">💡 <b>₹{pred_amt:,.0f}</b> could support 
+        <b style="color:#6C63FF">{pred['predicted_beneficiaries']} beneficiaries</b> 
+        via <b>{pred['top_activity']}</b></span>
+    </div>""", unsafe_allow_html=True)
+    if forecast_available():                                 # numpy is optional — no band without it
+        fc = forecast(ngo_id, pred_amt, seed=int(pred_amt))     # seeded: same amount, same band
+        b, u = fc["beneficiaries"], fc["units"]
+        st.markdown(f"""
+        <div style="font-size:0.9rem;color:#4A5568;margin-top:8px">
+            📊 Across {fc['sims']:,} simulations: <b>{b['p10']}–{b['p90']} beneficiaries</b>
+            (median {b['p50']}) and {u['p10']}–{u['p90']} units delivered, 80% of the time
+            {'' if fc['has_history'] else '· <i>no outcome history yet — based on platform priors</i>'}
+        </div>""", unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: DONATE (Payment simulation)
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -657,10 +927,28 @@ def page_donate():
     ngo_id = st.session_state.get("donate_to")
     if not ngo_id:
         nav("browse_ngos"); return
-    ngo = get_ngo_by_id(ngo_id)
+    ngo = get_ngo_by_id(ngo_id)         # live, not the browse snapshot: it may be rejected since
     if not ngo:
         st.error("NGO not found."); return
+    if ngo["status"] != "approved" and st.session_state.payment_stage != "success":
+        st.error(NOT_ACCEPTING); return
+
+    donate_flow(user, ngo_id, NGORecord.from_row(ngo))
+
 
+NOT_ACCEPTING = "This NGO is not accepting donations right now."
+
+
+def accepting_donations(ngo_id):
+    """Live status check right before money moves — snapshots can be up to a TTL stale."""
+    row = get_ngo_by_id(ngo_id)
+    return bool(row) and row["status"] == "approved"
+
+
+@st.fragment
+@profiled
+def donate_flow(user, ngo_id, ngo):
+    """Payment stages advance with fragment reruns; the page around them stays put."""
     stage = st.session_state.payment_stage
 
     # ── STAGE 0: Form ────────────────────────────────────────────────────────
@@ -673,8 +961,8 @@ def page_donate():
         </div>""", unsafe_allow_html=True)
 
         # Show quick safety summary
-        ts = float(ngo["transparency_score"])
-        risk = float(ngo["risk_percent"])
+        ts = ngo.transparency_score
+        risk = ngo.risk_percent
         c1, c2, c3 = st.columns(3)
         c1.metric("Transparency", f"{ts:.1f}%")
         c2.metric("Risk", f"{risk:.1f}%")
@@ -685,13 +973,31 @@ def page_donate():
         upi    = st.text_input("📱 UPI ID", placeholder="yourname@upi")
         st.markdown("</div>", unsafe_allow_html=True)
 
+        guard  = payment_guard()
+        repeat = bool(upi) and guard.is_repeat(user["user_id"], ngo_id, amount, upi)
+        if repeat:
+            st.markdown('<div class="card-warning">⚠️ You just made an identical payment to this NGO. '
+                        'Only continue if you really mean to donate again.</div>', unsafe_allow_html=True)
+            confirm = st.checkbox("Yes, make another donation", key="confirm_repeat")
+
         if st.button("💳 PAY NOW", use_container_width=True):
             if not upi or "@" not in upi:
                 st.error("Please enter a valid UPI ID (e.g. name@upi)")
+            elif guard.velocity_exceeded(upi):
+                st.error("Too many payments from this UPI ID in the last few minutes. Please try again later.")
+            elif repeat and not confirm:
+                st.error("Please confirm the repeat donation above.")
+            elif not accepting_donations(ngo_id):
+                st.error(NOT_ACCEPTING)
             else:
-                st.session_state.payment_data  = {"amount": amount, "upi": upi}
-                st.session_state.payment_stage = "processing"
-                st.rerun()
+                allowed, limit_msg = ratelimit.check("donate", session=session_id(), upi=upi)
+                if not allowed:
+                    st.error(limit_msg)
+                else:
+                    st.session_state.payment_data  = {"amount": amount, "upi": upi,
+                                                      "key": uuid.uuid4().hex}
+                    st.session_state.payment_stage = "processing"
+                    st.rerun(scope="fragment")
 
     # ── STAGE 1: Processing spinner ──────────────────────────────────────────
     elif stage == "processing":
@@ -706,16 +1012,48 @@ def page_donate():
             prog.progress(i)
             time.sleep(0.018)
         st.session_state.payment_stage = "success"
-        st.rerun()
+        st.rerun(scope="fragment")
 
     # ── STAGE 2: Success ─────────────────────────────────────────────────────
     elif stage == "success":
         pd = st.session_state.payment_data
-        # Save to DB
-        donation = create_donation(user["user_id"], ngo_id, pd["amount"], pd["upi"])
-        receipt  = create_receipt(donation, user["name"], user["email"], ngo["name"])
-        # Run analysis to update scores
-        run_ngo_analysis(ngo_id)
+        # Save to DB — exactly once per idempotency key, even across reruns
+        if "receipt" in pd:
+            receipt = pd["receipt"]
+        else:
+            guard = payment_guard()
+            fresh, donation_id = guard.claim(pd["key"])
+            if fresh and not accepting_donations(ngo_id):
+                guard.release(pd["key"])    # nothing was recorded
+                st.session_state.payment_stage = None
+                st.error(NOT_ACCEPTING)
+                return
+            if fresh:
+                try:
+                    donation = create_donation(user["user_id"], ngo_id, pd["amount"], pd["upi"])
+                except Exception:
+                    guard.release(pd["key"])    # nothing was recorded
+                    raise
+                # From here the key maps to this donation — a retry must never create another
+                guard.record(pd["key"], donation["donation_id"], user["user_id"],
+                             ngo_id, pd["amount"], pd["upi"])
+                pd["donation"] = donation
+                # A repeat confirmation covers one payment, not the next identical one
+                st.session_state.pop("confirm_repeat", None)
+                # Run analysis to update scores
+                run_ngo_analysis(ngo_id)
+                receipt = create_receipt(donation, user["name"], user["email"], ngo["name"])
+            elif donation_id:
+                receipt = get_receipt_by_donation(donation_id)
+                if not receipt and "donation" in pd:
+                    # The donation was saved but its receipt write failed — retry the receipt alone
+                    receipt = create_receipt(pd["donation"], user["name"], user["email"], ngo["name"])
+            else:
+                receipt = None
+            if not receipt:
+                st.info("⏳ This payment is already being recorded…")
+                return
+            pd["receipt"] = receipt
 
         st.markdown("""
         <div style="text-align:center;padding:30px" class="fade-in">
@@ -733,29 +1071,7 @@ def page_donate():
 
         # Receipt
         st.markdown('<div class="section-title">🧾 Donation Receipt</div>', unsafe_allow_html=True)
-        receipt_text = f"""
-╔══════════════════════════════════════════════╗
-             NSITN — OFFICIAL RECEIPT           
-══════════════════════════════════════════════
-  Receipt ID   : {receipt['receipt_id']}
-  Donation ID  : {receipt['donation_id']}
-══════════════════════════════════════════════
-  Donor Name   : {receipt['donor_name']}
-  Donor Email  : {receipt['donor_email']}
-  UPI ID       : {receipt['upi_id']}
-══════════════════════════════════════════════
-  NGO Name     : {receipt['ngo_name']}
-  Amount       : ₹{float(receipt['amount']):,.2f}
-  Date/Time    : {receipt['donated_at']}
-══════════════════════════════════════════════
-  Trust DNA    : {ngo['trust_dna']}
-  Transparency : {ngo['transparency_score']}%
-  Risk         : {ngo['risk_percent']}%
-══════════════════════════════════════════════
-  Generated    : {receipt['generated_at']}
-  NSITN v2.0   — Powered by DOTE Engine
-╚══════════════════════════════════════════════╝
-""".strip()
+        receipt_text = render_receipt_text(receipt, ngo)
         st.markdown(f'<div class="receipt-box">{receipt_text}</div>', unsafe_allow_html=True)
 
         st.download_button(
@@ -775,42 +1091,50 @@ def page_donate():
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: MY DONATIONS (Donor)
 # ═══════════════════════════════════════════════════════════════════════════════
+def donation_card_html(d):
+    ngo = get_ngo_by_id(d["ngo_id"])
+    ngo_name = ngo["name"] if ngo else "Unknown NGO"
+    return f"""
+    <div class="card fade-in">
+        <div style="display:flex;justify-content:space-between;align-items:center;flex-wrap:wrap;gap:8px">
+            <div>
+                <div style="font-weight:700;font-size:1rem">{ngo_name}</div>
+                <div style="color:#718096;font-size:0.85rem">{d['donated_at']} · UPI: {d['upi_id']}</div>
+                <div style="font-size:0.8rem;color:#A0AEC0">ID: {d['donation_id']} · Receipt: {d['receipt_id']}</div>
+            </div>
+            <div style="font-size:1.5rem;font-weight:800;color:#6C63FF">₹{d.amount:,.0f}</div>
+        </div>
+    </div>"""
+
+
 def page_my_donations():
     user = st.session_state.user
     if not user:
         nav("login"); return
 
     st.markdown('<div class="section-title">💰 My Donations</div>', unsafe_allow_html=True)
-    donations = get_donations_by_donor(user["user_id"])
+    donations = DonationRecord.many(get_donations_by_donor(user["user_id"]))
 
     if not donations:
         st.info("You haven't made any donations yet.")
         if st.button("🔍 Browse NGOs"): nav("browse_ngos")
         return
 
-    total = sum(float(d["amount"]) for d in donations)
+    total = sum(d.amount for d in donations)
     st.markdown(f"""
     <div class="card-accent fade-in" style="padding:20px">
         <span style="font-size:1.4rem;font-weight:700">₹{total:,.0f}</span>
         <span style="opacity:0.85"> total donated across {len(donations)} donations</span>
     </div>""", unsafe_allow_html=True)
 
+    render_recommendations(user, "💡 NGOs Like the Ones You Support")
+
     for d in reversed(donations):
-        ngo = get_ngo_by_id(d["ngo_id"])
-        ngo_name = ngo["name"] if ngo else "Unknown NGO"
         receipt = get_receipt_by_donation(d["donation_id"])
 
-        st.markdown(f"""
-        <div class="card fade-in">
-            <div style="display:flex;justify-content:space-between;align-items:center;flex-wrap:wrap;gap:8px">
-                <div>
-                    <div style="font-weight:700;font-size:1rem">{ngo_name}</div>
-                    <div style="color:#718096;font-size:0.85rem">{d['donated_at']} · UPI: {d['upi_id']}</div>
-                    <div style="font-size:0.8rem;color:#A0AEC0">ID: {d['donation_id']} · Receipt: {d['receipt_id']}</div>
-                </div>
-                <div style="font-size:1.5rem;font-weight:800;color:#6C63FF">₹{float(d['amount']):,.0f}</div>
-            </div>
-        </div>""", unsafe_allow_html=True)
+        # Donation rows are append-only; only the receipt id is filled in later
+        st.markdown(fragments.html("donation_card", d.donation_id, d.receipt_id, lambda: donation_card_html(d)),
+                    unsafe_allow_html=True)
 
         if receipt:
             receipt_text = f"""
@@ -827,6 +1151,28 @@ Generated: {receipt['generated_at']}
                 key=f"dl_{d['donation_id']}"
             )
 
+        if st.button("🔐 Verify on public ledger", key=f"proof_{d['donation_id']}"):
+            render_ledger_proof(d)
+
+
+def render_ledger_proof(d):
+    proof = ledger.proof_for(d["donation_id"])
+    if not proof:
+        st.warning("This donation predates the public ledger, so no inclusion proof exists for it.")
+        return
+    recorded = proof["payload"]["row"]
+    unaltered = all(str(recorded.get(k)) == str(d[k])
+                    for k in ("donor_id", "ngo_id", "donated_at", "upi_id")) \
+        and float(recorded.get("amount", 0)) == d.amount
+    if ledger.verify_proof(proof) and unaltered:
+        st.success(f"✅ Entry #{proof['seq']} is included in the ledger of {proof['size']} entries "
+                   f"and matches your donation exactly.")
+    else:
+        st.error("🚨 The ledger entry does not match this donation — please contact support.")
+    st.code(f"leaf  {proof['leaf']}\nroot  {proof['root']}\n" +
+            "\n".join(f"path  {h}" for h in proof["path"]), language=None)
+    st.caption(f"Check it yourself: python -m utils.ledger proof {d['donation_id']}")
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: NGO DASHBOARD
@@ -843,8 +1189,10 @@ def page_ngo_dashboard():
         st.warning("NGO profile not found. Please register your NGO.")
         return
 
-    # Run fresh analysis
-    analysis = run_ngo_analysis(ngo["ngo_id"])
+    # Run fresh analysis — under load, serve the cached one for the current row version
+    with ratelimit.admit("analysis") as admitted:
+        analysis = (run_ngo_analysis(ngo["ngo_id"]) if admitted else
+                    cached_analysis(ngo["ngo_id"], ngo_version(ngo["ngo_id"])))
     ngo = get_ngo_by_id(ngo["ngo_id"])   # refresh
 
     status_color = {"approved":"#276749","pending":"#975A16","rejected":"#C53030"}
@@ -922,19 +1270,22 @@ def page_add_allocation():
                 unsafe_allow_html=True)
 
     # Show donations available to allocate
-    donations = get_donations_by_ngo(ngo["ngo_id"])
+    donations = DonationRecord.many(get_donations_by_ngo(ngo["ngo_id"]))
     if not donations:
         st.info("No donations received yet. Wait for donors to contribute.")
         return
 
+    render_bulk_import("allocations", ngo)
+
     st.markdown('<div class="card fade-in">', unsafe_allow_html=True)
-    don_options = {d["donation_id"]: f"₹{d['amount']} on {d['donated_at'][:10]}" for d in donations}
+    don_options = {d.donation_id: f"₹{d.amount:,.0f} on {d.donated_at[:10]}" for d in donations}
     sel_don_id  = st.selectbox("Link to Donation", list(don_options.keys()),
                                format_func=lambda x: don_options[x])
 
     activity = st.selectbox("Activity Type", list(UNIT_COST_DEFAULTS.keys()),
                             format_func=str.title)
-    default_cost = UNIT_COST_DEFAULTS.get(activity, 100)
+    peers, n_peers = cost_sketch.peer_quantiles(activity, ngo["location"])
+    default_cost = int(round(peers[0.5])) if peers else UNIT_COST_DEFAULTS.get(activity, 100)
 
     c1, c2 = st.columns(2)
     with c1:
@@ -942,6 +1293,12 @@ def page_add_allocation():
     with c2:
         units_planned = st.number_input("Units Planned", min_value=1, value=100)
 
+    pct, _ = cost_sketch.percentile(activity, unit_cost, ngo["location"])
+    if pct is not None:
+        flag = "🚨" if not cost_sketch.OUTLIER_LOW <= pct <= cost_sketch.OUTLIER_HIGH else "📊"
+        st.caption(f"{flag} ₹{unit_cost:,} is at the {pct:.0f}th percentile of {n_peers} peer "
+                   f"{activity} allocations (peer range ₹{peers[0.1]:,.0f}–₹{peers[0.9]:,.0f})")
+
     total_cost = unit_cost * units_planned
     st.markdown(f"""
     <div class="card-success" style="margin-top:10px">
@@ -979,33 +1336,35 @@ def page_record_outcome():
 
     st.markdown('<div class="section-title">📊 Record Activity Outcome</div>', unsafe_allow_html=True)
 
-    allocations = get_allocations_by_ngo(ngo["ngo_id"])
+    allocations = AllocationRecord.many(get_allocations_by_ngo(ngo["ngo_id"]))
     if not allocations:
         st.info("No allocations found. Add allocations first.")
         return
 
+    render_bulk_import("outcomes", ngo)
+
     st.markdown('<div class="card fade-in">', unsafe_allow_html=True)
     alloc_options = {
-        a["alloc_id"]: f"{a['activity_type'].title()} — {a['units_planned']} units (₹{a['total_cost']})"
+        a.alloc_id: f"{a.activity_type.title()} — {a.units_planned} units (₹{a.total_cost:,.0f})"
         for a in allocations
     }
     sel_alloc_id = st.selectbox("Select Allocation", list(alloc_options.keys()),
                                 format_func=lambda x: alloc_options[x])
 
-    alloc = next(a for a in allocations if a["alloc_id"] == sel_alloc_id)
+    alloc = next(a for a in allocations if a.alloc_id == sel_alloc_id)
     st.markdown(f"""
     <div class="card-warning">
-        📋 Planned: <b>{alloc['units_planned']} {alloc['activity_type']}s</b>
-        &nbsp;|&nbsp; Unit cost: ₹{alloc['unit_cost']}
-        &nbsp;|&nbsp; Total budget: ₹{alloc['total_cost']}
+        📋 Planned: <b>{alloc.units_planned} {alloc.activity_type}s</b>
+        &nbsp;|&nbsp; Unit cost: ₹{alloc.unit_cost:,.0f}
+        &nbsp;|&nbsp; Total budget: ₹{alloc.total_cost:,.0f}
     </div>""", unsafe_allow_html=True)
 
     actual_units = st.number_input("Actual Units Delivered", min_value=0,
-                                   max_value=int(float(alloc["units_planned"])) * 2,
-                                   value=int(float(alloc["units_planned"])))
+                                   max_value=alloc.units_planned * 2,
+                                   value=alloc.units_planned)
     beneficiaries = st.number_input("Beneficiaries Reached", min_value=0, value=max(1, actual_units // 3))
 
-    planned = float(alloc["units_planned"])
+    planned = alloc.units_planned
     accuracy = min((actual_units / planned * 100) if planned > 0 else 0, 100)
     acc_color = "#276749" if accuracy >= 70 else ("#975A16" if accuracy >= 50 else "#C53030")
     st.markdown(f"""
@@ -1047,15 +1406,20 @@ def page_ngo_analytics():
     c3.metric("Beneficiaries",   impact["total_beneficiaries"])
     c4.metric("Avg Accuracy",    f"{impact['avg_outcome_accuracy']}%")
 
+    render_score_trend(ngo["ngo_id"])
+
     # Allocations table
     allocations = get_allocations_by_ngo(ngo["ngo_id"])
     if allocations:
         st.markdown('<div class="section-title">📁 Allocations (DOTE)</div>', unsafe_allow_html=True)
+        overdue = deadlines.overdue_allocations(ngo["ngo_id"])
+        if overdue:
+            st.warning(f"⏰ {len(overdue)} allocation(s) are past their due date with no outcome recorded.")
         rows = "".join([
             f"<tr><td>{a['alloc_id']}</td><td>{a['activity_type'].title()}</td>"
             f"<td>₹{a['unit_cost']}</td><td>{a['units_planned']}</td>"
             f"<td>{a['units_delivered']}</td><td>₹{a['total_cost']}</td>"
-            f"<td>{a['outcome_date']}</td></tr>"
+            f"<td>{a['outcome_date']}{' ⏰' if a['alloc_id'] in overdue else ''}</td></tr>"
             for a in allocations
         ])
         st.markdown(f"""
@@ -1082,6 +1446,37 @@ def page_ngo_analytics():
             {rows}
         </table>""", unsafe_allow_html=True)
 
+    render_archive(ngo["ngo_id"])
+
+
+def render_archive(ngo_id):
+    """Closed financial years: lifetime totals from segment summaries, rows on demand for audits."""
+    segs = archive.segments(ngo_id)
+    if not segs:
+        return
+    life = archive.lifetime(ngo_id)
+    with st.expander(f"🗄️ Archived financial years ({', '.join(life['archived_years'])})"):
+        st.caption(f"Lifetime: {life['donations']} donations · ₹{life['total_raised']:,.0f} raised · "
+                   f"{life['outcomes']} outcomes · {life['beneficiaries']:,} beneficiaries · "
+                   f"{life['avg_accuracy']}% avg accuracy. Tables above show the current years only.")
+        rows = "".join(
+            f"<tr><td>{s['fy']}</td><td>{s['table'].title()}</td><td>{s['rows']}</td>"
+            f"<td>{'₹{:,.0f}'.format(s['summary']['amount']) if s['table'] == 'donations' else s['summary']['beneficiaries']}</td>"
+            f"<td><code>{s['digest'][:12]}</code></td></tr>"
+            for s in segs)
+        st.markdown(f"""
+        <table class="custom-table">
+            <tr><th>Year</th><th>Table</th><th>Rows</th><th>Amount / Beneficiaries</th><th>Digest</th></tr>
+            {rows}
+        </table>""", unsafe_allow_html=True)
+        c1, c2 = st.columns(2)
+        fy    = c1.selectbox("Year", life["archived_years"], key="archive_fy")
+        table = c2.selectbox("Table", archive.TIERED, format_func=str.title, key="archive_table")
+        if st.button("📂 Load for audit", key="archive_load"):
+            st.download_button("⬇️ Download JSON lines",
+                               data="\n".join(json.dumps(r, ensure_ascii=False) for r in archive.scan(ngo_id, table, fy)),
+                               file_name=f"{ngo_id}-{fy}-{table}.jsonl", mime="application/json")
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: ADMIN PANEL
@@ -1097,80 +1492,183 @@ def page_admin_panel():
         <div style="opacity:0.85">Review NGOs before they go public to donors</div>
     </div>""", unsafe_allow_html=True)
 
+    # Writes a durable sink (ledger, change feed, partitions) refused are queued, not lost — say so
+    parked = parked_writes()
+    if parked:
+        st.error(f"🚨 {parked} write(s) have not reached the ledger / change feed / partitions yet. "
+                 "They are retried on every write; run `python -m utils.store replay` once the cause is fixed.")
+
     pending = get_pending_ngos()
     if not pending:
         st.success("✅ No pending NGOs. All caught up!")
     else:
         st.markdown(f'<div class="section-title">⏳ Pending NGOs ({len(pending)})</div>',
                     unsafe_allow_html=True)
+        versions = ngo_versions(n["ngo_id"] for n in pending)
+        scored = []
         for n in pending:
-            analysis = run_ngo_analysis(n["ngo_id"])
-            n = get_ngo_by_id(n["ngo_id"])   # refresh scores
+            analysis = cached_analysis(n["ngo_id"], versions[n["ngo_id"]])
+            scored.append((NGORecord.from_row(get_ngo_by_id(n["ngo_id"])), analysis))   # refresh scores
 
-            ts   = float(n["transparency_score"])
-            risk = float(n["risk_percent"])
+        render_bulk_decisions([n for n, _ in scored])
+        for n, analysis in scored:
+            admin_card(n, analysis, versions[n.ngo_id])
 
-            st.markdown(f"""
-            <div class="card fade-in">
-                <div style="font-size:1.1rem;font-weight:700">{n['name']}</div>
-                <div style="color:#718096;font-size:0.85rem;margin-bottom:10px">
-                    {n['cause'].title()} · {n['location']} · Reg: {n['registration_number']}
-                </div>
-                <span class="stat-chip {score_color(ts)}">Transparency: {ts:.1f}%</span>
-                <span class="stat-chip {risk_color(risk)}">Risk: {risk:.1f}%</span>
-                <span class="dna-badge" style="font-size:0.8rem;padding:4px 12px">{n['trust_dna']}</span>
-                <span class="stat-chip">Outcome Acc: {n['outcome_accuracy']}%</span>
-                <div style="margin-top:10px;font-size:0.88rem;color:#4A5568">{n['description'][:200]}</div>
-            </div>""", unsafe_allow_html=True)
+    render_session_memory()
 
-            if analysis["anomalies"]:
-                for a in analysis["anomalies"]:
-                    st.markdown(f'<div class="card-warning">{a.get("flag","⚠️ Anomaly")}</div>',
-                                unsafe_allow_html=True)
-
-            note = st.text_input(f"Admin note (optional)", key=f"note_{n['ngo_id']}")
-            c1, c2, c3 = st.columns([1, 1, 2])
-            with c1:
-                if st.button(f"✅ Approve", key=f"app_{n['ngo_id']}", use_container_width=True):
-                    admin_decision(n["ngo_id"], "approved", note)
-                    st.success(f"✅ {n['name']} approved!")
-                    st.rerun()
-            with c2:
-                if st.button(f"❌ Reject", key=f"rej_{n['ngo_id']}", use_container_width=True):
-                    admin_decision(n["ngo_id"], "rejected", note or "Did not meet transparency standards.")
-                    st.warning(f"❌ {n['name']} rejected.")
-                    st.rerun()
-            st.markdown("---")
+
+def render_session_memory():
+    mem = session_registry().summary()
+    with st.expander(f"🧠 Session memory — {mem['total_kb']:,.0f} KB across {mem['sessions']} session(s)"):
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Sessions", mem["sessions"])
+        c2.metric("Total KB", f"{mem['total_kb']:,.1f}")
+        c3.metric("Spilled to disk", mem["spilled"])
+        warm = cache_warmer().status
+        frag = fragments.stats()
+        st.caption(f"Boot cache warm: {warm['state']} — {warm['warmed']} steps, "
+                   f"{warm['errors']} errors, {warm['seconds']}s · HTML fragments: {frag['fragments']} cached, "
+                   f"{frag['hits']} hits / {frag['misses']} misses")
+        rows = "".join(
+            f"<tr><td>{r['session']}</td><td>{r['user']}</td><td>{r['kb']:,.1f}</td>"
+            f"<td>{r['idle_s']}s</td><td>{'💾' if r['spilled'] else ''}</td></tr>"
+            for r in mem["rows"][:20]
+        )
+        st.markdown(f"""
+        <table class="custom-table">
+            <tr><th>Session</th><th>User</th><th>KB</th><th>Idle</th><th>Spilled</th></tr>
+            {rows}
+        </table>""", unsafe_allow_html=True)
+
+
+def render_bulk_decisions(pending):
+    """Multi-select or score rule → one admin_decisions() call."""
+    by_id = {n["ngo_id"]: n for n in pending}
+    with st.expander("⚡ Bulk decisions"):
+        mode = st.radio("Select NGOs by", ["Pick from list", "Score rule"], horizontal=True, key="bulk_mode")
+        if mode == "Pick from list":
+            chosen = st.multiselect("NGOs", list(by_id), format_func=lambda i: by_id[i]["name"], key="bulk_pick")
+        else:
+            c1, c2 = st.columns(2)
+            min_ts   = c1.number_input("Transparency ≥", 0.0, 100.0, 70.0, step=5.0, key="bulk_ts")
+            max_risk = c2.number_input("Risk <",         0.0, 100.0, 30.0, step=5.0, key="bulk_risk")
+            chosen = [i for i, n in by_id.items()
+                      if n.transparency_score >= min_ts and n.risk_percent < max_risk]
+            st.markdown(f"**{len(chosen)}** of {len(by_id)} pending NGOs match: "
+                        + ", ".join(by_id[i]["name"] for i in chosen[:10])
+                        + (" …" if len(chosen) > 10 else ""))
+
+        c1, c2 = st.columns([1, 2])
+        status = c1.selectbox("Decision", ["approved", "rejected"], key="bulk_status",
+                              format_func=lambda x: {"approved": "✅ Approve", "rejected": "❌ Reject"}[x])
+        note   = c2.text_input("Admin note (optional)", key="bulk_note")
+        if st.button(f"Apply to {len(chosen)} NGO(s)", disabled=not chosen,
+                     use_container_width=True, key="bulk_apply"):
+            if status == "rejected" and not note:
+                note = "Did not meet transparency standards."
+            count, msg = admin_decisions([(i, status, note) for i in chosen])
+            if msg:
+                st.error(msg)
+            else:
+                st.success(f"{count} NGO(s) {status}.")
+                st.rerun()
+
+
+def admin_card_html(n):
+    ts   = n.transparency_score
+    risk = n.risk_percent
+    return f"""
+    <div class="card fade-in">
+        <div style="font-size:1.1rem;font-weight:700">{n['name']}</div>
+        <div style="color:#718096;font-size:0.85rem;margin-bottom:10px">
+            {n['cause'].title()} · {n['location']} · Reg: {n['registration_number']}
+        </div>
+        <span class="stat-chip {score_color(ts)}">Transparency: {ts:.1f}%</span>
+        <span class="stat-chip {risk_color(risk)}">Risk: {risk:.1f}%</span>
+        <span class="dna-badge" style="font-size:0.8rem;padding:4px 12px">{n['trust_dna']}</span>
+        <span class="stat-chip">Outcome Acc: {n['outcome_accuracy']}%</span>
+        <div style="margin-top:10px;font-size:0.88rem;color:#4A5568">{n['description'][:200]}</div>
+    </div>"""
+
+
+@st.fragment
+@profiled
+def admin_card(n, analysis, version):
+    """One pending NGO. Typing a note reruns only this card; a decision reruns the page."""
+    session_registry().seen(session_id())
+    st.markdown(fragments.html("admin_card", n.ngo_id, ngo_state(n, version), lambda: admin_card_html(n)),
+                unsafe_allow_html=True)
+
+    anomalies = analysis["anomalies"] + cost_sketch.anomalies(n["ngo_id"])
+    if anomalies:
+        for a in anomalies:
+            st.markdown(f'<div class="card-warning">{a.get("flag","⚠️ Anomaly")}</div>',
+                        unsafe_allow_html=True)
+
+    # Decide against the version the admin was looking at, not the latest
+    vkey = f"seen_ver_{n['ngo_id']}"
+    if vkey not in st.session_state:    # first render only — reruns keep the version shown
+        st.session_state[vkey] = version
+    seen = st.session_state[vkey]
+
+    note = st.text_input(f"Admin note (optional)", key=f"note_{n['ngo_id']}")
+    c1, c2, c3 = st.columns([1, 1, 2])
+    with c1:
+        if st.button(f"✅ Approve", key=f"app_{n['ngo_id']}", use_container_width=True):
+            ok, msg = admin_decision_if_unchanged(n["ngo_id"], seen, "approved", note)
+            st.session_state.pop(vkey, None)
+            if msg:
+                st.error(msg)               # no rerun: the refusal must stay on screen
+            else:
+                st.success(f"✅ {n['name']} approved!")
+                st.rerun()
+    with c2:
+        if st.button(f"❌ Reject", key=f"rej_{n['ngo_id']}", use_container_width=True):
+            ok, msg = admin_decision_if_unchanged(n["ngo_id"], seen, "rejected",
+                                                  note or "Did not meet transparency standards.")
+            st.session_state.pop(vkey, None)
+            if msg:
+                st.error(msg)               # no rerun: the refusal must stay on screen
+            else:
+                st.warning(f"❌ {n['name']} rejected.")
+                st.rerun()
+    st.markdown("---")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: ALL NGOs (Admin)
 # ═══════════════════════════════════════════════════════════════════════════════
+def ngo_row_html(n):
+    status_bg = {"approved":"#F0FFF4","pending":"#FFFBEA","rejected":"#FFF5F5"}.get(n["status"],"#F7FAFC")
+    return f"""
+    <div class="card fade-in" style="background:{status_bg}">
+        <div style="display:flex;justify-content:space-between;flex-wrap:wrap;gap:8px">
+            <div>
+                <b>{n['name']}</b> · {n['cause'].title()} · {n['location']}<br>
+                <span class="stat-chip {score_color(n['transparency_score'])}">T: {n['transparency_score']}%</span>
+                <span class="stat-chip {risk_color(n['risk_percent'])}">R: {n['risk_percent']}%</span>
+                <span class="dna-badge" style="font-size:0.75rem;padding:3px 10px">{n['trust_dna']}</span>
+            </div>
+            <div>
+                <span style="font-weight:700;color:{'#276749' if n['status']=='approved' else '#C53030' if n['status']=='rejected' else '#975A16'}">
+                    {n['status'].upper()}
+                </span>
+            </div>
+        </div>
+    </div>"""
+
+
 def page_all_ngos():
     user = st.session_state.user
     if not user or user["role"] != "admin":
         nav("login"); return
 
     st.markdown('<div class="section-title">🏢 All NGOs</div>', unsafe_allow_html=True)
-    ngos = get_all_ngos()
+    ngos = NGORecord.many(get_all_ngos())
+    versions = ngo_versions(n.ngo_id for n in ngos)
     for n in ngos:
-        status_bg = {"approved":"#F0FFF4","pending":"#FFFBEA","rejected":"#FFF5F5"}.get(n["status"],"#F7FAFC")
-        st.markdown(f"""
-        <div class="card fade-in" style="background:{status_bg}">
-            <div style="display:flex;justify-content:space-between;flex-wrap:wrap;gap:8px">
-                <div>
-                    <b>{n['name']}</b> · {n['cause'].title()} · {n['location']}<br>
-                    <span class="stat-chip {score_color(n['transparency_score'])}">T: {n['transparency_score']}%</span>
-                    <span class="stat-chip {risk_color(n['risk_percent'])}">R: {n['risk_percent']}%</span>
-                    <span class="dna-badge" style="font-size:0.75rem;padding:3px 10px">{n['trust_dna']}</span>
-                </div>
-                <div>
-                    <span style="font-weight:700;color:{'#276749' if n['status']=='approved' else '#C53030' if n['status']=='rejected' else '#975A16'}">
-                        {n['status'].upper()}
-                    </span>
-                </div>
-            </div>
-        </div>""", unsafe_allow_html=True)
+        st.markdown(fragments.html("ngo_row", n.ngo_id, ngo_state(n, versions[n.ngo_id]), lambda: ngo_row_html(n)),
+                    unsafe_allow_html=True)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -1190,7 +1688,7 @@ def page_platform_stats():
     c3.metric("Total Raised",     f"₹{s['total_raised']:,.0f}")
     c4.metric("Beneficiaries",    s["total_beneficiaries"])
 
-    all_ngos = get_all_ngos()
+    all_ngos = NGORecord.many(get_all_ngos())
     approved = sum(1 for n in all_ngos if n["status"] == "approved")
     pending  = sum(1 for n in all_ngos if n["status"] == "pending")
     rejected = sum(1 for n in all_ngos if n["status"] == "rejected")
@@ -1203,10 +1701,9 @@ def page_platform_stats():
 
     if approved > 0:
         st.markdown('<div class="section-title">Top NGOs by Transparency</div>', unsafe_allow_html=True)
-        top = sorted(
-            [n for n in all_ngos if n["status"] == "approved"],
-            key=lambda x: float(x["transparency_score"]), reverse=True
-        )[:5]
+        board = st.selectbox("Leaderboard", leaderboard.boards(),
+                             format_func=lambda b: b.replace(":", " · ").title())
+        top = leaderboard.top(board, 5)
         rows = "".join([
             f"<tr><td>{n['name']}</td><td>{n['transparency_score']}%</td>"
             f"<td>{n['risk_percent']}%</td><td>{n['trust_dna']}</td></tr>"
@@ -1229,6 +1726,25 @@ def page_chatbot():
         <div style="opacity:0.85">Ask me anything about NGOs, transparency, donations & more</div>
     </div>""", unsafe_allow_html=True)
 
+    chat_panel()
+
+
+def chat_reply(message, history=None):
+    """chat() behind the per-session limit; shed first when the server is busy."""
+    allowed, limit_msg = ratelimit.check("chat", session=session_id())
+    if not allowed:
+        return f"⏳ {limit_msg}"
+    with ratelimit.admit("chat") as admitted:
+        if not admitted:
+            return "⏳ I'm handling a lot of questions right now — please ask again in a moment."
+        return chat(message, history) if history is not None else chat(message)
+
+
+@st.fragment
+@profiled
+def chat_panel():
+    """Prompts, history and input rerun together without redrawing the page."""
+    session_registry().touch(session_id(), st.session_state)   # also restores a spilled history
     # Quick prompts
     st.markdown("**Quick questions:**")
     quick = [
@@ -1240,8 +1756,8 @@ def page_chatbot():
     for i, q in enumerate(quick):
         with cols[i % 3]:
             if st.button(q, key=f"qp_{i}", use_container_width=True):
-                st.session_state.chat_history.append((q, chat(q)))
-                st.rerun()
+                append_chat(st.session_state.chat_history, (q, chat_reply(q)))
+                st.rerun(scope="fragment")
 
     # Chat display
     st.markdown("---")
@@ -1258,19 +1774,23 @@ def page_chatbot():
             submit = st.form_submit_button("Send →", use_container_width=True)
 
     if submit and user_input.strip():
-        response = chat(user_input, st.session_state.chat_history)
-        st.session_state.chat_history.append((user_input, response))
-        st.rerun()
+        response = chat_reply(user_input, st.session_state.chat_history)
+        append_chat(st.session_state.chat_history, (user_input, response))
+        st.rerun(scope="fragment")
 
     if st.button("🗑️ Clear Chat"):
         st.session_state.chat_history = []
-        st.rerun()
+        st.rerun(scope="fragment")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # ROUTER
 # ═══════════════════════════════════════════════════════════════════════════════
+@profiled
 def main():
+    # Off the chat page the history is spilled to disk; chat_panel's touch() reads it back
+    session_registry().touch(session_id(), st.session_state,
+                             chat_visible=st.session_state.get("page") == "chatbot")
     render_sidebar()
     page = st.session_state.page
 
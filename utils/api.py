@@ -0,0 +1,320 @@
+"""
+utils/api.py — NSITN v2.0
+Headless JSON API beside the Streamlit UI, for partner portals.
+
+    GET /api/ngos?q=&cause=&location=&order=transparency|risk|name&limit=&cursor=
+    GET /api/ngos/<ngo_id>                 detail + score breakdown + impact
+    GET /api/ngos/<ngo_id>/predict?amount=
+    GET /api/stats
+
+Reads come from the published browse snapshot (approved NGOs only) and
+utils.ai_engine. Every response carries an ETag built from data versions
+(snapshot published_at, the NGO's row version), computed *before* the body,
+so If-None-Match answers 304 without serialising anything. Bodies over
+GZIP_MIN bytes are gzipped for clients that accept it; those clients get
+their own "-gzip" ETag, so a cache never mixes up the two encodings.
+Listing uses keyset cursors (sort key + ngo_id), so pages stay stable while
+scores move.
+
+    python -m utils.api serve --port 8600
+    python -m utils.api bench --requests 2000 --concurrency 8
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from utils.store import ngo_version
+
+API_PORT  = int(os.environ.get("NSITN_API_PORT", "8600"))
+GZIP_MIN  = 1024
+PAGE_MAX  = 100
+
+SCORE_FIELDS = ("transparency_score", "risk_percent", "allocation_efficiency",
+                "outcome_accuracy", "timeliness_score", "donation_consistency")
+LIST_FIELDS  = ("ngo_id", "name", "cause", "location", "trust_dna",
+                "transparency_score", "risk_percent")
+
+ORDER_KEYS = {
+    "transparency": lambda n: (-n.transparency_score, n.ngo_id),
+    "risk":         lambda n: (n.risk_percent, n.ngo_id),
+    "name":         lambda n: (n.name.lower(), n.ngo_id),
+}
+# order → types of its sort key, so a forged cursor is a 400, not a failed comparison
+CURSOR_TYPES = {
+    "transparency": ((int, float), str),
+    "risk":         ((int, float), str),
+    "name":         (str, str),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _etag(*parts):
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def _gzip_etag(etag):
+    return etag[:-1] + '-gzip"'
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor, types):
+    try:
+        key = tuple(json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))))
+    except (ValueError, TypeError):
+        raise ApiError(400, "invalid cursor")
+    if len(key) != len(types) or any(isinstance(v, bool) or not isinstance(v, t)
+                                     for v, t in zip(key, types)):
+        raise ApiError(400, "invalid cursor")
+    return key
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ENDPOINTS — each returns (etag, build) so a 304 never calls build()
+# ═══════════════════════════════════════════════════════════════════════════════
+def list_ngos(snap, params):
+    order = params.get("order", "transparency")
+    if order not in ORDER_KEYS:
+        raise ApiError(400, f"order must be one of {', '.join(ORDER_KEYS)}")
+    try:
+        limit = min(max(int(params.get("limit", 20)), 1), PAGE_MAX)
+    except ValueError:
+        raise ApiError(400, "limit must be an integer")
+    after = _decode_cursor(params["cursor"], CURSOR_TYPES[order]) if params.get("cursor") else None
+    etag = _etag("ngos", snap.published_at, sorted(params.items()))
+
+    def build():
+        q, cause, location = (params.get(k, "").strip().lower() for k in ("q", "cause", "location"))
+        rows = [n for n in snap.orders[order]
+                if (not q or q in n.name.lower() or q in n.cause.lower())
+                and (not cause or n.cause.strip().lower() == cause)
+                and (not location or n.location.strip().lower() == location)]
+        key = ORDER_KEYS[order]
+        rows.sort(key=key)              # snapshot order plus ngo_id tie-break
+        start = 0
+        if after is not None:
+            start = bisect_right([key(n) for n in rows], after)
+        page = rows[start:start + limit]
+        more = start + limit < len(rows)
+        return {"items": [{f: n[f] for f in LIST_FIELDS} for n in page], "total": len(rows),
+                "next_cursor": _encode_cursor(key(page[-1])) if more and page else None,
+                "published_at": snap.published_at}
+    return etag, build
+
+
+def ngo_detail(snap, ngo_id):
+    n = snap.by_id.get(ngo_id)
+    if not n:
+        raise ApiError(404, f"NGO {ngo_id} not found")
+    etag = _etag("ngo", ngo_id, snap.published_at, ngo_version(ngo_id))
+
+    def build():
+        d = {f: n[f] for f in ("ngo_id", "name", "cause", "location", "founded_year",
+                               "description", "trust_dna", "status")}
+        d["breakdown"] = {f: n[f] for f in SCORE_FIELDS}
+        d["impact"] = n.get("impact") or {}
+        d["recent_outcomes"] = n.get("recent_outcomes") or []
+        return d
+    return etag, build
+
+
+def predict(snap, ngo_id, params):
+    from utils.ai_engine import predict_impact
+
+    if ngo_id not in snap.by_id:
+        raise ApiError(404, f"NGO {ngo_id} not found")
+    try:
+        amount = float(params.get("amount", 1000))
+    except ValueError:
+        raise ApiError(400, "amount must be a number")
+    if not math.isfinite(amount):       # float() accepts "nan" and "inf"
+        raise ApiError(400, "amount must be a number")
+    if amount <= 0:
+        raise ApiError(400, "amount must be positive")
+    etag = _etag("predict", ngo_id, amount, snap.published_at, ngo_version(ngo_id))
+    return etag, lambda: {"ngo_id": ngo_id, "amount": amount, **predict_impact(ngo_id, amount)}
+
+
+def stats(snap):
+    return _etag("stats", snap.published_at), lambda: snap.stats
+
+
+def route(path, params):
+    from utils.snapshot import get_snapshot
+
+    parts = [p for p in path.split("/") if p]
+    if not parts or parts[0] != "api":
+        raise ApiError(404, "not found")
+    snap = get_snapshot()
+    if parts[1:] == ["ngos"]:
+        return list_ngos(snap, params)
+    if len(parts) == 3 and parts[1] == "ngos":
+        return ngo_detail(snap, parts[2])
+    if len(parts) == 4 and parts[1] == "ngos" and parts[3] == "predict":
+        return predict(snap, parts[2], params)
+    if parts[1:] == ["stats"]:
+        return stats(snap)
+    raise ApiError(404, "not found")
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# HTTP
+# ═══════════════════════════════════════════════════════════════════════════════
+class Handler(BaseHTTPRequestHandler):
+    server_version = "NSITN-API/2.0"
+    protocol_version = "HTTP/1.1"       # keep-alive for partner polling
+    disable_nagle_algorithm = True      # headers and body go out as separate writes
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            etag, build = route(url.path, params)
+        except ApiError as e:
+            return self._send(e.status, {"error": str(e)})
+        except Exception as e:
+            self.log_error("API failure on %s: %r", self.path, e)
+            return self._send(500, {"error": "internal error"})
+
+        if self._accepts_gzip():
+            etag = _gzip_etag(etag)
+        if etag in (t.strip() for t in self.headers.get("If-None-Match", "").split(",")):
+            return self._send(304, None, etag)
+        try:
+            body = build()
+        except ApiError as e:
+            return self._send(e.status, {"error": str(e)})
+        except Exception as e:
+            self.log_error("API failure on %s: %r", self.path, e)
+            return self._send(500, {"error": "internal error"})
+        self._send(200, body, etag)
+
+    def _accepts_gzip(self):
+        return "gzip" in self.headers.get("Accept-Encoding", "")
+
+    def _send(self, status, body, etag=None):
+        data = b"" if body is None else json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        gz = len(data) >= GZIP_MIN and self._accepts_gzip()
+        if gz:
+            data = gzip.compress(data, compresslevel=5)
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")   # always revalidate, cheaply
+        self.send_header("Vary", "Accept-Encoding")
+        if status != 304:               # a 304 has no body, and no length of its own
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def log_message(self, fmt, *args):  # quiet by default; errors still go to log_error
+        if os.environ.get("NSITN_API_LOG") == "1":
+            super().log_message(fmt, *args)
+
+
+def serve(host="127.0.0.1", port=API_PORT):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BENCHMARK — python -m utils.api bench
+# ═══════════════════════════════════════════════════════════════════════════════
+def bench(requests=2000, concurrency=8, url=None):
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = None
+    if url is None:
+        server = serve(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    host = urlsplit(url).netloc
+    paths = ["/api/ngos?limit=20", "/api/stats", "/api/ngos?order=risk&limit=50"]
+
+    def worker(args):
+        n, conditional = args
+        conn = http.client.HTTPConnection(host, timeout=30)
+        etags, codes = {}, {}
+        try:
+            for i in range(n):
+                path = paths[i % len(paths)]
+                headers = {"Accept-Encoding": "gzip"}
+                if conditional and path in etags:
+                    headers["If-None-Match"] = etags[path]
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                etags[path] = resp.getheader("ETag") or etags.get(path)
+                codes[resp.status] = codes.get(resp.status, 0) + 1
+        finally:
+            conn.close()
+        return codes
+
+    results = {}
+    try:
+        for label, conditional in (("full", False), ("conditional", True)):
+            per = max(requests // concurrency, 1)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                codes = {}
+                for c in pool.map(worker, [(per, conditional)] * concurrency):
+                    for k, v in c.items():
+                        codes[k] = codes.get(k, 0) + v
+            elapsed = time.perf_counter() - t0
+            results[label] = {"requests": per * concurrency, "seconds": round(elapsed, 2),
+                              "rps": round(per * concurrency / elapsed, 1), "status": codes}
+            print(f"{label:<12} {results[label]['rps']:>8} req/s  {codes}")
+    finally:
+        if server:
+            server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NSITN JSON API")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=API_PORT)
+    b = sub.add_parser("bench", help="throughput against a local (or --url) server")
+    b.add_argument("--requests", type=int, default=2000)
+    b.add_argument("--concurrency", type=int, default=8)
+    b.add_argument("--url")
+    args = parser.parse_args()
+
+    from utils.data_manager import init_storage
+    init_storage()
+    if args.cmd == "serve":
+        server = serve(args.host, args.port)
+        print(f"✅ NSITN API on http://{args.host}:{server.server_address[1]}/api/ngos")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        bench(args.requests, args.concurrency, args.url)
@@ -0,0 +1,440 @@
+"""
+utils/archive.py — NSITN v2.0
+Hot/cold tiering: closed financial years move out of the partitions into
+compressed, immutable archive segments.
+
+A financial year (April–March, "FY2024-25") is closed once GRACE_DAYS have
+passed since 31 March. tier() then seals each NGO's donations and outcomes
+from closed years into one segment per (NGO, year, table): the rows as
+zlib-compressed JSON lines, a SHA-256 digest, and a summary (counts, amounts,
+beneficiaries). Segments are never rewritten — rows that turn up later for a
+sealed year go into a new part. Donations that still have unallocated money
+stay hot until they are spent, so they can still be linked to allocations.
+
+After tiering, partitions.get_*_by_ngo() reads only the active tier,
+lifetime() adds the archived summaries to the hot totals without opening a
+segment, and scan()/find() read the archive in full for audits. Archived
+donations are indexed by donor, so donor-keyed reads
+(partitions.get_donations_by_donor) stay complete across both tiers, and
+archived outcomes by allocation, so archived_allocs() answers "which
+allocations already have an outcome" without opening a segment.
+
+    python -m utils.archive tier                # seal every closed year now
+    python -m utils.archive list <ngo_id>
+    python -m utils.archive verify              # recheck every segment digest
+    python -m utils.archive export <ngo_id> <FY2023-24> [donations|outcomes]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+
+from utils.store import DATA_DIR, lock, on_write
+from utils import partitions
+
+ARCHIVE_PATH = os.path.join(DATA_DIR, "archive.sqlite")
+GRACE_DAYS   = int(os.environ.get("NSITN_ARCHIVE_GRACE_DAYS", "90"))
+TIERED       = ("donations", "outcomes")
+log = logging.getLogger(__name__)
+_migrated = False
+
+
+def _db():
+    global _migrated
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(ARCHIVE_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS segments (ngo_id TEXT, fy TEXT, tbl TEXT, part INTEGER,
+                                             rows INTEGER, summary TEXT, digest TEXT, data BLOB,
+                                             sealed_at REAL, PRIMARY KEY (ngo_id, fy, tbl, part));
+        CREATE TABLE IF NOT EXISTS archived (tbl TEXT, key TEXT, ngo_id TEXT, fy TEXT, part INTEGER,
+                                             donor_id TEXT, alloc_id TEXT, PRIMARY KEY (tbl, key));
+        CREATE INDEX IF NOT EXISTS idx_archived_donor ON archived (donor_id);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    if not _migrated:
+        _add_alloc_ids(db)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_archived_ngo ON archived (ngo_id, tbl, alloc_id)")
+        _migrated = True
+    return db
+
+
+def _add_alloc_ids(db):
+    """Archives sealed before alloc_id was indexed: add the column and fill it from the outcome segments."""
+    if "alloc_id" in {r[1] for r in db.execute("PRAGMA table_info(archived)")}:
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-checked under the write lock: another process may have migrated meanwhile
+        if "alloc_id" not in {r[1] for r in db.execute("PRAGMA table_info(archived)")}:
+            db.execute("ALTER TABLE archived ADD COLUMN alloc_id TEXT")
+            for (blob,) in db.execute("SELECT data FROM segments WHERE tbl = 'outcomes'").fetchall():
+                db.executemany("UPDATE archived SET alloc_id = ? WHERE tbl = 'outcomes' AND key = ?",
+                               [(r.get("alloc_id"), str(r.get("outcome_id", ""))) for r in _decode(blob)])
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FINANCIAL YEARS
+# ═══════════════════════════════════════════════════════════════════════════════
+def fy_of(at):
+    """'2024-05-02T…' → 'FY2024-25'; None for an unparseable date."""
+    try:
+        y, m = int(str(at)[:4]), int(str(at)[5:7])
+    except ValueError:
+        return None
+    start = y if m >= 4 else y - 1
+    return f"FY{start}-{(start + 1) % 100:02d}"
+
+
+def open_from(today=None):
+    """First day of the oldest financial year that is still hot (ISO string)."""
+    today = today or date.today()
+    start = today.year if today.month >= 4 else today.year - 1
+    # The year before the current one stays open until its grace period has passed
+    if today < date(start, 3, 31) + timedelta(days=GRACE_DAYS):
+        start -= 1
+    return f"{start}-04-01"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SEGMENTS
+# ═══════════════════════════════════════════════════════════════════════════════
+def _float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def summarize(table, rows):
+    if table == "donations":
+        return {"rows": len(rows), "amount": round(sum(_float(r.get("amount")) for r in rows), 2),
+                "first": min(r.get("donated_at", "") for r in rows),
+                "last":  max(r.get("donated_at", "") for r in rows)}
+    return {"rows": len(rows),
+            "planned_units":  sum(int(_float(r.get("planned_units"))) for r in rows),
+            "actual_units":   sum(int(_float(r.get("actual_units"))) for r in rows),
+            "beneficiaries":  sum(int(_float(r.get("beneficiaries_reached"))) for r in rows),
+            "accuracy_sum":   round(sum(_float(r.get("outcome_accuracy")) for r in rows), 2)}
+
+
+def _encode(rows):
+    raw = "\n".join(json.dumps(r, sort_keys=True, default=str) for r in rows).encode()
+    return zlib.compress(raw, 9), hashlib.sha256(raw).hexdigest()
+
+
+def _decode(blob):
+    return [json.loads(line) for line in zlib.decompress(blob).decode().split("\n") if line]
+
+
+def _seal(db, ngo_id, fy, table, rows):
+    """Write one immutable segment inside the caller's transaction."""
+    key_field = partitions.TABLES[table][0]
+    part = db.execute("SELECT COALESCE(MAX(part) + 1, 0) FROM segments WHERE ngo_id = ? AND fy = ? AND tbl = ?",
+                      (ngo_id, fy, table)).fetchone()[0]
+    blob, digest = _encode(rows)
+    db.execute("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (ngo_id, fy, table, part, len(rows), json.dumps(summarize(table, rows)),
+                digest, blob, time.time()))
+    db.executemany("INSERT INTO archived VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   [(table, str(r.get(key_field, "")), ngo_id, fy, part, r.get("donor_id"), r.get("alloc_id"))
+                    for r in rows])
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TIERING
+# ═══════════════════════════════════════════════════════════════════════════════
+def _unspent(shard, ngo_id):
+    """donation_ids with money not yet allocated — these stay hot."""
+    spent = {}
+    for (row,) in shard.execute("SELECT row FROM allocations WHERE ngo_id = ?", (ngo_id,)):
+        a = json.loads(row)
+        spent[a.get("donation_id")] = spent.get(a.get("donation_id"), 0.0) + _float(a.get("total_cost"))
+    return {key for key, row in shard.execute("SELECT key, row FROM donations WHERE ngo_id = ?", (ngo_id,))
+            if spent.get(key, 0.0) + 0.5 < _float(json.loads(row).get("amount"))}
+
+
+def tier_ngo(ngo_id, cutoff=None):
+    """Seal this NGO's closed-year rows and drop them from its partition → rows archived."""
+    cutoff = cutoff or open_from()
+    moved = 0
+    with partitions.owned(ngo_id) as shard:
+        db = _db()
+        try:
+            keep = _unspent(shard, ngo_id)
+            for table in TIERED:
+                # Keys already sealed (a run that died before the delete) are only dropped
+                done = {k for (k,) in db.execute("SELECT key FROM archived WHERE ngo_id = ? AND tbl = ?",
+                                                 (ngo_id, table))}
+                rows = shard.execute(f"SELECT key, row FROM {table} WHERE ngo_id = ? AND at < ? "
+                                     "ORDER BY at, rowid", (ngo_id, cutoff)).fetchall()
+                by_fy, leaving = {}, []
+                for k, r in rows:
+                    if table == "donations" and k in keep:
+                        continue
+                    leaving.append((k,))
+                    if k not in done:
+                        row = json.loads(r)
+                        fy = fy_of(row.get(partitions.TABLES[table][1]))
+                        if fy is None:      # undated row: leave it hot rather than guess a year
+                            leaving.pop()
+                            continue
+                        by_fy.setdefault(fy, []).append(row)
+                if not leaving:
+                    continue
+                db.execute("BEGIN IMMEDIATE")
+                for fy, fy_rows in sorted(by_fy.items()):
+                    _seal(db, ngo_id, fy, table, fy_rows)
+                db.execute("COMMIT")
+                # Segments are durable; only now leave the hot tier
+                shard.executemany(f"DELETE FROM {table} WHERE key = ?", leaving)
+                moved += len(leaving)
+        finally:
+            db.close()              # the shard connection is partitions' cached one
+    return moved
+
+
+def tier(cutoff=None):
+    """Seal every NGO's closed years. Safe to rerun; one replica at a time."""
+    cutoff = cutoff or open_from()
+    with lock("archive"):
+        moved = 0
+        ngo_ids = {r[0] for t in TIERED
+                   for part in partitions.fan_out(f"SELECT DISTINCT ngo_id FROM {t} WHERE at < ?", (cutoff,))
+                   for r in part}
+        for ngo_id in sorted(ngo_ids):
+            moved += tier_ngo(ngo_id, cutoff)
+        db = _db()
+        try:
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('tiered_to', ?)", (cutoff,))
+        finally:
+            db.close()
+    global _tiered_to
+    _tiered_to = max(_tiered_to, cutoff)
+    return moved
+
+
+_running   = threading.Lock()
+_tiered_to = ""                         # this process's view of meta 'tiered_to'
+
+
+@on_write("donation")
+def _maybe_tier(_row):
+    """A new financial year has closed since the last run → tier in the background."""
+    global _tiered_to
+    due = open_from()
+    if _tiered_to >= due:               # the common case: no file access at all
+        return
+    db = _db()                          # once per process per closed year
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = 'tiered_to'").fetchone()
+    finally:
+        db.close()
+    _tiered_to = row[0] if row else ""
+    if _tiered_to >= due or not _running.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            log.info("Archived %d row(s) from closed financial years", tier())
+        except Exception:
+            log.exception("Archive tiering failed")
+        finally:
+            _running.release()
+    threading.Thread(target=run, name="archive-tier", daemon=True).start()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READ
+# ═══════════════════════════════════════════════════════════════════════════════
+def segments(ngo_id):
+    """[{fy, table, part, rows, summary, digest, sealed_at}] without touching the data."""
+    db = _db()
+    try:
+        rows = db.execute("SELECT fy, tbl, part, rows, summary, digest, sealed_at FROM segments "
+                          "WHERE ngo_id = ? ORDER BY fy, tbl, part", (ngo_id,)).fetchall()
+    finally:
+        db.close()
+    return [{"fy": fy, "table": t, "part": p, "rows": n, "summary": json.loads(s), "digest": d, "sealed_at": at}
+            for fy, t, p, n, s, d, at in rows]
+
+
+def scan(ngo_id, table, fy=None):
+    """Every archived row of one table (optionally one year), oldest first — for audits."""
+    db = _db()
+    try:
+        sql, params = "SELECT data FROM segments WHERE ngo_id = ? AND tbl = ?", [ngo_id, table]
+        if fy:
+            sql += " AND fy = ?"
+            params.append(fy)
+        blobs = [r[0] for r in db.execute(sql + " ORDER BY fy, part", params)]
+    finally:
+        db.close()
+    return [row for blob in blobs for row in _decode(blob)]
+
+
+def find(table, key):
+    """One archived row by its id (donation_id / outcome_id), or None."""
+    db = _db()
+    try:
+        loc = db.execute("SELECT s.data FROM archived a JOIN segments s USING (ngo_id, fy, part) "
+                         "WHERE a.tbl = ? AND a.key = ? AND s.tbl = a.tbl", (table, key)).fetchone()
+    finally:
+        db.close()
+    if loc:
+        key_field = partitions.TABLES[table][0]
+        return next((r for r in _decode(loc[0]) if str(r.get(key_field)) == key), None)
+    return None
+
+
+def donations_by_donor(donor_id):
+    """A donor's archived donations, oldest first — only the segments that hold them are opened."""
+    db = _db()
+    try:
+        wanted = db.execute("SELECT ngo_id, fy, part, key FROM archived WHERE donor_id = ? AND tbl = 'donations'",
+                            (donor_id,)).fetchall()
+        keys, blobs = {k for *_, k in wanted}, []
+        for ngo_id, fy, part in sorted({(n, fy, p) for n, fy, p, _ in wanted}):
+            blobs.append(db.execute("SELECT data FROM segments WHERE ngo_id = ? AND fy = ? AND tbl = 'donations' "
+                                    "AND part = ?", (ngo_id, fy, part)).fetchone()[0])
+    finally:
+        db.close()
+    rows = [r for blob in blobs for r in _decode(blob) if str(r.get("donation_id")) in keys]
+    return sorted(rows, key=lambda r: r.get("donated_at", ""))
+
+
+def recent(ngo_id, table, n):
+    """The last n rows across both tiers — hot rows first, topped up from the newest segments."""
+    hot = partitions.by_ngo(table, ngo_id)
+    if len(hot) >= n:
+        return hot[-n:]
+    db = _db()
+    try:
+        blobs = [r[0] for r in db.execute("SELECT data FROM segments WHERE ngo_id = ? AND tbl = ? "
+                                          "ORDER BY fy DESC, part DESC", (ngo_id, table))]
+    finally:
+        db.close()
+    older = []
+    for blob in blobs:
+        older = _decode(blob) + older
+        if len(older) + len(hot) >= n:
+            break
+    return (older + hot)[-n:]
+
+
+def archived_keys(ngo_id, table):
+    db = _db()
+    try:
+        return {k for (k,) in db.execute("SELECT key FROM archived WHERE ngo_id = ? AND tbl = ?", (ngo_id, table))}
+    finally:
+        db.close()
+
+
+def archived_allocs(ngo_id):
+    """alloc_ids with an archived outcome — read from the index, no segment is opened."""
+    db = _db()
+    try:
+        return {a for (a,) in db.execute("SELECT alloc_id FROM archived WHERE ngo_id = ? AND tbl = 'outcomes' "
+                                         "AND alloc_id IS NOT NULL", (ngo_id,))}
+    finally:
+        db.close()
+
+
+def lifetime(ngo_id):
+    """Lifetime totals: hot rows aggregated in SQL plus the archived segment summaries."""
+    d = partitions.query(ngo_id, "SELECT COUNT(*), "
+                         "COALESCE(SUM(CAST(json_extract(row, '$.amount') AS REAL)), 0) "
+                         "FROM donations WHERE ngo_id = ?", (ngo_id,))[0]
+    o = partitions.query(ngo_id, "SELECT COUNT(*), "
+                         "COALESCE(SUM(CAST(json_extract(row, '$.beneficiaries_reached') AS INTEGER)), 0), "
+                         "COALESCE(SUM(CAST(json_extract(row, '$.outcome_accuracy') AS REAL)), 0) "
+                         "FROM outcomes WHERE ngo_id = ?", (ngo_id,))[0]
+    out = {"donations": d[0], "total_raised": d[1], "outcomes": o[0],
+           "beneficiaries": o[1], "accuracy_sum": o[2], "archived_years": set()}
+    for seg in segments(ngo_id):
+        s = seg["summary"]
+        out["archived_years"].add(seg["fy"])
+        if seg["table"] == "donations":
+            out["donations"] += s["rows"]
+            out["total_raised"] += s["amount"]
+        else:
+            out["outcomes"] += s["rows"]
+            out["beneficiaries"] += s["beneficiaries"]
+            out["accuracy_sum"] += s["accuracy_sum"]
+    acc = out.pop("accuracy_sum")
+    out["avg_accuracy"] = round(acc / out["outcomes"], 1) if out["outcomes"] else 0.0
+    out["archived_years"] = sorted(out["archived_years"])
+    return out
+
+
+def totals():
+    """Platform-wide archived {donations, total_raised, outcomes, beneficiaries} from summaries only."""
+    db = _db()
+    try:
+        rows = db.execute("SELECT tbl, summary FROM segments").fetchall()
+    finally:
+        db.close()
+    out = {"donations": 0, "total_raised": 0.0, "outcomes": 0, "beneficiaries": 0}
+    for table, summary in rows:
+        s = json.loads(summary)
+        if table == "donations":
+            out["donations"] += s["rows"]
+            out["total_raised"] += s["amount"]
+        else:
+            out["outcomes"] += s["rows"]
+            out["beneficiaries"] += s["beneficiaries"]
+    return out
+
+
+def verify():
+    """[(ngo_id, fy, table, part)] of segments whose data no longer matches the sealed digest."""
+    db = _db()
+    try:
+        bad = [(n, fy, t, p) for n, fy, t, p, d, blob in db.execute(
+               "SELECT ngo_id, fy, tbl, part, digest, data FROM segments")
+               if hashlib.sha256(zlib.decompress(blob)).hexdigest() != d]
+    finally:
+        db.close()
+    return bad
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NSITN hot/cold archive")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("tier", help="seal every closed financial year now")
+    t.add_argument("--before", help="override the cutoff date (YYYY-MM-DD)")
+    ls = sub.add_parser("list")
+    ls.add_argument("ngo_id")
+    sub.add_parser("verify")
+    e = sub.add_parser("export", help="print archived rows as JSON lines")
+    e.add_argument("ngo_id")
+    e.add_argument("fy")
+    e.add_argument("table", nargs="?", default="donations", choices=TIERED)
+    args = parser.parse_args()
+
+    if args.cmd == "tier":
+        print(f"✅ Archived {tier(args.before)} row(s) dated before {args.before or open_from()}")
+    elif args.cmd == "list":
+        for seg in segments(args.ngo_id):
+            print(f"{seg['fy']}  {seg['table']:<9} part {seg['part']}  {seg['rows']:>6} rows  {seg['summary']}")
+        print(json.dumps(lifetime(args.ngo_id), indent=2))
+    elif args.cmd == "verify":
+        bad = verify()
+        print("✅ Every segment matches its digest" if not bad else f"❌ {len(bad)} corrupt segment(s): {bad}")
+        raise SystemExit(1 if bad else 0)
+    else:
+        for row in scan(args.ngo_id, args.table, args.fy):
+            print(json.dumps(row, ensure_ascii=False))
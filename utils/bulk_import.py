@@ -0,0 +1,252 @@
+"""
+utils/bulk_import.py — NSITN v2.0
+Bulk CSV / XLSX import of allocations and outcomes for one NGO.
+Rows are streamed, validated one by one against UNIT_COST_DEFAULTS and the
+NGO's existing donations/allocations, written in batches, and re-scored once.
+A bad row is reported and skipped — it never aborts the rest of the file.
+Budgets and "already has an outcome" are re-checked against fresh totals
+inside each batch's NGO lock, so a concurrent write can't be overrun.
+"""
+
+import csv
+import io
+from datetime import datetime
+
+from utils.data_manager import UNIT_COST_DEFAULTS
+from utils.partitions import get_donations_by_ngo, get_allocations_by_ngo, get_outcomes_by_ngo
+from utils import archive
+from utils.store import add_allocation, record_outcome, run_ngo_analysis, ngo_lock
+
+ALLOCATION_COLUMNS = ["donation_id", "activity_type", "unit_cost", "units_planned",
+                      "alloc_date", "outcome_date"]
+OUTCOME_COLUMNS    = ["alloc_id", "actual_units", "beneficiaries"]
+
+
+def template_csv(columns):
+    return ",".join(columns) + "\n"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READERS — yield (row_number, {column: value}) without loading the whole file
+# ═══════════════════════════════════════════════════════════════════════════════
+def iter_rows(fileobj, filename):
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        yield from _iter_xlsx(fileobj)
+    else:
+        yield from _iter_csv(fileobj)
+
+
+def _iter_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    for i, row in enumerate(csv.DictReader(text), start=2):
+        # DictReader files surplus cells under the key None, as a list
+        extra = [v for v in row.pop(None, None) or () if (v or "").strip()]
+        clean = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+        if extra:
+            clean[None] = len(extra)    # reported by _shape()
+        yield i, clean
+
+
+def _iter_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("XLSX import needs openpyxl — pip install openpyxl, or upload a CSV")
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    header = [str(h or "").strip().lower() for h in next(rows, [])]
+    for i, values in enumerate(rows, start=2):
+        if all(v is None for v in values):
+            continue
+        row = {h: ("" if v is None else str(v).strip()) for h, v in zip(header, values)}
+        extra = sum(1 for v in values[len(header):] if v not in (None, ""))
+        if extra:
+            row[None] = extra
+        yield i, row
+    wb.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FIELD PARSERS — raise ValueError with a human message
+# ═══════════════════════════════════════════════════════════════════════════════
+def _shape(row):
+    if None in row:
+        raise ValueError(f"too many columns — {row[None]} value(s) beyond the header")
+
+
+def _int(row, key, minimum=0):
+    raw = row.get(key, "")
+    try:
+        num = float(raw)
+    except ValueError:
+        raise ValueError(f"{key} must be a number (got '{raw}')")
+    if not num.is_integer():                # also rejects inf / nan
+        raise ValueError(f"{key} must be a whole number (got '{raw}')")
+    val = int(num)
+    if val < minimum:
+        raise ValueError(f"{key} must be ≥ {minimum}")
+    return val
+
+
+def _date(row, key):
+    raw = row.get(key, "")[:10]
+    try:
+        datetime.strptime(raw, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{key} must be YYYY-MM-DD (got '{raw}')")
+    return raw
+
+
+def _batches(valid, batch_size):
+    batch = []
+    for item in valid:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write(report, ngo_id, valid, write_fn, batch_size, recheck):
+    """recheck() runs inside each batch's lock and returns check(args), which raises ValueError."""
+    for batch in _batches(valid, batch_size):
+        # Hold the NGO lock for the whole batch so other replicas can't interleave
+        with ngo_lock(ngo_id):
+            check = recheck()           # totals as of now, not as of the first read
+            for row_no, args in batch:
+                try:
+                    check(args)
+                except ValueError as e:
+                    report["errors"].append((row_no, str(e)))
+                    continue
+                try:
+                    report["ids"].append(write_fn(*args))
+                    report["inserted"] += 1
+                except Exception as e:
+                    report["errors"].append((row_no, f"write failed: {e}"))
+
+
+def _finish(ngo_id, report):
+    if report["inserted"]:
+        report["analysis"] = run_ngo_analysis(ngo_id)
+    return report
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ALLOCATIONS
+# ═══════════════════════════════════════════════════════════════════════════════
+def import_allocations(ngo_id, rows, batch_size=100):
+    """
+    rows: iterable of (row_number, dict) — see iter_rows().
+    Returns {"inserted", "ids", "errors": [(row_number, message)], "analysis"}.
+    """
+    donations = {d["donation_id"]: float(d["amount"]) for d in get_donations_by_ngo(ngo_id)}
+    archived  = archive.archived_keys(ngo_id, "donations")
+
+    def spent():
+        out = dict.fromkeys(donations, 0.0)
+        for a in get_allocations_by_ngo(ngo_id):
+            if a.get("donation_id") in out:
+                out[a["donation_id"]] += float(a["total_cost"])
+        return out
+
+    allocated = spent()
+
+    report = {"inserted": 0, "ids": [], "errors": [], "analysis": None}
+
+    def validated():
+        for row_no, row in rows:
+            try:
+                _shape(row)
+                don_id = row.get("donation_id", "")
+                if don_id not in donations:
+                    if don_id in archived:
+                        raise ValueError(f"donation '{don_id}' is fully allocated and archived")
+                    raise ValueError(f"donation '{don_id}' not found for this NGO")
+                activity = row.get("activity_type", "").lower()
+                if activity not in UNIT_COST_DEFAULTS:
+                    raise ValueError(f"unknown activity_type '{activity}' "
+                                     f"(expected one of {', '.join(UNIT_COST_DEFAULTS)})")
+                unit_cost = (_int(row, "unit_cost", 1) if row.get("unit_cost")
+                             else UNIT_COST_DEFAULTS[activity])
+                units     = _int(row, "units_planned", 1)
+                start     = _date(row, "alloc_date")
+                due       = _date(row, "outcome_date")
+                if due < start:
+                    raise ValueError("outcome_date is before alloc_date")
+                total = unit_cost * units
+                _fits(allocated, donations, don_id, total)
+            except ValueError as e:
+                report["errors"].append((row_no, str(e)))
+                continue
+            allocated[don_id] += total
+            yield row_no, (ngo_id, don_id, activity, unit_cost, units, start, due)
+
+    def recheck():
+        fresh = spent()
+
+        def check(args):
+            don_id, total = args[1], args[3] * args[4]
+            _fits(fresh, donations, don_id, total)
+            fresh[don_id] += total
+        return check
+
+    _write(report, ngo_id, validated(), lambda *a: add_allocation(*a)["alloc_id"], batch_size, recheck)
+    return _finish(ngo_id, report)
+
+
+def _fits(allocated, donations, don_id, total):
+    if allocated[don_id] + total > donations[don_id]:
+        raise ValueError(f"₹{total:,.0f} exceeds the ₹{donations[don_id] - allocated[don_id]:,.0f} "
+                         f"left unallocated on donation {don_id}")
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# OUTCOMES
+# ═══════════════════════════════════════════════════════════════════════════════
+def import_outcomes(ngo_id, rows, batch_size=100):
+    """Same contract as import_allocations, for OUTCOME_COLUMNS rows."""
+    planned = {a["alloc_id"]: int(float(a["units_planned"])) for a in get_allocations_by_ngo(ngo_id)}
+    done    = {o.get("alloc_id") for o in get_outcomes_by_ngo(ngo_id)} | archive.archived_allocs(ngo_id)
+
+    report = {"inserted": 0, "ids": [], "errors": [], "analysis": None}
+
+    def validated():
+        for row_no, row in rows:
+            try:
+                _shape(row)
+                alloc_id = row.get("alloc_id", "")
+                if alloc_id not in planned:
+                    raise ValueError(f"allocation '{alloc_id}' not found for this NGO")
+                if alloc_id in done:
+                    raise ValueError(f"allocation {alloc_id} already has an outcome")
+                actual = _int(row, "actual_units")
+                if actual > planned[alloc_id] * 2:
+                    raise ValueError(f"actual_units {actual} is more than twice the {planned[alloc_id]} planned")
+                benef = (_int(row, "beneficiaries") if row.get("beneficiaries")
+                         else max(1, actual // 3))
+            except ValueError as e:
+                report["errors"].append((row_no, str(e)))
+                continue
+            done.add(alloc_id)
+            yield row_no, (ngo_id, alloc_id, actual, benef)
+
+    def recheck():
+        # A concurrent outcome lands in the hot tier; archived ones were counted above
+        fresh = {o.get("alloc_id") for o in get_outcomes_by_ngo(ngo_id)}
+
+        def check(args):
+            if args[1] in fresh:
+                raise ValueError(f"allocation {args[1]} already has an outcome")
+            fresh.add(args[1])
+        return check
+
+    def write(*args):
+        outcome, msg = record_outcome(*args)
+        if not outcome:
+            raise ValueError(msg)
+        return outcome.get("outcome_id", args[1])
+
+    _write(report, ngo_id, validated(), write, batch_size, recheck)
+    return _finish(ngo_id, report)
@@ -0,0 +1,257 @@
+"""
+utils/changefeed.py — NSITN v2.0
+Ordered, durable change feed over every write made through utils.store.
+
+Each write becomes one typed event in an append-only SQLite log whose
+sequence numbers are monotonic across all replicas (AUTOINCREMENT; SQLite
+serialises writers, so commit order is sequence order):
+
+    user.created  ngo.registered  donation.created  receipt.created
+    allocation.added  outcome.recorded  ngo.decided  ngo.scored
+
+Producers are durable store sinks: the event is appended inside the write's
+critical section, and a failed append is parked in the store outbox and
+replayed in order rather than dropped. ngo.scored is only appended when a
+score actually moved.
+
+In-process consumers subscribe() and are called right after the event is
+durable. Other processes tail it with a named Consumer, which remembers its
+checkpointed offset, so delivery is at-least-once and resumes where it
+stopped. compact() drops events every consumer has already committed; the
+producers run it every COMPACT_EVERY seconds.
+
+    python -m utils.changefeed tail --consumer search-index
+    python -m utils.changefeed stats
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from utils.store import DATA_DIR, on_write
+from utils.score_history import FIELDS as SCORE_FIELDS
+
+FEED_PATH = os.path.join(DATA_DIR, "changefeed.sqlite")
+RETAIN_SECONDS = 30 * 86400             # compact() never drops younger events
+COMPACT_EVERY  = 3600                   # seconds between compactions, per process
+
+EVENT_TYPES = {
+    "user":       "user.created",
+    "ngo":        "ngo.registered",
+    "donation":   "donation.created",
+    "receipt":    "receipt.created",
+    "allocation": "allocation.added",
+    "outcome":    "outcome.recorded",
+    "decision":   "ngo.decided",
+    "analysis":   "ngo.scored",
+}
+KEY_FIELDS = ("receipt_id", "outcome_id", "alloc_id", "donation_id", "user_id", "ngo_id")
+REDACT     = {"password", "password_hash", "pwd", "salt"}
+
+_subscribers = []                       # [(fn, types or None)]
+_last_compact = 0.0
+log = logging.getLogger(__name__)
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(FEED_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, at REAL,
+                                           type TEXT, key TEXT, ngo_id TEXT, payload TEXT);
+        CREATE INDEX IF NOT EXISTS idx_events_ngo ON events (ngo_id, type);
+        CREATE TABLE IF NOT EXISTS offsets (consumer TEXT PRIMARY KEY, seq INTEGER, at REAL);
+    """)
+    return db
+
+
+def _event(row):
+    seq, at, type_, key, ngo_id, payload = row
+    return {"seq": seq, "at": at, "type": type_, "key": key, "ngo_id": ngo_id,
+            "data": json.loads(payload)}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PRODUCE
+# ═══════════════════════════════════════════════════════════════════════════════
+def _scores(data):
+    return [data.get(f) for f in SCORE_FIELDS + ("trust_dna",)]
+
+
+def append(type_, row):
+    """Append one event → its seq, or None when an ngo.scored event would repeat the last one."""
+    global _last_compact
+    data = {k: v for k, v in dict(row).items() if k not in REDACT}
+    key = next((str(data[f]) for f in KEY_FIELDS if data.get(f)), "")
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if type_ == "ngo.scored":
+                last = db.execute("SELECT payload FROM events WHERE ngo_id = ? AND type = ? "
+                                  "ORDER BY seq DESC LIMIT 1", (data.get("ngo_id"), type_)).fetchone()
+                if last and _scores(json.loads(last[0])) == _scores(data):
+                    db.execute("ROLLBACK")
+                    return None
+            at = time.time()                # under the write lock, so `at` follows seq order
+            cur = db.execute("INSERT INTO events (at, type, key, ngo_id, payload) VALUES (?, ?, ?, ?, ?)",
+                             (at, type_, key, data.get("ngo_id"),
+                              json.dumps(data, ensure_ascii=False, default=str)))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        event = {"seq": cur.lastrowid, "at": at, "type": type_, "key": key,
+                 "ngo_id": data.get("ngo_id"), "data": data}
+    finally:
+        db.close()
+    for fn, types in _subscribers:
+        if types is None or type_ in types:
+            try:
+                fn(event)
+            except Exception:
+                log.exception("Change feed subscriber %s failed on #%d", fn.__name__, event["seq"])
+    if at - _last_compact > COMPACT_EVERY:
+        _last_compact = at
+        try:
+            compact()
+        except Exception:
+            log.exception("Change feed compaction failed")
+    return event["seq"]
+
+
+def _producer(kind, type_):
+    def produce(row):
+        append(type_, row)
+    produce.__name__ = f"feed_{kind}"
+    return produce
+
+
+# Durable: a failed append is parked in the store outbox and replayed, never dropped
+for _kind, _type in EVENT_TYPES.items():
+    on_write(_kind, durable=True)(_producer(_kind, _type))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CONSUME
+# ═══════════════════════════════════════════════════════════════════════════════
+def subscribe(fn=None, types=None):
+    """In-process: fn(event) after each durable append. Usable as @subscribe or @subscribe(types=…)."""
+    def register(f):
+        _subscribers.append((f, set(types) if types else None))
+        return f
+    return register(fn) if fn else register
+
+
+def read(after=0, limit=500, types=None):
+    db = _db()
+    try:
+        sql, params = "SELECT seq, at, type, key, ngo_id, payload FROM events WHERE seq > ?", [after]
+        if types:
+            sql += f" AND type IN ({','.join('?' * len(types))})"
+            params += list(types)
+        rows = db.execute(sql + " ORDER BY seq LIMIT ?", params + [limit]).fetchall()
+    finally:
+        db.close()
+    return [_event(r) for r in rows]
+
+
+def head():
+    db = _db()
+    try:
+        return db.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+    finally:
+        db.close()
+
+
+class Consumer:
+    """Named cross-process reader with a checkpointed offset."""
+
+    def __init__(self, name, types=None, start=None):
+        self.name, self.types = name, types
+        if start is not None:
+            self.commit(start)
+
+    @property
+    def offset(self):
+        db = _db()
+        try:
+            row = db.execute("SELECT seq FROM offsets WHERE consumer = ?", (self.name,)).fetchone()
+            return row[0] if row else 0
+        finally:
+            db.close()
+
+    def commit(self, seq):
+        db = _db()
+        try:
+            db.execute("INSERT INTO offsets VALUES (?, ?, ?) ON CONFLICT(consumer) "
+                       "DO UPDATE SET seq = excluded.seq, at = excluded.at", (self.name, seq, time.time()))
+        finally:
+            db.close()
+
+    def poll(self, limit=500):
+        return read(self.offset, limit, self.types)
+
+    def run(self, handler, interval=1.0, batch=500, stop=None):
+        """Feed handler(event) forever (or until stop() is true); commit after each batch."""
+        while not (stop and stop()):
+            events = self.poll(batch)
+            for e in events:
+                handler(e)
+            if events:
+                self.commit(events[-1]["seq"])
+            else:
+                time.sleep(interval)
+
+
+def compact(retain_seconds=RETAIN_SECONDS):
+    """Drop events that every consumer has committed and that are older than the retention."""
+    db = _db()
+    try:
+        low = db.execute("SELECT MIN(seq) FROM offsets").fetchone()[0]
+        if low is None:
+            return 0
+        cur = db.execute("DELETE FROM events WHERE seq <= ? AND at < ?", (low, time.time() - retain_seconds))
+        return cur.rowcount
+    finally:
+        db.close()
+
+
+def stats():
+    db = _db()
+    try:
+        counts = dict(db.execute("SELECT type, COUNT(*) FROM events GROUP BY type").fetchall())
+        consumers = dict(db.execute("SELECT consumer, seq FROM offsets").fetchall())
+    finally:
+        db.close()
+    top = head()
+    return {"head": top, "events": counts, "lag": {c: top - s for c, s in consumers.items()}}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NSITN change feed")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("tail", help="print events as JSON lines, resuming from the consumer's offset")
+    t.add_argument("--consumer", default="cli")
+    t.add_argument("--from", dest="start", type=int)
+    t.add_argument("--types", nargs="*")
+    sub.add_parser("stats")
+    c = sub.add_parser("compact")
+    c.add_argument("--retain-days", type=float, default=RETAIN_SECONDS / 86400)
+    args = parser.parse_args()
+
+    if args.cmd == "tail":
+        try:
+            Consumer(args.consumer, args.types, args.start).run(
+                lambda e: print(json.dumps(e, ensure_ascii=False), flush=True))
+        except KeyboardInterrupt:
+            pass
+    elif args.cmd == "stats":
+        print(json.dumps(stats(), indent=2))
+    else:
+        print(f"✅ Dropped {compact(args.retain_days * 86400)} committed event(s)")
@@ -0,0 +1,348 @@
+"""
+utils/cost_sketch.py — NSITN v2.0
+Streaming unit-cost quantile sketches for peer benchmarking.
+
+One KLL sketch per activity type and per (activity, region), fed by
+store.on_write("allocation"). An update appends to the sketch's level-0
+buffer and occasionally compacts. Each sketch keeps O(k) items whatever the
+allocation count, so an update costs the same on day one and at a million
+allocations. percentile() tells an NGO or admin where a proposed unit cost
+sits among peers. Allocations outside the [OUTLIER_LOW, OUTLIER_HIGH]
+percentile band are recorded as peer-cost anomalies for admin review — no
+table scan involved. An update locks only the sketches it touches
+("cost_sketch:<key>"), so allocations for different activities never queue.
+
+The first build runs in the background (start(), triggered by the first
+query) or offline from the CLI: the sketches are filled in memory and saved,
+with the 'built' flag, in one transaction — until then queries answer "not
+enough peers", and a crashed build leaves no flag, so it is simply retried.
+Allocations written during a build are parked in a backlog that the build
+folds in before it commits.
+
+    python -m utils.cost_sketch      # rebuild every sketch from data_manager
+"""
+
+import functools
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+from contextlib import ExitStack
+
+from utils.store import DATA_DIR, lock, on_write
+
+SKETCH_PATH  = os.path.join(DATA_DIR, "cost_sketches.sqlite")
+K            = 200                      # KLL accuracy parameter: ~1.65/K rank error
+MIN_PEERS    = 20                       # below this, fall back from region to national sketch
+OUTLIER_LOW  = 2.0
+OUTLIER_HIGH = 98.0
+
+_built    = False                       # this process has seen the 'built' flag
+_building = threading.Lock()            # one background build per process
+log = logging.getLogger(__name__)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# KLL SKETCH
+# ═══════════════════════════════════════════════════════════════════════════════
+class KLL:
+    """Karnin–Lang–Liberty quantile sketch (items at level h weigh 2^h)."""
+
+    __slots__ = ("k", "n", "levels")
+    C = 2 / 3
+
+    def __init__(self, k=K, n=0, levels=None):
+        self.k, self.n, self.levels = k, n, levels or [[]]
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * self.C ** depth)), 2)
+
+    def update(self, x):
+        self.levels[0].append(float(x))
+        self.n += 1
+        if sum(map(len, self.levels)) > sum(self._capacity(h) for h in range(len(self.levels))):
+            self._compress()
+
+    def _compress(self):
+        for h, items in enumerate(self.levels):
+            if len(items) >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                items.sort()
+                keep = [items.pop()] if len(items) % 2 else []   # odd one out stays
+                self.levels[h + 1].extend(items[random.getrandbits(1)::2])
+                self.levels[h] = keep
+                return
+
+    def _weighted(self):
+        pairs = sorted((x, 1 << h) for h, items in enumerate(self.levels) for x in items)
+        return pairs, sum(w for _, w in pairs)
+
+    def rank(self, x):
+        """Mid-rank of x: fraction below it plus half the ties, so a common value sits mid-pack."""
+        pairs, total = self._weighted()
+        if not total:
+            return None
+        below = sum(w for v, w in pairs if v < x)
+        equal = sum(w for v, w in pairs if v == x)
+        return (below + equal / 2) / total
+
+    def quantiles(self, qs):
+        pairs, total = self._weighted()
+        if not total:
+            return [None] * len(qs)
+        out, acc, i = [], 0, 0
+        for q in sorted(qs):
+            target = q * total
+            while i < len(pairs) - 1 and acc + pairs[i][1] < target:
+                acc += pairs[i][1]
+                i += 1
+            out.append(pairs[i][0])
+        return out
+
+    def dumps(self):
+        return json.dumps({"k": self.k, "n": self.n, "levels": self.levels}, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, s):
+        d = json.loads(s)
+        return cls(d["k"], d["n"], d["levels"])
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STORAGE
+# ═══════════════════════════════════════════════════════════════════════════════
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(SKETCH_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS sketches (key TEXT PRIMARY KEY, sketch TEXT);
+        CREATE TABLE IF NOT EXISTS outliers (alloc_id TEXT PRIMARY KEY, ngo_id TEXT, activity TEXT,
+                                             unit_cost REAL, percentile REAL, peers INTEGER);
+        CREATE INDEX IF NOT EXISTS idx_outliers_ngo ON outliers (ngo_id);
+        CREATE TABLE IF NOT EXISTS backlog (alloc_id TEXT PRIMARY KEY, alloc TEXT, region TEXT);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    return db
+
+
+def keys_for(activity, region=None):
+    activity = str(activity).strip().lower()
+    keys = [f"activity:{activity}"]
+    if region:
+        keys.append(f"activity:{activity}|region:{str(region).strip().lower()}")
+    return keys
+
+
+def _load(db, key):
+    row = db.execute("SELECT sketch FROM sketches WHERE key = ?", (key,)).fetchone()
+    return KLL.loads(row[0]) if row else KLL()
+
+
+@functools.lru_cache(maxsize=4096)
+def _region(ngo_id):
+    """An NGO's location is fixed at registration, so one lookup per NGO per process."""
+    from utils.data_manager import get_ngo_by_id
+    ngo = get_ngo_by_id(ngo_id)
+    return ngo["location"] if ngo else None
+
+
+def _unit_cost(alloc):
+    try:
+        return float(alloc.get("unit_cost"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# UPDATE
+# ═══════════════════════════════════════════════════════════════════════════════
+def _keys_locked(keys):
+    """Hold the per-key locks of the sketches one update touches (sorted, so never deadlocks)."""
+    stack = ExitStack()
+    for k in sorted(keys):
+        stack.enter_context(lock(f"cost_sketch:{k}"))
+    return stack
+
+
+def _score(sketches, keys, alloc, cost):
+    """Outlier row for alloc against its peers *before* it joins them, or None."""
+    pct, peers = _percentile(sketches, keys, cost)
+    if pct is not None and not OUTLIER_LOW <= pct <= OUTLIER_HIGH:
+        return (alloc["alloc_id"], alloc["ngo_id"], keys[0].split(":", 1)[1], cost, pct, peers)
+    return None
+
+
+def _is_built(db):
+    global _built
+    if not _built:
+        _built = db.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+    return _built
+
+
+@on_write("allocation")
+def add_allocation(alloc, region=None):
+    cost = _unit_cost(alloc)
+    if cost is None or cost <= 0:
+        return
+    region = region or _region(alloc["ngo_id"])
+    keys = keys_for(alloc.get("activity_type", ""), region)
+    with _keys_locked(keys):            # load → update → save, across replicas
+        db = _db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if not _is_built(db):       # the build folds it in before it commits
+                db.execute("INSERT OR REPLACE INTO backlog VALUES (?, ?, ?)",
+                           (alloc["alloc_id"], json.dumps(dict(alloc), default=str), region))
+                db.execute("COMMIT")
+                return
+            sketches = {k: _load(db, k) for k in keys}
+            outlier = _score(sketches, keys, alloc, cost)
+            if outlier:
+                db.execute("INSERT OR REPLACE INTO outliers VALUES (?, ?, ?, ?, ?, ?)", outlier)
+            for k, sk in sketches.items():
+                sk.update(cost)
+                db.execute("INSERT OR REPLACE INTO sketches VALUES (?, ?)", (k, sk.dumps()))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+
+def rebuild(force=True):
+    """Fill every sketch in memory, then save them and the 'built' flag in one transaction."""
+    global _built
+    from utils.data_manager import get_all_ngos, get_allocations_by_ngo
+
+    with lock("cost_sketch:build"):     # one replica builds; the others find the flag
+        if not force:
+            db = _db()
+            try:
+                if _is_built(db):
+                    return
+            finally:
+                db.close()
+        sketches, outliers, seen = {}, [], set()
+
+        def feed(alloc, region):
+            cost = _unit_cost(alloc)
+            if cost is None or cost <= 0 or alloc.get("alloc_id") in seen:
+                return
+            seen.add(alloc.get("alloc_id"))
+            keys = keys_for(alloc.get("activity_type", ""), region)
+            mine = {k: sketches.setdefault(k, KLL()) for k in keys}
+            outlier = _score(mine, keys, alloc, cost)
+            if outlier:
+                outliers.append(outlier)
+            for sk in mine.values():
+                sk.update(cost)
+
+        for ngo in get_all_ngos():
+            for a in get_allocations_by_ngo(ngo["ngo_id"]):
+                feed(dict(a, ngo_id=ngo["ngo_id"]), ngo["location"])
+
+        db = _db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Allocations parked while we read: the write lock keeps more from arriving
+                for alloc, region in db.execute("SELECT alloc, region FROM backlog").fetchall():
+                    feed(json.loads(alloc), region)
+                for table in ("sketches", "outliers", "backlog"):
+                    db.execute(f"DELETE FROM {table}")
+                db.executemany("INSERT INTO sketches VALUES (?, ?)", [(k, sk.dumps()) for k, sk in sketches.items()])
+                db.executemany("INSERT OR REPLACE INTO outliers VALUES (?, ?, ?, ?, ?, ?)", outliers)
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+    _built = True
+
+
+def start():
+    """Build in the background if no build exists yet; queries say "not enough peers" meanwhile."""
+    if _built:
+        return None
+    db = _db()
+    try:
+        if _is_built(db) or not _building.acquire(blocking=False):
+            return None
+    finally:
+        db.close()
+
+    def run():
+        try:
+            rebuild(force=False)
+        except Exception:
+            log.exception("Cost sketch build failed — retried on the next query, or run python -m utils.cost_sketch")
+        finally:
+            _building.release()
+    thread = threading.Thread(target=run, name="cost-sketch-build", daemon=True)
+    thread.start()
+    return thread
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# QUERY
+# ═══════════════════════════════════════════════════════════════════════════════
+def _percentile(sketches, keys, cost):
+    """Most specific sketch with enough peers wins: region first, then national."""
+    for k in reversed(keys):
+        sk = sketches[k]
+        if sk.n >= MIN_PEERS:
+            return round(sk.rank(cost) * 100, 1), sk.n
+    return None, 0
+
+
+def percentile(activity, unit_cost, region=None):
+    """(percentile 0–100 of unit_cost among peers, peer count) — (None, 0) without enough peers."""
+    start()
+    keys = keys_for(activity, region)
+    db = _db()
+    try:
+        sketches = {k: _load(db, k) for k in keys}
+    finally:
+        db.close()
+    return _percentile(sketches, keys, float(unit_cost))
+
+
+def peer_quantiles(activity, region=None, qs=(0.1, 0.5, 0.9)):
+    """({q: unit cost}, peer count) from the most specific sketch with enough peers."""
+    start()
+    db = _db()
+    try:
+        for k in reversed(keys_for(activity, region)):
+            sk = _load(db, k)
+            if sk.n >= MIN_PEERS:
+                return dict(zip(sorted(qs), sk.quantiles(qs))), sk.n
+    finally:
+        db.close()
+    return {}, 0
+
+
+def anomalies(ngo_id):
+    """Peer unit-cost outliers, shaped like ai_engine anomalies ({"flag": …})."""
+    db = _db()
+    try:
+        rows = db.execute("SELECT alloc_id, activity, unit_cost, percentile, peers FROM outliers "
+                          "WHERE ngo_id = ? ORDER BY alloc_id", (ngo_id,)).fetchall()
+    finally:
+        db.close()
+    return [{"flag": f"💸 {alloc_id}: {activity} unit cost ₹{cost:,.0f} is at the "
+                     f"{pct:.0f}th percentile of {peers} peer allocations",
+             "alloc_id": alloc_id, "percentile": pct}
+            for alloc_id, activity, cost, pct, peers in rows]
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    rebuild()
+    print(f"✅ Rebuilt {SKETCH_PATH}")
@@ -0,0 +1,234 @@
+"""
+utils/deadlines.py — NSITN v2.0
+Deadline index for allocations still waiting on an outcome.
+
+Every allocation without a recorded outcome sits in a SQLite table indexed by
+(flagged, due) — a persistent priority queue ordered by outcome_date. The
+scheduler thread peeks the earliest unflagged deadline and sleeps until it
+passes; when it fires, the allocation is flagged overdue and only that NGO is
+re-scored (ai_engine derives timeliness from the rows and today's date, so a
+passing deadline changes the score without any write). New allocations and
+outcomes arrive through store.on_write. Existing allocations are indexed one
+NGO at a time: on first read for that NGO, and by the scheduler thread in the
+background — never in the page that starts it.
+
+    python -m utils.deadlines      # rebuild the index, then flag anything overdue
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.store import DATA_DIR, lock, on_write
+
+DEADLINES_PATH = os.path.join(DATA_DIR, "deadlines.sqlite")
+MAX_SLEEP      = 3600                   # re-check at least hourly (clock changes, other replicas)
+
+log = logging.getLogger(__name__)
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(DEADLINES_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS deadlines (alloc_id TEXT PRIMARY KEY, ngo_id TEXT,
+                                              due REAL, flagged INTEGER DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS idx_due ON deadlines (flagged, due);
+        CREATE INDEX IF NOT EXISTS idx_deadline_ngo ON deadlines (ngo_id);
+        CREATE TABLE IF NOT EXISTS indexed (ngo_id TEXT PRIMARY KEY);
+    """)
+    return db
+
+
+def due_at(outcome_date):
+    """An allocation is overdue once its outcome date has fully passed (local midnight after)."""
+    try:
+        day = datetime.strptime(str(outcome_date)[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+    return (day + timedelta(days=1)).timestamp()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INDEX MAINTENANCE
+# ═══════════════════════════════════════════════════════════════════════════════
+@on_write("allocation")
+def add_allocation(alloc):
+    due = due_at(alloc.get("outcome_date"))
+    if due is None:
+        return
+    db = _db()
+    try:
+        db.execute("INSERT OR REPLACE INTO deadlines (alloc_id, ngo_id, due) VALUES (?, ?, ?)",
+                   (alloc["alloc_id"], alloc["ngo_id"], due))
+    finally:
+        db.close()
+    scheduler.wake()
+
+
+@on_write("outcome")
+def settle(outcome):
+    """An outcome takes its allocation off the queue."""
+    db = _db()
+    try:
+        db.execute("DELETE FROM deadlines WHERE alloc_id = ?", (outcome.get("alloc_id"),))
+    finally:
+        db.close()
+
+
+_indexed = set()                        # NGOs known to be indexed (this process)
+
+
+def _index(db, ngo_id):
+    from utils.data_manager import get_allocations_by_ngo, get_outcomes_by_ngo
+
+    settled = {o.get("alloc_id") for o in get_outcomes_by_ngo(ngo_id)}
+    db.executemany("INSERT OR IGNORE INTO deadlines (alloc_id, ngo_id, due) VALUES (?, ?, ?)",
+                   [(a["alloc_id"], ngo_id, due_at(a.get("outcome_date")))
+                    for a in get_allocations_by_ngo(ngo_id)
+                    if a["alloc_id"] not in settled and due_at(a.get("outcome_date")) is not None])
+    db.execute("INSERT OR IGNORE INTO indexed VALUES (?)", (ngo_id,))
+
+
+def ensure_indexed(ngo_id):
+    """Index one NGO's existing allocations the first time anything needs them."""
+    if ngo_id in _indexed:
+        return
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if not db.execute("SELECT 1 FROM indexed WHERE ngo_id = ?", (ngo_id,)).fetchone():
+                _index(db, ngo_id)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+    _indexed.add(ngo_id)
+
+
+def backfill():
+    """Index every NGO not seen yet, one short transaction each (the scheduler runs this)."""
+    from utils.data_manager import get_all_ngos
+    for ngo in get_all_ngos():
+        ensure_indexed(ngo["ngo_id"])
+
+
+def rebuild():
+    """Re-index every NGO from data_manager (after restoring a backup)."""
+    from utils.data_manager import get_all_ngos
+
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM deadlines")
+        db.execute("DELETE FROM indexed")
+        for ngo in get_all_ngos():
+            _index(db, ngo["ngo_id"])
+        db.execute("COMMIT")
+    finally:
+        db.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SCHEDULER
+# ═══════════════════════════════════════════════════════════════════════════════
+def next_deadline():
+    db = _db()
+    try:
+        row = db.execute("SELECT MIN(due) FROM deadlines WHERE flagged = 0").fetchone()
+        return row[0]
+    finally:
+        db.close()
+
+
+def fire_due(now=None):
+    """Flag every allocation whose deadline has passed. Returns {ngo_id: newly overdue}."""
+    from utils.store import run_ngo_analysis
+
+    now = time.time() if now is None else now
+    with lock("deadlines"):             # one replica flags a given deadline
+        db = _db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute("SELECT alloc_id, ngo_id FROM deadlines WHERE flagged = 0 AND due <= ?",
+                              (now,)).fetchall()
+            fired = {}
+            for alloc_id, ngo_id in rows:
+                db.execute("UPDATE deadlines SET flagged = 1 WHERE alloc_id = ?", (alloc_id,))
+                fired[ngo_id] = fired.get(ngo_id, 0) + 1
+            db.execute("COMMIT")
+        finally:
+            db.close()
+    for ngo_id in fired:
+        try:
+            run_ngo_analysis(ngo_id, force=True)    # refresh timeliness: no row changed, time did
+        except Exception:
+            log.exception("Score refresh failed for %s after deadline", ngo_id)
+    return fired
+
+
+class DeadlineScheduler:
+    """Sleeps until the earliest open deadline; add_allocation() wakes it early."""
+
+    def __init__(self):
+        self._wake    = threading.Event()
+        self._started = False
+        self._guard   = threading.Lock()
+
+    def start(self):
+        with self._guard:
+            if not self._started:
+                threading.Thread(target=self._run, name="deadline-scheduler", daemon=True).start()
+                self._started = True
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        try:
+            backfill()
+        except Exception:
+            log.exception("Deadline backfill failed — NGOs are still indexed on first read")
+        while True:
+            try:
+                fire_due()
+                nxt = next_deadline()
+            except Exception:
+                log.exception("Deadline scheduler tick failed")
+                nxt = None
+            delay = MAX_SLEEP if nxt is None else min(max(nxt - time.time(), 0), MAX_SLEEP)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+
+scheduler = DeadlineScheduler()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READ
+# ═══════════════════════════════════════════════════════════════════════════════
+def overdue_allocations(ngo_id):
+    """{alloc_id} of this NGO's allocations flagged overdue."""
+    ensure_indexed(ngo_id)
+    db = _db()
+    try:
+        return {r[0] for r in db.execute(
+            "SELECT alloc_id FROM deadlines WHERE ngo_id = ? AND flagged = 1", (ngo_id,))}
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    rebuild()
+    fired = fire_due()
+    print(f"✅ Rebuilt {DEADLINES_PATH}: {sum(fired.values())} allocation(s) overdue across {len(fired)} NGO(s)")
@@ -0,0 +1,144 @@
+"""
+utils/facets.py — NSITN v2.0
+Faceted filter index over approved NGOs for the browse page.
+
+Every approved NGO owns a slot; each facet value is a bitset (a Python int)
+of the slots that carry it. A filter is an AND across facets of the OR of
+the selected values, and facet counts are popcounts of value & filter —
+each a handful of big-int operations, so any combination answers in
+milliseconds. Score ranges are exact: bands wholly inside [lo, hi] are taken
+as they are, and only the slots of the two edge bands are compared against
+their scores. The index is built from one browse snapshot and never patched,
+so its counts always describe exactly the cards the page lists.
+"""
+
+import threading
+
+BAND = 10                               # score facets are 10-point bands
+RANGED = {"transparency": "transparency_score", "risk": "risk_percent"}
+
+FACETS = {
+    "cause":        "Cause",
+    "location":     "Location",
+    "founded":      "Founded",
+    "trust_dna":    "Trust DNA",
+    "transparency": "Transparency %",
+    "risk":         "Risk %",
+}
+
+
+def _band(value):
+    lo = min(int(float(value) // BAND) * BAND, 100 - BAND)
+    return f"{lo:02d}–{lo + BAND}"
+
+
+def _band_range(label):
+    lo = int(label.split("–")[0])
+    return lo, lo + BAND                # half-open, except that the top band also holds 100
+
+
+def bands_between(lo, hi):
+    """Band labels that hold any score in the closed range [lo, hi] (hi itself included)."""
+    return sorted({_band(v) for v in range(int(lo // BAND) * BAND, int(hi) + 1, BAND)} | {_band(hi)})
+
+
+def facet_values(ngo):
+    try:
+        year = int(str(ngo["founded_year"])[:4])
+        founded = f"{year // 10 * 10}s"
+    except ValueError:
+        founded = "Unknown"
+    dna = str(ngo["trust_dna"]).strip()
+    return {
+        "cause":        str(ngo["cause"]).strip().lower(),
+        "location":     str(ngo["location"]).strip().title() or "Unknown",
+        "founded":      founded,
+        "trust_dna":    dna.replace(" ", "-").split("-")[0] or "Unknown",
+        "transparency": _band(ngo["transparency_score"]),
+        "risk":         _band(ngo["risk_percent"]),
+    }
+
+
+class FacetIndex:
+    """Immutable once built (one slot per approved NGO of one snapshot), so queries need no lock."""
+
+    def __init__(self, ngos=()):
+        self.slot_of  = {}              # ngo_id → slot
+        self.scores   = []              # slot → {ranged facet: score}
+        self.all      = 0
+        self.bitmaps  = {f: {} for f in FACETS}
+        for n in ngos:
+            if n["status"] == "approved":
+                self._add(n)
+
+    def _add(self, ngo):
+        slot = self.slot_of[ngo["ngo_id"]] = len(self.scores)
+        self.scores.append({f: float(ngo[field]) for f, field in RANGED.items()})
+        bit = 1 << slot
+        for facet, value in facet_values(ngo).items():
+            self.bitmaps[facet][value] = self.bitmaps[facet].get(value, 0) | bit
+        self.all |= bit
+
+    # ── queries ──
+    def mask(self, filters, skip=None):
+        """
+        filters: {facet: iterable of values}, or (lo, hi) for a score facet;
+        empty selections mean "any".
+        """
+        m = self.all
+        for facet, selected in filters.items():
+            if facet == skip or not selected:
+                continue
+            if facet in RANGED and isinstance(selected, tuple):
+                m &= self._range(facet, *selected)
+                continue
+            bitmaps = self.bitmaps[facet]
+            union = 0
+            for v in selected:
+                union |= bitmaps.get(v, 0)
+            m &= union
+        return m
+
+    def _range(self, facet, lo, hi):
+        """Slots whose score lies in [lo, hi]."""
+        out = 0
+        for label in bands_between(lo, hi):
+            bits = self.bitmaps[facet].get(label, 0)
+            b_lo, b_hi = _band_range(label)
+            if lo <= b_lo and b_hi <= hi:
+                out |= bits             # whole band inside the range
+                continue
+            while bits:                 # edge band: check each slot's score
+                low = bits & -bits
+                slot = low.bit_length() - 1
+                if lo <= self.scores[slot][facet] <= hi:
+                    out |= low
+                bits ^= low
+        return out
+
+    def counts(self, filters):
+        """{facet: {value: count}} — each facet counted under the *other* facets' filters."""
+        out = {}
+        for facet, bitmaps in self.bitmaps.items():
+            m = self.mask(filters, skip=facet)
+            out[facet] = {v: (b & m).bit_count() for v, b in bitmaps.items()}
+        return out
+
+    def matches(self, m, ngo_id):
+        slot = self.slot_of.get(ngo_id)
+        return slot is not None and (m >> slot) & 1 == 1
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROCESS-WIDE INDEX
+# ═══════════════════════════════════════════════════════════════════════════════
+_index, _built_for, _index_lock = None, None, threading.Lock()
+
+
+def get_index(snapshot):
+    """Index for exactly this snapshot version (rebuilt only when a new one is published)."""
+    global _index, _built_for
+    with _index_lock:
+        if _built_for != snapshot.published_at:
+            _index, _built_for = FacetIndex(snapshot.ngos), snapshot.published_at
+        return _index
@@ -0,0 +1,124 @@
+"""
+utils/forecast.py — NSITN v2.0
+Vectorised Monte Carlo impact forecast — ranges instead of one point.
+
+For a donation amount, every simulation draws, all at once with NumPy:
+  activity      ~ the NGO's historical spend mix (falls back to an even mix)
+  unit cost     ~ that activity's historical unit costs × lognormal jitter
+  accuracy      ~ the NGO's historical outcome accuracy (bootstrap + jitter)
+  delivered     ~ Binomial(floor(amount / unit cost), accuracy)
+  beneficiaries ~ delivered × a historical beneficiaries-per-unit ratio
+and returns P10/P50/P90 bands. The NGO's history is turned into arrays once
+per row version, so 20 000 simulations take a few milliseconds.
+"""
+
+import functools
+
+from utils.data_manager import UNIT_COST_DEFAULTS
+from utils.partitions import get_allocations_by_ngo, get_outcomes_by_ngo
+from utils.archive import scan
+from utils.store import ngo_version
+
+SIMULATIONS   = 20_000
+PERCENTILES   = (10, 50, 90)
+COST_JITTER   = 0.10                    # σ of the lognormal unit-cost noise
+PRIOR_ACC     = (8.0, 2.0)              # Beta prior (~80%) when an NGO has no outcomes yet
+PRIOR_PER_UNIT = 1.0
+
+
+def _np():
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("Impact forecasting needs numpy — pip install numpy")
+    return np
+
+
+def _float(v, default=0.0):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def available():
+    try:
+        _np()
+        return True
+    except RuntimeError:
+        return False
+
+
+@functools.lru_cache(maxsize=512)
+def _history(ngo_id, version):
+    """NGO history → NumPy arrays, rebuilt only when the NGO's row version moves."""
+    np = _np()
+    # Accuracy history is lifetime: closed years come from the archive
+    allocations = get_allocations_by_ngo(ngo_id)
+    outcomes    = scan(ngo_id, "outcomes") + get_outcomes_by_ngo(ngo_id)
+
+    spend, costs = {}, {}
+    for a in allocations:
+        act = a.get("activity_type", "")
+        spend[act] = spend.get(act, 0.0) + _float(a.get("total_cost"))
+        cost = _float(a.get("unit_cost"))
+        if cost > 0:
+            costs.setdefault(act, []).append(cost)
+    activities = sorted(spend) or sorted(UNIT_COST_DEFAULTS)
+    weights = np.array([spend.get(act, 0.0) for act in activities], dtype=float)
+    weights = weights / weights.sum() if weights.sum() > 0 else np.full(len(activities), 1 / len(activities))
+    # All activities' unit costs in one array; activity i owns pool[offsets[i] : offsets[i] + sizes[i]]
+    pools   = [costs.get(act) or [UNIT_COST_DEFAULTS.get(act, 100)] for act in activities]
+    sizes   = np.array([len(p) for p in pools])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    cost_pool = (np.array([c for p in pools for c in p], dtype=float), offsets, sizes)
+
+    acc = np.array([_float(o.get("outcome_accuracy")) / 100 for o in outcomes], dtype=float)
+    acc = np.clip(acc, 0.0, 1.0)
+    per_unit = np.array([_float(o.get("beneficiaries_reached")) / _float(o.get("actual_units"))
+                         for o in outcomes if _float(o.get("actual_units")) > 0], dtype=float)
+    return activities, weights, cost_pool, acc, per_unit
+
+
+def prepare(ngo_id):
+    """Build and cache an NGO's history arrays without simulating (read-only — the boot warmer)."""
+    _history(ngo_id, ngo_version(ngo_id))
+
+
+def forecast(ngo_id, amount, sims=SIMULATIONS, seed=None):
+    """
+    {"beneficiaries": {p10, p50, p90}, "units": {…}, "top_activity", "activity_mix", "sims"}.
+    Pass seed for repeatable numbers (the UI uses the amount, so a rerun doesn't jitter).
+    """
+    np = _np()
+    activities, weights, (pool, offsets, sizes), acc_hist, per_unit_hist = \
+        _history(ngo_id, ngo_version(ngo_id))
+    rng = np.random.default_rng(seed)
+
+    # Activity per simulation, then a unit cost drawn from that activity's slice of the pool
+    act = rng.choice(len(activities), size=sims, p=weights)
+    cost = pool[offsets[act] + (rng.random(sims) * sizes[act]).astype(np.int64)]
+    cost *= rng.lognormal(0.0, COST_JITTER, sims)
+    planned = np.floor(amount / np.maximum(cost, 1e-9)).astype(np.int64)
+
+    if len(acc_hist):
+        acc = np.clip(acc_hist[rng.integers(0, len(acc_hist), sims)] + rng.normal(0, 0.05, sims), 0, 1)
+    else:
+        acc = rng.beta(*PRIOR_ACC, sims)
+    delivered = rng.binomial(planned, acc)
+
+    per_unit = (per_unit_hist[rng.integers(0, len(per_unit_hist), sims)]
+                if len(per_unit_hist) else np.full(sims, PRIOR_PER_UNIT))
+    beneficiaries = np.floor(delivered * per_unit)
+
+    def bands(x):
+        return {f"p{p}": int(v) for p, v in zip(PERCENTILES, np.percentile(x, PERCENTILES))}
+
+    mix = np.bincount(act, minlength=len(activities)) / sims
+    return {
+        "amount": amount, "sims": sims,
+        "beneficiaries": bands(beneficiaries), "units": bands(delivered),
+        "top_activity": activities[int(np.argmax(mix))],
+        "activity_mix": {a: round(float(m), 3) for a, m in zip(activities, mix) if m > 0},
+        "has_history": bool(len(acc_hist)),
+    }
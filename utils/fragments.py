@@ -0,0 +1,62 @@
+"""
+utils/fragments.py — NSITN v2.0
+Memoised HTML fragments for long card lists and table rows.
+
+Pages build each NGO / donation card as an f-string on every rerun. html()
+keeps the rendered string per (kind, record id) together with the record
+version it was built from; a rerun with the same version reuses the string,
+a new version rebuilds it, so a changed record never serves stale HTML.
+The cache is a bounded LRU shared by every session in the process.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+MAX_FRAGMENTS = int(os.environ.get("NSITN_FRAGMENT_CACHE", "4096"))
+
+
+class FragmentCache:
+    def __init__(self, maxsize=MAX_FRAGMENTS):
+        self.maxsize = maxsize
+        self._items  = OrderedDict()    # (kind, key) → (version, html)
+        self._lock   = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, kind, key, version, build):
+        with self._lock:
+            hit = self._items.get((kind, key))
+            if hit is not None and hit[0] == version:
+                self._items.move_to_end((kind, key))
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+        html = build()                  # outside the lock — sessions render in parallel
+        with self._lock:
+            self._items[(kind, key)] = (version, html)
+            self._items.move_to_end((kind, key))
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return html
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            self._items.pop((kind, key), None)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {"fragments": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+_cache = FragmentCache()
+
+
+def html(kind, key, version, build):
+    """Rendered HTML for one record — build() runs only when (kind, key) is new or its version moved."""
+    return _cache.get(kind, key, version, build)
+
+
+def stats():
+    return _cache.stats
+
@@ -0,0 +1,115 @@
+"""
+utils/leaderboard.py — NSITN v2.0
+Maintained transparency leaderboards: overall, per cause and per location.
+
+Each approved NGO has one row per board in an indexed SQLite table, upserted
+whenever store.run_ngo_analysis writes new scores or an admin decision
+changes status. Reading the top N walks the (board, score) index — O(N),
+never the full NGO table. Shared by every replica through the data dir.
+"""
+
+import os
+import sqlite3
+
+from utils.store import DATA_DIR, on_ngo_change
+
+LEADERBOARD_PATH = os.path.join(DATA_DIR, "leaderboard.sqlite")
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(LEADERBOARD_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS entries (
+        board TEXT, ngo_id TEXT, score REAL, risk REAL, name TEXT, trust_dna TEXT,
+        PRIMARY KEY (board, ngo_id))""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_board_score ON entries (board, score DESC)")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return db
+
+
+def boards_for(ngo):
+    return ["overall",
+            f"cause:{ngo['cause'].strip().lower()}",
+            f"location:{ngo['location'].strip().lower()}"]
+
+
+def _upsert(db, ngo):
+    db.execute("DELETE FROM entries WHERE ngo_id = ?", (ngo["ngo_id"],))
+    if ngo["status"] != "approved":
+        return
+    row = (ngo["ngo_id"], float(ngo["transparency_score"]), float(ngo["risk_percent"]),
+           ngo["name"], ngo["trust_dna"])
+    db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                   [(board, *row) for board in boards_for(ngo)])
+
+
+@on_ngo_change
+def update_ngo(ngo):
+    """Re-place one NGO on its boards (or drop it if no longer approved)."""
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        _upsert(db, ngo)
+        db.execute("COMMIT")
+    finally:
+        db.close()
+
+
+def rebuild(ngos=None):
+    """Full rebuild — only needed once, or after restoring a backup."""
+    if ngos is None:
+        from utils.data_manager import get_all_ngos
+        ngos = get_all_ngos()
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM entries")
+        for ngo in ngos:
+            _upsert(db, ngo)
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+        db.execute("COMMIT")
+    finally:
+        db.close()
+
+
+def _ensure_built():
+    db = _db()
+    try:
+        built = db.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone()
+    finally:
+        db.close()
+    if not built:
+        rebuild()
+
+
+def top(board="overall", n=5):
+    """[{ngo_id, name, transparency_score, risk_percent, trust_dna}] best first."""
+    _ensure_built()
+    db = _db()
+    try:
+        rows = db.execute(
+            "SELECT ngo_id, name, score, risk, trust_dna FROM entries "
+            "WHERE board = ? ORDER BY score DESC LIMIT ?", (board, n)).fetchall()
+    finally:
+        db.close()
+    return [{"ngo_id": i, "name": name, "transparency_score": score,
+             "risk_percent": risk, "trust_dna": dna} for i, name, score, risk, dna in rows]
+
+
+def boards():
+    """Names of all non-empty boards, overall first."""
+    _ensure_built()
+    db = _db()
+    try:
+        names = [r[0] for r in db.execute("SELECT DISTINCT board FROM entries ORDER BY board")]
+    finally:
+        db.close()
+    return sorted(names, key=lambda b: (b != "overall", b))
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    rebuild()
+    print(f"✅ Rebuilt {LEADERBOARD_PATH}: {len(boards())} boards")
@@ -0,0 +1,327 @@
+"""
+utils/ledger.py — NSITN v2.0
+Append-only, tamper-evident ledger of donations, allocations and outcomes.
+
+Every create_donation / add_allocation / record_outcome is appended (via
+store.on_write, as a durable sink: a failed append is logged, parked in the
+store outbox and replayed in order — never a silent gap) as a canonical-JSON
+entry. Entries are hash-chained
+(chain = H(prev chain ‖ leaf)) and are also the leaves of a Merkle tree in the
+RFC 6962 shape. The tree is maintained incrementally: each append stores its
+leaf and completes at most log₂ n parent nodes, and the root of any size is
+folded from the O(log n) perfect subtrees it is made of. A donor's inclusion
+proof is the O(log n) sibling hashes from their entry to the root, and
+verify_inclusion() checks it without touching the database.
+
+    python -m utils.ledger verify        # recompute every hash, compare roots, reconcile with data_manager
+    python -m utils.ledger proof <ref>   # inclusion proof for a donation / alloc / outcome id
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from utils.store import DATA_DIR, lock, on_write
+
+LEDGER_PATH = os.path.join(DATA_DIR, "ledger.sqlite")
+EMPTY_ROOT  = hashlib.sha256(b"").digest()
+GENESIS     = b"\x00" * 32
+
+REF_FIELD = {"donation": "donation_id", "allocation": "alloc_id", "outcome": "outcome_id"}
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(LEDGER_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS entries (seq INTEGER PRIMARY KEY, kind TEXT, ref TEXT,
+                                            payload TEXT, leaf BLOB, chain BLOB);
+        CREATE INDEX IF NOT EXISTS idx_ref ON entries (ref);
+        CREATE TABLE IF NOT EXISTS nodes (level INTEGER, idx INTEGER, hash BLOB,
+                                          PRIMARY KEY (level, idx));
+    """)
+    return db
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# HASHING (RFC 6962 domain separation: 0x00 leaves, 0x01 interior nodes)
+# ═══════════════════════════════════════════════════════════════════════════════
+def canonical(kind, row):
+    return json.dumps({"kind": kind, "row": dict(row)}, sort_keys=True,
+                      separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def leaf_hash(payload):
+    return hashlib.sha256(b"\x00" + payload.encode("utf-8")).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _split(n):
+    """Largest power of two strictly below n (n ≥ 2)."""
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# APPEND
+# ═══════════════════════════════════════════════════════════════════════════════
+def size(db=None):
+    own = db is None
+    db = db or _db()
+    try:
+        return db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    finally:
+        if own:
+            db.close()
+
+
+def append(kind, row):
+    """Append one event; returns its 0-based sequence number."""
+    payload = canonical(kind, row)
+    leaf = leaf_hash(payload)
+    with lock("ledger"):                # one appender across replicas keeps seq dense
+        db = _db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            last = db.execute("SELECT seq, chain FROM entries ORDER BY seq DESC LIMIT 1").fetchone()
+            seq, prev = (last[0] + 1, last[1]) if last else (0, GENESIS)
+            db.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                       (seq, kind, str(row.get(REF_FIELD[kind], "")), payload, leaf,
+                        hashlib.sha256(prev + leaf).digest()))
+            # Complete every perfect subtree this leaf closes: O(log n) parents
+            level, idx, h = 0, seq, leaf
+            db.execute("INSERT INTO nodes VALUES (0, ?, ?)", (idx, h))
+            while idx & 1:
+                left = db.execute("SELECT hash FROM nodes WHERE level = ? AND idx = ?",
+                                  (level, idx - 1)).fetchone()[0]
+                h, level, idx = node_hash(left, h), level + 1, idx >> 1
+                db.execute("INSERT INTO nodes VALUES (?, ?, ?)", (level, idx, h))
+            db.execute("COMMIT")
+            return seq
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+
+@on_write("donation", durable=True)
+def _donation(row):
+    append("donation", row)
+
+
+@on_write("allocation", durable=True)
+def _allocation(row):
+    append("allocation", row)
+
+
+@on_write("outcome", durable=True)
+def _outcome(row):
+    append("outcome", row)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ROOTS AND PROOFS
+# ═══════════════════════════════════════════════════════════════════════════════
+def _subtree(db, lo, hi):
+    """Merkle hash of leaves [lo, hi) — stored directly when it is a perfect aligned subtree."""
+    n = hi - lo
+    if n & (n - 1) == 0 and lo % n == 0:
+        level = n.bit_length() - 1
+        return db.execute("SELECT hash FROM nodes WHERE level = ? AND idx = ?",
+                          (level, lo >> level)).fetchone()[0]
+    k = _split(n)
+    return node_hash(_subtree(db, lo, lo + k), _subtree(db, lo + k, hi))
+
+
+def _path(db, m, lo, hi):
+    if hi - lo == 1:
+        return []
+    k = _split(hi - lo)
+    if m < lo + k:
+        return _path(db, m, lo, lo + k) + [_subtree(db, lo + k, hi)]
+    return _path(db, m, lo + k, hi) + [_subtree(db, lo, lo + k)]
+
+
+def root(n=None):
+    """(tree size, root hex) — the signed-tree-head a donor compares against."""
+    db = _db()
+    try:
+        n = size(db) if n is None else n
+        return n, (_subtree(db, 0, n) if n else EMPTY_ROOT).hex()
+    finally:
+        db.close()
+
+
+def proof_for(ref):
+    """Inclusion proof for the latest entry with this donation/alloc/outcome id, or None."""
+    db = _db()
+    try:
+        db.execute("BEGIN")             # one consistent view of entries + nodes
+        row = db.execute("SELECT seq, kind, payload, leaf FROM entries WHERE ref = ? "
+                         "ORDER BY seq DESC LIMIT 1", (str(ref),)).fetchone()
+        if not row:
+            return None
+        seq, kind, payload, leaf = row
+        n = size(db)
+        proof = {
+            "seq": seq, "kind": kind, "payload": json.loads(payload), "leaf": leaf.hex(),
+            "size": n, "root": _subtree(db, 0, n).hex(),
+            "path": [h.hex() for h in _path(db, seq, 0, n)],
+        }
+        db.execute("COMMIT")
+        return proof
+    finally:
+        db.close()
+
+
+def verify_inclusion(leaf, seq, n, path, expected_root):
+    """RFC 9162 §2.1.3.2 — True if `leaf` sits at `seq` in the size-`n` tree with that root."""
+    if seq >= n:
+        return False
+    fn, sn = seq, n - 1
+    r = bytes.fromhex(leaf)
+    for p in path:
+        p = bytes.fromhex(p)
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            if not fn & 1:
+                while fn and not fn & 1:
+                    fn, sn = fn >> 1, sn >> 1
+        else:
+            r = node_hash(r, p)
+        fn, sn = fn >> 1, sn >> 1
+    return sn == 0 and r.hex() == expected_root
+
+
+def verify_proof(proof):
+    """Check a proof_for() result end to end: payload → leaf → root."""
+    payload = canonical(proof["kind"], proof["payload"]["row"])
+    return (leaf_hash(payload).hex() == proof["leaf"] and
+            verify_inclusion(proof["leaf"], proof["seq"], proof["size"], proof["path"], proof["root"]))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FULL VERIFICATION — one streaming pass, O(n) hashes, O(log n) memory
+# ═══════════════════════════════════════════════════════════════════════════════
+def verify_all(log=print):
+    """Recompute every leaf, the hash chain and the Merkle root. Returns (ok, problems)."""
+    db = _db()
+    problems = []
+    try:
+        db.execute("BEGIN")
+        prev, frontier, expected = GENESIS, [], 0    # frontier: [(height, hash)] perfect subtrees
+        stored_leaves = db.execute("SELECT idx, hash FROM nodes WHERE level = 0 ORDER BY idx")
+        for (seq, kind, payload, leaf, chain), (idx, stored) in zip(
+                db.execute("SELECT seq, kind, payload, leaf, chain FROM entries ORDER BY seq"),
+                stored_leaves):
+            if seq != expected or idx != seq:
+                problems.append(f"gap or reorder at entry {expected}")
+                break
+            expected += 1
+            h = leaf_hash(payload)
+            if h != leaf or h != stored:
+                problems.append(f"entry {seq} ({kind}) payload does not match its leaf hash")
+            if hashlib.sha256(prev + leaf).digest() != chain:
+                problems.append(f"entry {seq} breaks the hash chain")
+            prev = chain
+            height = 0
+            while frontier and frontier[-1][0] == height:
+                h, height = node_hash(frontier.pop()[1], h), height + 1
+            frontier.append((height, h))
+        n = size(db)
+        if expected != n:
+            problems.append(f"{n} entries but {expected} verified leaves")
+        recomputed = EMPTY_ROOT
+        if frontier:
+            recomputed = frontier[-1][1]
+            for _, h in reversed(frontier[:-1]):
+                recomputed = node_hash(h, recomputed)
+        stored_root = _subtree(db, 0, n) if n else EMPTY_ROOT
+        if recomputed != stored_root:
+            problems.append("recomputed Merkle root differs from the stored tree")
+        db.execute("COMMIT")
+    finally:
+        db.close()
+    log(f"{'✅' if not problems else '❌'} {expected} entries, root {recomputed.hex()}")
+    for p in problems[:20]:
+        log(f"   {p}")
+    return not problems, problems
+
+
+def reconcile(log=print):
+    """
+    Cross-check the ledger against data_manager: every donation, allocation and
+    outcome row must have an entry (and a donation's amount must match its latest
+    entry), and every entry must still have its row. Returns (ok, problems).
+    """
+    from utils import data_manager as dm
+    from utils.store import pending
+
+    db = _db()
+    try:
+        latest = {}                     # (kind, ref) → payload of its newest entry
+        for kind, ref, payload in db.execute("SELECT kind, ref, payload FROM entries ORDER BY seq"):
+            latest[(kind, ref)] = payload
+    finally:
+        db.close()
+
+    readers = {"donation": dm.get_donations_by_ngo, "allocation": dm.get_allocations_by_ngo,
+               "outcome": dm.get_outcomes_by_ngo}
+    problems, rows = [], 0
+    for ngo in dm.get_all_ngos():
+        for kind, reader in readers.items():
+            for r in reader(ngo["ngo_id"]):
+                rows += 1
+                ref = str(r.get(REF_FIELD[kind], ""))
+                payload = latest.pop((kind, ref), None)
+                if payload is None:
+                    problems.append(f"{kind} {ref} is in data_manager but not in the ledger")
+                elif kind == "donation" and \
+                        str(json.loads(payload)["row"].get("amount")) != str(r.get("amount")):
+                    problems.append(f"donation {ref}: ledger amount differs from data_manager")
+    for kind, ref in latest:
+        problems.append(f"ledger {kind} {ref} has no data_manager row")
+    parked = sum(pending(sink=fn._sink) for fn in (_donation, _allocation, _outcome))
+    if parked:
+        problems.append(f"{parked} write(s) parked in the store outbox — python -m utils.store replay")
+
+    log(f"{'✅' if not problems else '❌'} {rows} data_manager rows reconciled against the ledger")
+    for p in problems[:20]:
+        log(f"   {p}")
+    return not problems, problems
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="NSITN transparency ledger")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("verify", help="recompute every hash and the Merkle root, reconcile with data_manager")
+    sub.add_parser("root", help="print the current tree size and root")
+    p = sub.add_parser("proof", help="inclusion proof for a donation / allocation / outcome id")
+    p.add_argument("ref")
+    args = parser.parse_args()
+
+    if args.cmd == "verify":
+        from utils.data_manager import init_storage
+        from utils import ledger        # the imported module's sink names, not __main__'s
+        init_storage()
+        ok = verify_all()[0]
+        ok = ledger.reconcile()[0] and ok
+        sys.exit(0 if ok else 1)
+    elif args.cmd == "root":
+        print("%d %s" % root())
+    else:
+        proof = proof_for(args.ref)
+        if not proof:
+            sys.exit(f"❌ {args.ref} is not in the ledger")
+        print(json.dumps(proof, indent=2, ensure_ascii=False))
+        print(f"{'✅ verified' if verify_proof(proof) else '❌ proof does not verify'}", file=sys.stderr)
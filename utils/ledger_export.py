@@ -0,0 +1,178 @@
+"""
+utils/ledger_export.py — NSITN v2.0
+Streaming export of the donations / allocations / outcomes ledger for auditors.
+
+    python -m utils.ledger_export --out ledger/ --format jsonl --from 2025-04-01 --to 2026-03-31
+
+Rows are produced by generators and written in fixed-size chunks, so memory
+stays flat however large the ledger grows (at most one NGO's rows are held
+at a time while the cursor walks the NGO table).
+
+CSV and Parquet columns are declared up front per table (COLUMNS), not
+taken from the first row, so every file of a table has the same header and
+schema. Keys outside the declared columns are kept, as a JSON object in the
+trailing "extra" column — never dropped.
+"""
+
+import argparse
+import csv
+import json
+import os
+from itertools import islice
+
+from utils.data_manager import (
+    get_all_ngos, get_donations_by_ngo, get_allocations_by_ngo, get_outcomes_by_ngo
+)
+
+# table → (per-NGO getter, date field candidates)
+TABLES = {
+    "donations":   (get_donations_by_ngo,   ("donated_at",)),
+    "allocations": (get_allocations_by_ngo, ("alloc_date", "allocated_at", "created_at")),
+    "outcomes":    (get_outcomes_by_ngo,    ("recorded_at",)),
+}
+FORMATS = ("csv", "jsonl", "parquet")
+
+# table → declared export columns (the record fields of utils.records, plus the dates used above)
+COLUMNS = {
+    "donations":   ("donation_id", "donor_id", "ngo_id", "amount", "upi_id", "donated_at", "receipt_id"),
+    "allocations": ("alloc_id", "ngo_id", "donation_id", "activity_type", "unit_cost", "units_planned",
+                    "units_delivered", "total_cost", "alloc_date", "outcome_date"),
+    "outcomes":    ("outcome_id", "alloc_id", "ngo_id", "activity_type", "planned_units", "actual_units",
+                    "outcome_accuracy", "beneficiaries_reached", "recorded_at"),
+}
+EXTRA = "extra"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CURSORS
+# ═══════════════════════════════════════════════════════════════════════════════
+def _row_date(row, fields):
+    for f in fields:
+        if row.get(f):
+            return str(row[f])[:10]
+    return ""
+
+
+def iter_ledger(table, ngo_ids=None, start=None, end=None):
+    """
+    Yield rows of `table` one at a time, optionally limited to `ngo_ids` and to
+    dates in [start, end] (inclusive, YYYY-MM-DD).
+    """
+    getter, date_fields = TABLES[table]
+    wanted = set(ngo_ids) if ngo_ids else None
+    ids = (n["ngo_id"] for n in get_all_ngos()) if wanted is None else iter(sorted(wanted))
+    for ngo_id in ids:
+        for row in getter(ngo_id):
+            day = _row_date(row, date_fields)
+            if start and day < start:
+                continue
+            if end and day > end:
+                continue
+            yield row
+
+
+def iter_donations(ngo_ids=None, start=None, end=None):
+    return iter_ledger("donations", ngo_ids, start, end)
+
+def iter_allocations(ngo_ids=None, start=None, end=None):
+    return iter_ledger("allocations", ngo_ids, start, end)
+
+def iter_outcomes(ngo_ids=None, start=None, end=None):
+    return iter_ledger("outcomes", ngo_ids, start, end)
+
+
+def flatten(row, columns):
+    """Row → {column: value} over the declared columns, other keys as JSON under EXTRA."""
+    out = {c: row.get(c) for c in columns}
+    rest = {k: v for k, v in row.items() if k not in out}
+    out[EXTRA] = json.dumps(rest, ensure_ascii=False, sort_keys=True, default=str) if rest else None
+    return out
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# WRITERS — each consumes chunks and returns the row count
+# ═══════════════════════════════════════════════════════════════════════════════
+def write_csv(chunks, path, columns):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(columns) + [EXTRA], restval="")
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(flatten(r, columns) for r in chunk)
+            count += len(chunk)
+    return count
+
+
+def write_jsonl(chunks, path, columns=None):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in chunk))
+            count += len(chunk)
+    return count
+
+
+def write_parquet(chunks, path, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow — pip install pyarrow")
+
+    # Store fields as strings, like the underlying tables do
+    schema = pa.schema([(k, pa.string()) for k in list(columns) + [EXTRA]])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            rows = [flatten(r, columns) for r in chunk]
+            cols = {k: [None if r[k] is None else str(r[k]) for r in rows] for k in schema.names}
+            writer.write_table(pa.Table.from_pydict(cols, schema=schema))
+            count += len(chunk)
+    return count
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def export_ledger(out_dir, fmt="csv", tables=tuple(TABLES), ngo_ids=None,
+                  start=None, end=None, chunk_size=5000, log=print):
+    """Write one file per table into `out_dir`. Returns {table: row_count}."""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(FORMATS)})")
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+    for table in tables:
+        path = os.path.join(out_dir, f"{table}.{fmt}")
+        counts[table] = WRITERS[fmt](chunked(iter_ledger(table, ngo_ids, start, end), chunk_size), path,
+                                     COLUMNS[table])
+        log(f"✅ {table}: {counts[table]} rows → {path}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NSITN streaming ledger export")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--format", default="csv", choices=FORMATS)
+    parser.add_argument("--tables", nargs="+", default=list(TABLES), choices=list(TABLES))
+    parser.add_argument("--ngo", nargs="+", default=None, help="only these ngo_ids")
+    parser.add_argument("--from", dest="start", default=None, help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--to", dest="end", default=None, help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    from utils.data_manager import init_storage
+    init_storage()
+    export_ledger(args.out, args.format, args.tables, args.ngo, args.start, args.end, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+utils/partitions.py — NSITN v2.0
+Per-NGO partitioned read store for donations, allocations and outcomes.
+
+Rows live in shard files (SQLite, WAL) under DATA_DIR/partitions. A small
+routing directory maps ngo_id → shard: new NGOs hash into one of SHARDS
+shared files, and isolate() moves a hot NGO (a viral campaign) into a file of
+its own. get_*_by_ngo() opens exactly one shard, writers for NGOs on
+different shards never share a file lock, and platform-wide reads fan out
+across shards on a thread pool.
+
+Every write made through utils.store is written through here, under the
+shard lock, as a durable sink: a failed shard write is parked in the store
+outbox and replayed, never dropped. While an NGO has parked writes its
+get_*_by_ngo() reads fall back to data_manager (minus the rows already
+archived), so a reader can never see a partition that has diverged from it.
+data_manager (outside this tree) still owns the physical tables, mints the
+row ids and keeps its global write lock; the shards take every per-NGO read
+off those tables.
+
+Other modules reach a shard only through owned(ngo_id) (the shard under its
+partition lock), query() and fan_out().
+
+Closed financial years are moved out to utils.archive: get_*_by_ngo()
+return the active (hot) tier only, while get_donations_by_donor() and
+totals() also cover the archive, so donor views and platform totals stay
+lifetime-complete.
+
+    python -m utils.partitions rebuild          # bootstrap from data_manager
+    python -m utils.partitions isolate <ngo_id> # give one NGO its own shard
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from utils import store
+from utils.store import DATA_DIR, lock, on_write
+
+PART_DIR  = os.path.join(DATA_DIR, "partitions")
+DIRECTORY = os.path.join(PART_DIR, "directory.sqlite")
+SHARDS    = int(os.environ.get("NSITN_SHARDS", "16"))
+FAN_OUT   = 8                           # threads for platform-wide queries
+
+# table → (key field, time field)
+TABLES = {
+    "donations":   ("donation_id", "donated_at"),
+    "allocations": ("alloc_id",    "alloc_date"),
+    "outcomes":    ("outcome_id",  "recorded_at"),
+}
+DM_READERS = {"donations": "get_donations_by_ngo", "allocations": "get_allocations_by_ngo",
+              "outcomes": "get_outcomes_by_ngo"}
+
+_local   = threading.local()            # per-thread connections, opened once
+_ready   = set()                        # files whose schema exists (checked once per process)
+_built   = False
+_pool    = ThreadPoolExecutor(max_workers=FAN_OUT, thread_name_prefix="partitions")
+log = logging.getLogger(__name__)
+
+
+def _connect(path, schema):
+    conns = _local.__dict__.setdefault("conns", {})
+    db = conns.get(path)
+    if db is None:
+        os.makedirs(PART_DIR, exist_ok=True)
+        db = conns[path] = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _ready:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(schema)
+        _ready.add(path)
+    return db
+
+
+def _directory():
+    return _connect(DIRECTORY, """
+        CREATE TABLE IF NOT EXISTS routes (ngo_id TEXT PRIMARY KEY, shard TEXT);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+
+
+def _shard(name):
+    return _connect(os.path.join(PART_DIR, f"{name}.sqlite"), "".join(
+        f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, ngo_id TEXT, donor_id TEXT, at TEXT, row TEXT);"
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_ngo ON {table} (ngo_id);" for table in TABLES)
+        + "CREATE INDEX IF NOT EXISTS idx_donations_donor ON donations (donor_id);")
+
+
+def _write(db, statements):
+    """Run [(sql, params-or-seq)] in one IMMEDIATE transaction on a cached connection."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, params in statements:
+            (db.executemany if isinstance(params, list) else db.execute)(sql, params)
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ROUTING
+# ═══════════════════════════════════════════════════════════════════════════════
+def shard_for(ngo_id):
+    db = _directory()
+    row = db.execute("SELECT shard FROM routes WHERE ngo_id = ?", (ngo_id,)).fetchone()
+    if not row:
+        name = f"shard-{zlib.crc32(str(ngo_id).encode()) % SHARDS:02d}"
+        db.execute("INSERT OR IGNORE INTO routes VALUES (?, ?)", (ngo_id, name))
+        row = db.execute("SELECT shard FROM routes WHERE ngo_id = ?", (ngo_id,)).fetchone()
+    return row[0]
+
+
+def shards():
+    return sorted(r[0] for r in _directory().execute("SELECT DISTINCT shard FROM routes"))
+
+
+@contextmanager
+def owned(ngo_id):
+    """The NGO's shard connection, held under its partition lock (follows an isolate() that moved it)."""
+    while True:
+        name = shard_for(ngo_id)
+        with lock(f"partition:{name}"):     # only writers on the same shard queue here
+            if shard_for(ngo_id) != name:   # moved by isolate() while we waited
+                continue
+            yield _shard(name)
+            return
+
+
+def isolate(ngo_id):
+    """Move one NGO's rows into a dedicated shard and repoint the directory."""
+    old, new = shard_for(ngo_id), f"ngo-{ngo_id}"
+    if old == new:
+        return new
+    with lock(f"partition:{old}"), lock(f"partition:{new}"):
+        src, dst = _shard(old), _shard(new)
+        _write(dst, [(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)",
+                      src.execute(f"SELECT key, ngo_id, donor_id, at, row FROM {table} "
+                                  "WHERE ngo_id = ? ORDER BY rowid", (ngo_id,)).fetchall())
+                     for table in TABLES])
+        _directory().execute("UPDATE routes SET shard = ? WHERE ngo_id = ?", (new, ngo_id))
+        _write(src, [(f"DELETE FROM {table} WHERE ngo_id = ?", (ngo_id,)) for table in TABLES])
+    return new
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# WRITE — durable sink for utils.store
+# ═══════════════════════════════════════════════════════════════════════════════
+def _put(table, row):
+    key_field, at_field = TABLES[table]
+    ngo_id = row.get("ngo_id")
+    if not ngo_id:
+        raise ValueError(f"{table} row {row.get(key_field)} has no ngo_id — cannot be partitioned")
+    with owned(ngo_id) as shard:
+        shard.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)",
+                      (str(row.get(key_field, "")), ngo_id, row.get("donor_id"),
+                       str(row.get(at_field, "")), json.dumps(dict(row), default=str)))
+
+
+@on_write("donation", durable=True)
+def _donation(row):
+    _put("donations", row)
+
+
+@on_write("allocation", durable=True)
+def _allocation(row):
+    _put("allocations", row)
+
+
+@on_write("outcome", durable=True)
+def _outcome(row):
+    _put("outcomes", row)
+
+
+def rebuild():
+    """Bootstrap every partition from data_manager (one NGO at a time)."""
+    global _built
+    from utils import data_manager as dm
+
+    for ngo in dm.get_all_ngos():
+        ngo_id = ngo["ngo_id"]
+        name = shard_for(ngo_id)
+        with lock(f"partition:{name}"):
+            statements = []
+            for table, reader in DM_READERS.items():
+                key_field, at_field = TABLES[table]
+                statements += [
+                    (f"DELETE FROM {table} WHERE ngo_id = ?", (ngo_id,)),
+                    (f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)", [
+                        (str(r.get(key_field, "")), ngo_id, r.get("donor_id"),
+                         str(r.get(at_field, "")), json.dumps(dict(r, ngo_id=ngo_id), default=str))
+                        for r in getattr(dm, reader)(ngo_id)]),
+                ]
+            _write(_shard(name), statements)
+    _directory().execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+    _built = True
+    from utils.archive import tier
+    tier()                              # closed years were reloaded too — send them back to the archive
+
+
+def _ensure_built():
+    if _built:                          # checked against the file once per process
+        return
+    if _directory().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone():
+        globals()["_built"] = True
+    else:
+        rebuild()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READ — one shard per NGO, fan-out for everything else
+# ═══════════════════════════════════════════════════════════════════════════════
+def by_ngo(table, ngo_id):
+    """One NGO's active-tier rows of `table`, oldest first."""
+    _ensure_built()
+    if store.pending(ngo_id):           # a write hasn't reached the shard yet: read the source
+        from utils import data_manager as dm
+        from utils.archive import TIERED, archived_keys
+        rows = [dict(r, ngo_id=ngo_id) for r in getattr(dm, DM_READERS[table])(ngo_id)]
+        if table in TIERED:             # data_manager still holds closed years: keep them archived
+            gone, key_field = archived_keys(ngo_id, table), TABLES[table][0]
+            rows = [r for r in rows if str(r.get(key_field, "")) not in gone]
+        return rows
+    return [json.loads(r[0]) for r in query(ngo_id, f"SELECT row FROM {table} WHERE ngo_id = ? ORDER BY rowid",
+                                            (ngo_id,))]
+
+
+def get_donations_by_ngo(ngo_id):
+    return by_ngo("donations", ngo_id)
+
+
+def get_allocations_by_ngo(ngo_id):
+    return by_ngo("allocations", ngo_id)
+
+
+def get_outcomes_by_ngo(ngo_id):
+    return by_ngo("outcomes", ngo_id)
+
+
+def query(ngo_id, sql, params=()):
+    """Run one read-only SQL query on the NGO's shard → rows."""
+    _ensure_built()
+    return _shard(shard_for(ngo_id)).execute(sql, params).fetchall()
+
+
+def fan_out(query, params=()):
+    """Run one read-only SQL query on every shard concurrently → [rows per shard]."""
+    _ensure_built()
+    return list(_pool.map(lambda name: _shard(name).execute(query, params).fetchall(), shards()))
+
+
+def get_donations_by_donor(donor_id):
+    """Every donation by this donor, oldest first — archived years included."""
+    from utils.archive import donations_by_donor
+    rows = [r for part in fan_out("SELECT at, row FROM donations WHERE donor_id = ?", (donor_id,))
+            for r in part]
+    return donations_by_donor(donor_id) + [json.loads(row) for _, row in sorted(rows)]
+
+
+def totals():
+    """Platform-wide lifetime {donations, total_raised, allocations, total_allocated, outcomes}."""
+    from utils.archive import totals as archived
+    parts = fan_out("""
+        SELECT (SELECT COUNT(*) FROM donations),
+               (SELECT COALESCE(SUM(CAST(json_extract(row, '$.amount') AS REAL)), 0) FROM donations),
+               (SELECT COUNT(*) FROM allocations),
+               (SELECT COALESCE(SUM(CAST(json_extract(row, '$.total_cost') AS REAL)), 0) FROM allocations),
+               (SELECT COUNT(*) FROM outcomes)""")
+    sums = [sum(p[0][i] for p in parts) for i in range(5)] if parts else [0] * 5
+    out = dict(zip(("donations", "total_raised", "allocations", "total_allocated", "outcomes"), sums))
+    cold = archived()                   # closed years, from segment summaries only
+    for k in ("donations", "total_raised", "outcomes"):
+        out[k] += cold[k]
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NSITN per-NGO partitions")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="bootstrap partitions from data_manager")
+    p = sub.add_parser("isolate", help="move one NGO to a dedicated shard")
+    p.add_argument("ngo_id")
+    args = parser.parse_args()
+
+    if args.cmd == "rebuild":
+        from utils.data_manager import init_storage
+        init_storage()
+        rebuild()
+        print(f"✅ Rebuilt {len(shards())} shard(s) in {PART_DIR}: {totals()}")
+    else:
+        print(f"✅ {args.ngo_id} now lives in {isolate(args.ngo_id)}")
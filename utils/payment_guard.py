@@ -0,0 +1,193 @@
+"""
+utils/payment_guard.py — NSITN v2.0
+Duplicate-payment & UPI-velocity guard for the donation write path.
+Idempotency-key index + Bloom filter + count-min sketch: fixed size per
+window, O(1) checks, no matter how many donations are already on record.
+
+All three live in a small SQLite file in DATA_DIR, so every replica claims
+keys from the same index and sees the same fingerprints and velocities. The
+sketches are stored sparsely — one row per set bit / non-zero counter — and
+windows are aligned to the clock (time // window_seconds), so replicas agree
+on which window is current without coordinating a rotation.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from utils.store import DATA_DIR
+
+GUARD_PATH = os.path.join(DATA_DIR, "payment_guard.sqlite")
+KEY_TTL    = 86400                      # seconds an idempotency key is remembered
+
+_local = threading.local()
+
+
+def _db():
+    db = getattr(_local, "db", None)
+    if db is None:                      # one connection per thread, reused across checks
+        os.makedirs(DATA_DIR, exist_ok=True)
+        db = sqlite3.connect(GUARD_PATH, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, donation_id TEXT, at REAL);
+            CREATE INDEX IF NOT EXISTS idx_keys_at ON keys (at);
+            CREATE TABLE IF NOT EXISTS bloom (win INTEGER, bit INTEGER, PRIMARY KEY (win, bit)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS cms (win INTEGER, row INTEGER, col INTEGER, n INTEGER,
+                                            PRIMARY KEY (win, row, col)) WITHOUT ROWID;
+        """)
+        _local.db = db
+    return db
+
+
+def _hashes(key, k, m):
+    """k bucket indexes in [0, m) via Kirsch–Mitzenmacher double hashing."""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % m for i in range(k)]
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BLOOM FILTER
+# ═══════════════════════════════════════════════════════════════════════════════
+class BloomFilter:
+    """Set membership with no false negatives and ~error_rate false positives, one bit set per window."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        m = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.m = m
+        self.k = max(1, round(m / capacity * math.log(2)))
+
+    def add(self, db, win, key):
+        db.executemany("INSERT OR IGNORE INTO bloom VALUES (?, ?)",
+                       [(win, i) for i in _hashes(key, self.k, self.m)])
+
+    def contains(self, db, wins, key):
+        """True if key is in any of the windows."""
+        bits = _hashes(key, self.k, self.m)
+        for win in wins:
+            found = db.execute(f"SELECT COUNT(*) FROM bloom WHERE win = ? AND bit IN ({','.join('?' * len(bits))})",
+                               [win] + bits).fetchone()[0]
+            if found == len(set(bits)):
+                return True
+        return False
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# COUNT-MIN SKETCH
+# ═══════════════════════════════════════════════════════════════════════════════
+class CountMinSketch:
+    """Frequency estimates that never under-count, one width × depth table per window."""
+
+    def __init__(self, width=4096, depth=4):
+        self.width = width
+        self.depth = depth
+
+    def add(self, db, win, key, count=1):
+        db.executemany("INSERT INTO cms VALUES (?, ?, ?, ?) ON CONFLICT (win, row, col) "
+                       "DO UPDATE SET n = n + excluded.n",
+                       [(win, row, col, count) for row, col in enumerate(_hashes(key, self.depth, self.width))])
+
+    def estimate(self, db, wins, key):
+        """Sum over the windows of each window's estimate."""
+        cells = list(enumerate(_hashes(key, self.depth, self.width)))
+        where = " OR ".join("(row = ? AND col = ?)" for _ in cells)
+        total = 0
+        for win in wins:
+            counts = dict.fromkeys(range(self.depth), 0)
+            for row, n in db.execute(f"SELECT row, n FROM cms WHERE win = ? AND ({where})",
+                                     [win] + [v for cell in cells for v in cell]):
+                counts[row] = n
+            total += min(counts.values())
+        return total
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PAYMENT GUARD
+# ═══════════════════════════════════════════════════════════════════════════════
+class PaymentGuard:
+    """
+    Guard consulted by page_donate before create_donation; its state is shared by every replica.
+
+    - Idempotency keys: one per "PAY NOW" click; replays of the same key map
+      back to the donation already recorded instead of creating another.
+    - Repeat fingerprints (donor, NGO, amount, UPI) seen in the current or
+      previous window are reported so the UI can ask for confirmation.
+    - UPI velocity: payments per UPI over the current + previous window.
+
+    Windows are `window_seconds` long; older ones are swept, so both
+    sketches stay fixed-size.
+    """
+
+    def __init__(self, window_seconds=600, max_per_upi=5,
+                 window_capacity=1_000_000, key_ttl=KEY_TTL):
+        self.window_seconds = window_seconds
+        self.max_per_upi    = max_per_upi
+        self.key_ttl        = key_ttl
+        self._seen          = BloomFilter(window_capacity)
+        self._velocity      = CountMinSketch()
+        self._swept         = None      # last window this process swept for
+
+    @staticmethod
+    def fingerprint(donor_id, ngo_id, amount, upi):
+        return f"{donor_id}|{ngo_id}|{float(amount):.2f}|{upi.strip().lower()}"
+
+    def _windows(self):
+        """(current, previous) window numbers; sweeps expired state once per window per process."""
+        now = time.time()
+        win = int(now // self.window_seconds)
+        if self._swept != win:
+            self._swept = win
+            db = _db()
+            db.execute("DELETE FROM bloom WHERE win < ?", (win - 1,))
+            db.execute("DELETE FROM cms WHERE win < ?", (win - 1,))
+            db.execute("DELETE FROM keys WHERE at < ?", (now - self.key_ttl,))
+        return win, win - 1
+
+    def is_repeat(self, donor_id, ngo_id, amount, upi):
+        fp = self.fingerprint(donor_id, ngo_id, amount, upi)
+        return self._seen.contains(_db(), self._windows(), fp)
+
+    def upi_velocity(self, upi):
+        return self._velocity.estimate(_db(), self._windows(), upi.strip().lower())
+
+    def velocity_exceeded(self, upi):
+        return self.upi_velocity(upi) >= self.max_per_upi
+
+    def claim(self, key):
+        """
+        Reserve an idempotency key. Returns (True, None) for a fresh key, or
+        (False, donation_id) if the key was already used — donation_id is None
+        while the first request is still writing.
+        """
+        db = _db()
+        if db.execute("INSERT OR IGNORE INTO keys VALUES (?, NULL, ?)", (key, time.time())).rowcount:
+            return True, None
+        row = db.execute("SELECT donation_id FROM keys WHERE key = ?", (key,)).fetchone()
+        return False, row[0] if row else None
+
+    def release(self, key):
+        """
+        Give back a claimed key whose donation was never written, so it can be
+        retried. Keys already mapped to a donation (record()) are kept.
+        """
+        _db().execute("DELETE FROM keys WHERE key = ? AND donation_id IS NULL", (key,))
+
+    def record(self, key, donation_id, donor_id, ngo_id, amount, upi):
+        fp = self.fingerprint(donor_id, ngo_id, amount, upi)
+        win, _ = self._windows()
+        db = _db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT INTO keys VALUES (?, ?, ?) ON CONFLICT (key) "
+                       "DO UPDATE SET donation_id = excluded.donation_id", (key, donation_id, time.time()))
+            self._seen.add(db, win, fp)
+            self._velocity.add(db, win, upi.strip().lower())
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
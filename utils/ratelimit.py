@@ -0,0 +1,146 @@
+"""
+utils/ratelimit.py — NSITN v2.0
+Token-bucket rate limits and load shedding for the expensive user paths.
+
+Rate limits: one token bucket per (scope, key kind, key) — e.g. login by
+session and by email, donate by UPI — kept in a small SQLite file so every
+replica draws from the same buckets. A request must get a token from every
+bucket it names. Refill is computed lazily from the elapsed time, so an idle
+bucket costs nothing.
+
+Backpressure: admit(path) counts in-flight work per process. Each path has
+a priority, and lower priorities are shed at a lower queue depth — chat and
+score analysis go first, sign-up/login next, and donations are never shed.
+
+    from utils.ratelimit import check, admit
+    ok, msg = check("login", session=sid, email=email)
+    with admit("chat") as admitted: ...
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.store import DATA_DIR
+
+LIMITS_PATH = os.path.join(DATA_DIR, "ratelimit.sqlite")
+
+# scope → {key kind: (tokens per minute, burst)}
+POLICIES = {
+    "login":  {"session": (10, 5),  "email": (5, 5)},
+    "signup": {"session": (3, 3),   "email": (2, 2)},
+    "donate": {"session": (6, 3),   "upi": (4, 3)},
+    "chat":   {"session": (20, 10)},
+}
+
+# path → max in-flight requests (this process) before it is shed; None = never shed
+SHED_AT = {
+    "chat":     int(os.environ.get("NSITN_SHED_LOW", "8")),
+    "analysis": int(os.environ.get("NSITN_SHED_LOW", "8")),
+    "signup":   int(os.environ.get("NSITN_SHED_MID", "24")),
+    "login":    int(os.environ.get("NSITN_SHED_MID", "24")),
+    "donate":   None,
+}
+
+SWEEP_EVERY = 3600                      # seconds between sweeps of idle buckets, per process
+BUSY_MSG    = "The platform is busy right now — please try again in a moment."
+
+_local      = threading.local()
+_last_sweep = 0.0
+
+
+def _db():
+    db = getattr(_local, "db", None)
+    if db is None:                      # one connection per thread, reused across checks
+        os.makedirs(DATA_DIR, exist_ok=True)
+        db = sqlite3.connect(LIMITS_PATH, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")     # buckets are advisory, not ledger data
+        db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        _local.db = db
+    return db
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TOKEN BUCKETS
+# ═══════════════════════════════════════════════════════════════════════════════
+def take(buckets, cost=1.0, now=None):
+    """
+    buckets: [(key, per_minute, burst)]. Takes `cost` from every bucket or from none.
+    Returns (True, 0) or (False, seconds until the emptiest bucket can pay).
+    """
+    global _last_sweep
+    now = time.time() if now is None else now
+    if now - _last_sweep > SWEEP_EVERY:
+        _last_sweep = now
+        sweep()
+    db = _db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        levels, wait = [], 0.0
+        for key, per_minute, burst in buckets:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * per_minute / 60)
+            if tokens < cost:
+                wait = max(wait, (cost - tokens) * 60 / per_minute)
+            levels.append((key, tokens))
+        if wait:
+            db.execute("ROLLBACK")
+            return False, wait
+        db.executemany("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                       [(key, tokens - cost, now) for key, tokens in levels])
+        db.execute("COMMIT")
+        return True, 0.0
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+def check(scope, **keys):
+    """check("login", session=sid, email=email) → (True, "") or (False, message)."""
+    policy = POLICIES[scope]
+    buckets = [(f"{scope}:{kind}:{str(value).strip().lower()}", *policy[kind])
+               for kind, value in keys.items() if value and kind in policy]
+    if not buckets:
+        return True, ""
+    ok, wait = take(buckets)
+    if ok:
+        return True, ""
+    return False, f"Too many attempts — please try again in {max(int(wait + 0.999), 1)}s."
+
+
+def sweep(older_than=86400):
+    """Drop buckets idle long enough to have refilled completely (take() runs this hourly)."""
+    db = _db()
+    db.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - older_than,))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BACKPRESSURE
+# ═══════════════════════════════════════════════════════════════════════════════
+_inflight, _inflight_lock = {}, threading.Lock()
+
+
+def depth():
+    """Total in-flight admitted requests in this process."""
+    with _inflight_lock:
+        return sum(_inflight.values())
+
+
+@contextmanager
+def admit(path):
+    """Yields True if the request may run, False if it should be shed (caller degrades)."""
+    limit = SHED_AT.get(path)
+    with _inflight_lock:
+        current = sum(_inflight.values())
+        admitted = limit is None or current < limit
+        if admitted:
+            _inflight[path] = _inflight.get(path, 0) + 1
+    try:
+        yield admitted
+    finally:
+        if admitted:
+            with _inflight_lock:
+                _inflight[path] -= 1
@@ -0,0 +1,207 @@
+"""
+utils/receipt_batch.py — NSITN v2.0
+Year-end receipt pipeline: regenerate every donor's receipts for a financial
+year, render them in a process pool and pack them into compressed archives.
+
+    python -m utils.receipt_batch --fy 2025 --out receipts_fy2025 --format txt pdf
+
+Resumable: donations are spooled once into an on-disk SQLite table ordered
+by donor, archives are written in parts, and checkpoint.json records the last
+donor of every finished part. Re-running the same command continues from there.
+Memory is bounded by --part-size and --workers, not by the number of donors.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from utils.receipts import RENDERERS
+
+CHECKPOINT = "checkpoint.json"
+SPOOL      = "spool.sqlite"
+
+
+def fy_bounds(fy):
+    """Indian financial year `fy` runs 1 April fy → 31 March fy+1."""
+    return f"{fy}-04-01", f"{fy + 1}-04-01"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STAGE 1 — SPOOL (one NGO in memory at a time)
+# ═══════════════════════════════════════════════════════════════════════════════
+def spool_donations(path, fy):
+    from utils.data_manager import get_all_ngos, get_donations_by_ngo, get_receipt_by_donation
+
+    start, end = fy_bounds(fy)
+    db = sqlite3.connect(path)
+    db.execute("DROP TABLE IF EXISTS receipts")
+    db.execute("CREATE TABLE receipts (donor_id TEXT, donated_at TEXT, payload TEXT)")
+    skipped = 0
+    for ngo in get_all_ngos():
+        ngo_info = {k: ngo[k] for k in ("trust_dna", "transparency_score", "risk_percent")}
+        rows = []
+        for d in get_donations_by_ngo(ngo["ngo_id"]):
+            if not (start <= d["donated_at"][:10] < end):
+                continue
+            receipt = get_receipt_by_donation(d["donation_id"])
+            if not receipt:
+                skipped += 1
+                continue
+            rows.append((d["donor_id"], d["donated_at"],
+                         json.dumps({"receipt": receipt, "ngo": ngo_info})))
+        db.executemany("INSERT INTO receipts VALUES (?, ?, ?)", rows)
+        db.commit()
+    db.execute("CREATE INDEX idx_donor ON receipts (donor_id, donated_at)")
+    db.commit()
+    db.close()
+    return skipped
+
+
+def iter_donors(path, after):
+    """Yield (donor_id, [payload, ...]) in donor order, strictly after `after`."""
+    db = sqlite3.connect(path)
+    cur = db.execute(
+        "SELECT donor_id, payload FROM receipts WHERE donor_id > ? ORDER BY donor_id, donated_at",
+        (after or "",))
+    for donor_id, rows in groupby(cur, key=lambda r: r[0]):
+        yield donor_id, [json.loads(p) for _, p in rows]
+    db.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STAGE 2 — RENDER (worker processes)
+# ═══════════════════════════════════════════════════════════════════════════════
+def render_donor(donor_id, payloads, formats):
+    files = []
+    total = 0.0
+    lines = []
+    for p in payloads:
+        r, n = p["receipt"], p["ngo"]
+        total += float(r["amount"])
+        lines.append(f"{r['donated_at'][:10]}  {r['receipt_id']:<16} {r['ngo_name'][:30]:<30} ₹{float(r['amount']):>12,.2f}")
+        for fmt in formats:
+            files.append((f"{donor_id}/{r['receipt_id']}.{fmt}", RENDERERS[fmt](r, n)))
+    first = payloads[0]["receipt"]
+    summary = "\n".join([
+        "NSITN — ANNUAL DONATION STATEMENT",
+        f"Donor : {first['donor_name']} <{first['donor_email']}>",
+        f"Count : {len(payloads)}",
+        f"Total : ₹{total:,.2f}",
+        "",
+        *lines,
+    ])
+    files.append((f"{donor_id}/statement.txt", summary.encode("utf-8")))
+    return donor_id, len(payloads), files
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STAGE 3 — ARCHIVE (checkpointed parts)
+# ═══════════════════════════════════════════════════════════════════════════════
+def _load_checkpoint(out_dir):
+    path = os.path.join(out_dir, CHECKPOINT)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def _save_checkpoint(out_dir, state):
+    path = os.path.join(out_dir, CHECKPOINT)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def run_batch(fy, out_dir, formats=("txt",), workers=None, part_size=500, log=print):
+    """Generate all receipts for financial year `fy` into `out_dir`. Returns the checkpoint."""
+    os.makedirs(out_dir, exist_ok=True)
+    state = _load_checkpoint(out_dir)
+    if state and state["fy"] != fy:
+        raise ValueError(f"{out_dir} holds a FY{state['fy']} run — use a different --out")
+    if not state:
+        state = {"fy": fy, "formats": list(formats), "spooled": False,
+                 "parts": [], "last_donor": None, "donors": 0, "receipts": 0}
+    if state.get("complete"):
+        log(f"FY{fy} already complete in {out_dir}")
+        return state
+    formats = state["formats"]
+
+    spool = os.path.join(out_dir, SPOOL)
+    if not state["spooled"]:
+        state["skipped"] = spool_donations(spool, fy)
+        state["spooled"] = True
+        _save_checkpoint(out_dir, state)
+        log(f"Spooled FY{fy} donations ({state['skipped']} without receipts skipped)")
+
+    # Drop a half-written part from an interrupted run
+    part_no = len(state["parts"]) + 1
+    part_name = f"part-{part_no:05d}.zip"
+    if os.path.exists(os.path.join(out_dir, part_name)):
+        os.remove(os.path.join(out_dir, part_name))
+
+    donors = iter_donors(spool, state["last_donor"])
+    in_flight = deque()
+    max_in_flight = (workers or os.cpu_count() or 1) * 4
+    archive, in_part = None, 0
+
+    def flush(result):
+        nonlocal archive, in_part, part_no, part_name
+        donor_id, count, files = result
+        if archive is None:
+            archive = zipfile.ZipFile(os.path.join(out_dir, part_name), "w", zipfile.ZIP_DEFLATED)
+        for name, data in files:
+            archive.writestr(name, data)
+        in_part += 1
+        state["donors"] += 1
+        state["receipts"] += count
+        state["last_donor"] = donor_id
+        if in_part >= part_size:
+            archive.close()
+            state["parts"].append(part_name)
+            _save_checkpoint(out_dir, state)
+            log(f"✅ {part_name}: {state['donors']} donors so far")
+            archive, in_part = None, 0
+            part_no += 1
+            part_name = f"part-{part_no:05d}.zip"
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for donor_id, payloads in donors:
+            in_flight.append(pool.submit(render_donor, donor_id, payloads, formats))
+            # Results are archived in donor order so the checkpoint stays a prefix
+            while len(in_flight) >= max_in_flight:
+                flush(in_flight.popleft().result())
+        while in_flight:
+            flush(in_flight.popleft().result())
+
+    if archive is not None:
+        archive.close()
+        state["parts"].append(part_name)
+    state["complete"] = True
+    _save_checkpoint(out_dir, state)
+    os.remove(spool)
+    log(f"🎉 FY{fy}: {state['receipts']} receipts for {state['donors']} donors in {len(state['parts'])} archive(s)")
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NSITN year-end receipt generation")
+    parser.add_argument("--fy", type=int, required=True, help="financial year start, e.g. 2025 for FY2025-26")
+    parser.add_argument("--out", required=True, help="output directory (re-use it to resume)")
+    parser.add_argument("--format", nargs="+", default=["txt"], choices=sorted(RENDERERS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--part-size", type=int, default=500, help="donors per archive part")
+    args = parser.parse_args(argv)
+
+    from utils.data_manager import init_storage
+    init_storage()
+    run_batch(args.fy, args.out, tuple(args.format), args.workers, args.part_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+utils/receipts.py — NSITN v2.0
+Receipt rendering shared by the donate page and the year-end batch job.
+Plain functions over receipt/NGO dicts — safe to call from worker processes.
+"""
+
+import html
+
+
+def render_receipt_text(receipt, ngo):
+    return f"""
+╔══════════════════════════════════════════════╗
+             NSITN — OFFICIAL RECEIPT           
+══════════════════════════════════════════════
+  Receipt ID   : {receipt['receipt_id']}
+  Donation ID  : {receipt['donation_id']}
+══════════════════════════════════════════════
+  Donor Name   : {receipt['donor_name']}
+  Donor Email  : {receipt['donor_email']}
+  UPI ID       : {receipt['upi_id']}
+══════════════════════════════════════════════
+  NGO Name     : {receipt['ngo_name']}
+  Amount       : ₹{float(receipt['amount']):,.2f}
+  Date/Time    : {receipt['donated_at']}
+══════════════════════════════════════════════
+  Trust DNA    : {ngo['trust_dna']}
+  Transparency : {ngo['transparency_score']}%
+  Risk         : {ngo['risk_percent']}%
+══════════════════════════════════════════════
+  Generated    : {receipt['generated_at']}
+  NSITN v2.0   — Powered by DOTE Engine
+╚══════════════════════════════════════════════╝
+""".strip()
+
+
+def render_receipt_html(receipt, ngo):
+    text = html.escape(render_receipt_text(receipt, ngo))
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>NSITN Receipt {html.escape(receipt['receipt_id'])}</title>
+<style>
+body {{ font-family: 'Inter', sans-serif; background: #F5F7FA; }}
+.receipt-box {{ font-family: monospace; white-space: pre; background: #FAFAFA;
+    border: 1.5px dashed #CBD5E0; border-radius: 12px; padding: 20px 24px;
+    font-size: 13px; line-height: 1.8; max-width: 560px; margin: 40px auto; }}
+</style></head>
+<body><div class="receipt-box">{text}</div></body></html>"""
+
+
+def render_receipt_pdf(receipt, ngo):
+    """PDF bytes via reportlab (optional dependency)."""
+    try:
+        from io import BytesIO
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        raise RuntimeError("PDF receipts need reportlab — pip install reportlab")
+
+    buf = BytesIO()
+    pdf = canvas.Canvas(buf, pagesize=A4)
+    pdf.setTitle(f"NSITN Receipt {receipt['receipt_id']}")
+    pdf.setFont("Courier", 10)
+    y = A4[1] - 72
+    # Core PDF fonts have no ₹ glyph
+    for line in render_receipt_text(receipt, ngo).replace("₹", "Rs.").splitlines():
+        pdf.drawString(56, y, line)
+        y -= 15
+    pdf.showPage()
+    pdf.save()
+    return buf.getvalue()
+
+
+RENDERERS = {
+    "txt":  lambda r, n: render_receipt_text(r, n).encode("utf-8"),
+    "html": lambda r, n: render_receipt_html(r, n).encode("utf-8"),
+    "pdf":  render_receipt_pdf,
+}
@@ -0,0 +1,346 @@
+"""
+utils/recommender.py — NSITN v2.0
+"NGOs like the ones you support" — precomputed item-item recommendations.
+
+Offline: the donor × NGO matrix A is kept sparse (one row per donor→NGO
+pair); AᵀA co-donation counts come from walking each donor's NGO list, and
+cosine similarity is blended with attribute similarity (cause, location,
+Trust DNA, transparency). The top-K neighbours of every approved NGO are
+stored in SQLite.
+
+Online: suggestions for a donor are two indexed lookups — the donor's NGOs,
+then their neighbours — so they serve in milliseconds.
+
+Refresh is off the write path: a background thread (start()) tails the
+utils.changefeed as the "recommender" consumer. Each batch of events updates
+the sparse counts and re-ranks, once, only the NGOs whose lists the batch can
+move (a new donor→NGO pair re-ranks the NGO's partners; an NGO change the
+lists it can enter or leave). Batches and rebuilds run under
+lock("recommender"), so one replica at a time applies them; donations never
+wait on this file. A batch that fails is not committed and is retried.
+
+rebuild() writes a fresh generation into *_next tables in short autocommit
+steps, then swaps them in with one brief transaction and moves the consumer
+to the feed head it read before the build, so events that arrived during
+the build are replayed on top.
+
+    python -m utils.recommender      # full rebuild
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from itertools import chain
+
+from utils import changefeed
+from utils.store import DATA_DIR, lock
+
+RECS_PATH = os.path.join(DATA_DIR, "recommendations.sqlite")
+TOP_K     = 10
+W_COVISIT = 0.7                         # co-donation cosine vs attribute similarity
+CONSUMER  = "recommender"
+EVENTS    = ("donation.created", "ngo.registered", "ngo.decided", "ngo.scored")
+BATCH     = 500
+POLL      = 2.0                         # seconds between polls of an idle feed
+
+TABLES = {
+    "donor_ngos": "donor_id TEXT, ngo_id TEXT, PRIMARY KEY (donor_id, ngo_id)",
+    "co":         "a TEXT, b TEXT, n INTEGER, PRIMARY KEY (a, b)",
+    "ngos":       "ngo_id TEXT PRIMARY KEY, cause TEXT, location TEXT, trust_dna TEXT, score REAL, approved INTEGER",
+    "neighbours": "ngo_id TEXT, other TEXT, score REAL, PRIMARY KEY (ngo_id, other)",
+}
+
+log = logging.getLogger(__name__)
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(RECS_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("".join(f"CREATE TABLE IF NOT EXISTS {t} ({cols});" for t, cols in TABLES.items()) + """
+        CREATE INDEX IF NOT EXISTS idx_ngo_donors ON donor_ngos (ngo_id);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    return db
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SIMILARITY
+# ═══════════════════════════════════════════════════════════════════════════════
+def _attr_similarity(a, b):
+    """a, b: (cause, location, trust_dna, score) tuples → [0, 1]."""
+    sim  = 0.4 if a[0] == b[0] else 0.0
+    sim += 0.2 if a[1] == b[1] else 0.0
+    # Trust DNA codes share a prefix when NGOs have a similar profile
+    dna_a, dna_b = a[2] or "", b[2] or ""
+    common = next((i for i, (x, y) in enumerate(zip(dna_a, dna_b)) if x != y), min(len(dna_a), len(dna_b)))
+    sim += 0.1 * common / max(len(dna_a), len(dna_b), 1)
+    sim += 0.3 * (1 - min(abs(a[3] - b[3]), 100) / 100)
+    return sim
+
+
+def _top(ngo_id, attrs, co, degree):
+    """Top-K [(ngo_id, other, score)] of one NGO, given its co-donation counts {other: n}."""
+    me = attrs.get(ngo_id)
+    if not me:
+        return []
+    scored = []
+    for other, attr in attrs.items():
+        if other == ngo_id:
+            continue
+        cos = 0.0
+        if other in co:
+            cos = co[other] / math.sqrt(degree.get(ngo_id, 1) * degree.get(other, 1))
+        scored.append((W_COVISIT * cos + (1 - W_COVISIT) * _attr_similarity(me, attr), other))
+    scored.sort(reverse=True)
+    return [(ngo_id, other, score) for score, other in scored[:TOP_K]]
+
+
+def _rank(db, ngo_id, attrs, degree):
+    """Recompute and store the top-K neighbours of one NGO."""
+    db.execute("DELETE FROM neighbours WHERE ngo_id = ?", (ngo_id,))
+    co = dict(db.execute("SELECT b, n FROM co WHERE a = ?", (ngo_id,)).fetchall())
+    db.executemany("INSERT INTO neighbours VALUES (?, ?, ?)", _top(ngo_id, attrs, co, degree))
+
+
+def _approved_attrs(db):
+    return {r[0]: r[1:] for r in db.execute(
+        "SELECT ngo_id, cause, location, trust_dna, score FROM ngos WHERE approved = 1")}
+
+
+def _degrees(db, ngo_ids):
+    marks = ",".join("?" * len(ngo_ids))
+    return dict(db.execute(f"SELECT ngo_id, COUNT(*) FROM donor_ngos WHERE ngo_id IN ({marks}) "
+                           "GROUP BY ngo_id", list(ngo_ids)).fetchall())
+
+
+def _partners(db, ngo_id):
+    return [r[0] for r in db.execute("SELECT b FROM co WHERE a = ?", (ngo_id,))]
+
+
+def _degrees_around(db, ngo_ids):
+    """Degrees of ngo_ids and of every NGO they share a donor with."""
+    marks = ",".join("?" * len(ngo_ids))
+    partners = [r[0] for r in db.execute(f"SELECT DISTINCT b FROM co WHERE a IN ({marks})", ngo_ids)]
+    return _degrees(db, list(set(ngo_ids) | set(partners)))
+
+
+def _rerank(db, ngo_ids, attrs):
+    ngo_ids = sorted(set(ngo_ids))
+    if not ngo_ids:
+        return
+    degree = _degrees_around(db, ngo_ids)
+    for n in ngo_ids:
+        _rank(db, n, attrs, degree)
+
+
+def _affected(db, ngo_id, attrs):
+    """
+    NGOs whose top-K can change when ngo_id's attributes, status or degree move:
+    itself, its co-donation partners (their cosine with it), the NGOs that list
+    it now, and the TOP_K nearest by attributes (where a new NGO would enter).
+    """
+    listed_by = [r[0] for r in db.execute("SELECT ngo_id FROM neighbours WHERE other = ?", (ngo_id,))]
+    nearest = []
+    if ngo_id in attrs:
+        nearest = sorted((o for o in attrs if o != ngo_id),
+                         key=lambda o: _attr_similarity(attrs[ngo_id], attrs[o]), reverse=True)[:TOP_K]
+    return [n for n in {ngo_id, *_partners(db, ngo_id), *listed_by, *nearest} if n in attrs]
+
+
+def _ngo_row(ngo):
+    return (ngo["ngo_id"], ngo["cause"].strip().lower(), ngo["location"].strip().lower(),
+            ngo["trust_dna"], float(ngo["transparency_score"]), int(ngo["status"] == "approved"))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# OFFLINE BUILD — into *_next tables, then one short swap
+# ═══════════════════════════════════════════════════════════════════════════════
+def rebuild():
+    from utils.data_manager import get_all_ngos, get_donations_by_ngo
+
+    with lock(CONSUMER):
+        start = changefeed.head()       # anything later is replayed by the consumer
+        db = _db()
+        try:
+            for table, cols in TABLES.items():
+                db.execute(f"DROP TABLE IF EXISTS {table}_next")
+                db.execute(f"CREATE TABLE {table}_next ({cols})")
+            pairs = set()
+            for ngo in get_all_ngos():  # autocommit, one NGO per write: never a long write lock
+                db.execute("INSERT INTO ngos_next VALUES (?, ?, ?, ?, ?, ?)", _ngo_row(ngo))
+                mine = {(d["donor_id"], ngo["ngo_id"]) for d in get_donations_by_ngo(ngo["ngo_id"])}
+                db.executemany("INSERT OR IGNORE INTO donor_ngos_next VALUES (?, ?)", mine)
+                pairs |= mine
+
+            # AᵀA over the sparse donor rows: each donor contributes their NGO pairs
+            co, degree = {}, {}
+            donor, basket = None, []
+            for donor_id, ngo_id in chain(sorted(pairs), [(None, None)]):
+                if donor_id != donor:
+                    for i, a in enumerate(basket):
+                        for b in basket[i + 1:]:
+                            for x, y in ((a, b), (b, a)):
+                                row = co.setdefault(x, {})
+                                row[y] = row.get(y, 0) + 1
+                    donor, basket = donor_id, []
+                basket.append(ngo_id)
+                if ngo_id is not None:
+                    degree[ngo_id] = degree.get(ngo_id, 0) + 1
+            db.executemany("INSERT INTO co_next VALUES (?, ?, ?)",
+                           [(a, b, n) for a, row in co.items() for b, n in row.items()])
+
+            attrs = {r[0]: r[1:] for r in db.execute(
+                "SELECT ngo_id, cause, location, trust_dna, score FROM ngos_next WHERE approved = 1")}
+            for ngo_id in attrs:
+                db.executemany("INSERT INTO neighbours_next VALUES (?, ?, ?)",
+                               _top(ngo_id, attrs, co.get(ngo_id, {}), degree))
+
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for table in TABLES:
+                    db.execute(f"DROP TABLE {table}")
+                    db.execute(f"ALTER TABLE {table}_next RENAME TO {table}")
+                db.execute("CREATE INDEX IF NOT EXISTS idx_ngo_donors ON donor_ngos (ngo_id)")
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+        changefeed.Consumer(CONSUMER, EVENTS).commit(start)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INCREMENTAL REFRESH — change-feed consumer, off the write path
+# ═══════════════════════════════════════════════════════════════════════════════
+def _add_donation(db, donation):
+    """Record one donor→NGO pair → the NGOs to re-rank (none for a repeat donor)."""
+    donor_id, ngo_id = donation["donor_id"], donation["ngo_id"]
+    cur = db.execute("INSERT OR IGNORE INTO donor_ngos VALUES (?, ?)", (donor_id, ngo_id))
+    if cur.rowcount == 0:               # repeat donor for this NGO — A is binary, nothing moves
+        return set()
+    others = [r[0] for r in db.execute(
+        "SELECT ngo_id FROM donor_ngos WHERE donor_id = ? AND ngo_id != ?", (donor_id, ngo_id))]
+    for other in others:
+        for a, b in ((ngo_id, other), (other, ngo_id)):
+            db.execute("INSERT INTO co VALUES (?, ?, 1) "
+                       "ON CONFLICT(a, b) DO UPDATE SET n = n + 1", (a, b))
+    # ngo_id's degree moved, so every partner's cosine with it moved too —
+    # not only the NGOs this donor supports
+    return {ngo_id, *_partners(db, ngo_id)}
+
+
+def _update_ngo(db, ngo):
+    """Store an NGO's ranked attributes → the lists it used to be in or near (None if unchanged)."""
+    row = _ngo_row(ngo)
+    if db.execute("SELECT 1 FROM ngos WHERE ngo_id = ? AND cause = ? AND location = ? AND trust_dna = ? "
+                  "AND score = ? AND approved = ?", row).fetchone():
+        return None                     # a re-score that moved nothing the ranking uses
+    before = set(_affected(db, ngo["ngo_id"], _approved_attrs(db)))
+    db.execute("INSERT OR REPLACE INTO ngos VALUES (?, ?, ?, ?, ?, ?)", row)
+    if not row[5]:
+        db.execute("DELETE FROM neighbours WHERE ngo_id = ? OR other = ?", (ngo["ngo_id"], ngo["ngo_id"]))
+    return before
+
+
+def apply(events):
+    """Apply a batch of change-feed events in one transaction; each affected NGO is re-ranked once."""
+    from utils.data_manager import get_ngo_by_id
+
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            dirty, changed = set(), set()
+            for e in events:
+                if e["type"] == "donation.created":
+                    dirty |= _add_donation(db, e["data"])
+                    continue
+                ngo = get_ngo_by_id(e["ngo_id"])    # decision events carry no row: read it fresh
+                before = _update_ngo(db, ngo) if ngo else None
+                if before is not None:
+                    dirty |= before
+                    changed.add(ngo["ngo_id"])
+            attrs = _approved_attrs(db)
+            for ngo_id in changed:      # lists each changed NGO now qualifies for
+                dirty |= set(_affected(db, ngo_id, attrs))
+            _rerank(db, dirty, attrs)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+
+
+def consume(stop=None):
+    """Tail the change feed forever (or until stop() is true); build first if no build exists."""
+    consumer = changefeed.Consumer(CONSUMER, EVENTS)
+    while not (stop and stop()):
+        try:
+            with lock(CONSUMER):        # one replica applies a batch at a time
+                if not built():
+                    rebuild()
+                events = consumer.poll(BATCH)
+                if events:
+                    apply(events)
+                    consumer.commit(events[-1]["seq"])
+        except Exception:
+            log.exception("Recommendation refresh failed — retrying (python -m utils.recommender rebuilds)")
+            events = None
+        if not events:
+            time.sleep(POLL)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SERVE
+# ═══════════════════════════════════════════════════════════════════════════════
+def built():
+    db = _db()
+    try:
+        return db.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+    finally:
+        db.close()
+
+
+def start():
+    """Server boot: the build (if none exists yet) and the feed consumer, in one background thread."""
+    thread = threading.Thread(target=consume, name="recommender", daemon=True)
+    thread.start()
+    return thread
+
+
+def recommend_for_donor(donor_id, n=5):
+    """[(ngo_id, score)] best first, excluding NGOs the donor already supports ([] until built)."""
+    db = _db()
+    try:
+        rows = db.execute("""
+            SELECT nb.other, SUM(nb.score) AS s
+            FROM donor_ngos d JOIN neighbours nb ON nb.ngo_id = d.ngo_id
+            WHERE d.donor_id = ?
+              AND nb.other NOT IN (SELECT ngo_id FROM donor_ngos WHERE donor_id = ?)
+            GROUP BY nb.other ORDER BY s DESC LIMIT ?""", (donor_id, donor_id, n)).fetchall()
+    finally:
+        db.close()
+    return rows
+
+
+def similar_ngos(ngo_id, n=5):
+    db = _db()
+    try:
+        return db.execute("SELECT other, score FROM neighbours WHERE ngo_id = ? "
+                          "ORDER BY score DESC LIMIT ?", (ngo_id, n)).fetchall()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    rebuild()
+    print(f"✅ Rebuilt {RECS_PATH}")
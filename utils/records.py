@@ -0,0 +1,127 @@
+"""
+utils/records.py — NSITN v2.0
+Typed, compact records for NGO / donation / allocation rows.
+
+data_manager rows store every field as a string, so pages used to call
+float(n["transparency_score"]) and friends on every render. These slotted
+dataclasses parse each field once; numeric fields are real floats/ints.
+Records still answer rec["field"] and rec.get("field") so existing templates
+keep working, while hot paths (sorting, colouring) use attributes.
+"""
+
+from dataclasses import dataclass, fields
+
+
+def _float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(v):
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _str(v):
+    return "" if v is None else str(v)
+
+
+_PARSERS = {float: _float, int: _int, str: _str}
+
+
+class _Record:
+    __slots__ = ()
+    _parsers = None                     # {field: parser}, built once per class
+
+    @classmethod
+    def _fields(cls):
+        if cls.__dict__.get("_parsers") is None:
+            cls._parsers = {f.name: _PARSERS[f.type] for f in fields(cls) if f.name != "extra"}
+        return cls._parsers
+
+    @classmethod
+    def from_row(cls, row):
+        if isinstance(row, cls):
+            return row
+        parsers = cls._fields()
+        values  = {k: p(row.get(k)) for k, p in parsers.items()}
+        extra   = {k: v for k, v in row.items() if k not in parsers}
+        return cls(**values, extra=extra or None)
+
+    @classmethod
+    def many(cls, rows):
+        return [cls.from_row(r) for r in rows]
+
+    # ── dict-style access for existing templates ──
+    def __getitem__(self, key):
+        if key in self._fields():
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._fields() or (self.extra is not None and key in self.extra)
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in self._fields()}
+        d.update(self.extra or {})
+        return d
+
+
+@dataclass(slots=True)
+class NGORecord(_Record):
+    ngo_id:                str
+    name:                  str
+    email:                 str
+    cause:                 str
+    location:              str
+    founded_year:          str
+    registration_number:   str
+    description:           str
+    trust_dna:             str
+    status:                str
+    admin_note:            str
+    transparency_score:    float
+    risk_percent:          float
+    allocation_efficiency: float
+    outcome_accuracy:      float
+    timeliness_score:      float
+    donation_consistency:  float
+    extra:                 dict = None
+
+
+@dataclass(slots=True)
+class DonationRecord(_Record):
+    donation_id: str
+    donor_id:    str
+    ngo_id:      str
+    amount:      float
+    upi_id:      str
+    donated_at:  str
+    receipt_id:  str
+    extra:       dict = None
+
+
+@dataclass(slots=True)
+class AllocationRecord(_Record):
+    alloc_id:        str
+    ngo_id:          str
+    donation_id:     str
+    activity_type:   str
+    unit_cost:       float
+    units_planned:   int
+    units_delivered: int
+    total_cost:      float
+    outcome_date:    str
+    extra:           dict = None
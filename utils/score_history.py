@@ -0,0 +1,200 @@
+"""
+utils/score_history.py — NSITN v2.0
+Per-NGO transparency-score history, delta + varint encoded.
+
+store.run_ngo_analysis emits every scoring run; a run whose scores differ
+from the last point appends one (time + the six scores) to the NGO's chunk
+for that month — reruns that change nothing add nothing. A point is the
+seconds since the previous point plus each score's change in hundredths,
+all zigzag/varint encoded (replica clocks may disagree, so time deltas can
+be negative) — a typical run costs 7–10 bytes. The first point of
+every monthly chunk is absolute, so a chunk decodes on its own and "this
+month" reads one small blob. Decoding fills array('d') columns directly, so
+trend charts and "changed by X" queries need no recomputation.
+"""
+
+import os
+import sqlite3
+import time
+from array import array
+from datetime import datetime
+
+from utils.store import DATA_DIR, on_write
+
+HISTORY_PATH = os.path.join(DATA_DIR, "score_history.sqlite")
+FIELDS = ("transparency_score", "risk_percent", "allocation_efficiency",
+          "outcome_accuracy", "timeliness_score", "donation_consistency")
+SCALE  = 100                            # scores are stored in hundredths
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(HISTORY_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS chunks (ngo_id TEXT, month TEXT, points INTEGER,
+                                           last_t INTEGER, last BLOB, data BLOB,
+                                           PRIMARY KEY (ngo_id, month));
+    """)
+    return db
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ENCODING
+# ═══════════════════════════════════════════════════════════════════════════════
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def encode_point(t, values, prev_t=0, prev=None):
+    """values, prev: ints in hundredths. prev=None → absolute (chunk keyframe)."""
+    prev = prev or [0] * len(values)
+    out = bytearray()
+    _put_varint(out, _zigzag(t - prev_t))
+    for v, p in zip(values, prev):
+        _put_varint(out, _zigzag(v - p))
+    return bytes(out)
+
+
+def decode(data):
+    """Chunk blob → (times array('q'), [array('q') per field]) in hundredths."""
+    times, cols = array("q"), [array("q") for _ in FIELDS]
+    t, cur, i, n = 0, [0] * len(FIELDS), 0, len(data)
+    vals = []
+    while i < n:
+        shift = result = 0
+        while True:
+            b = data[i]
+            i += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        vals.append(result)
+        if len(vals) == len(FIELDS) + 1:
+            t += _unzigzag(vals[0])
+            times.append(t)
+            for k in range(len(FIELDS)):
+                cur[k] += _unzigzag(vals[k + 1])
+                cols[k].append(cur[k])
+            vals = []
+    return times, cols
+
+
+def _pack(values):
+    return array("q", values).tobytes()
+
+
+def _unpack(blob):
+    a = array("q")
+    a.frombytes(blob)
+    return list(a)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# APPEND — one point per change in scores
+# ═══════════════════════════════════════════════════════════════════════════════
+def record(ngo, at=None):
+    """Append one point unless the scores equal the NGO's latest point. Returns True if appended."""
+    values = []
+    for f in FIELDS:
+        try:
+            values.append(int(round(float(ngo.get(f) or 0) * SCALE)))
+        except (TypeError, ValueError):
+            values.append(0)
+    db = _db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        # Clock read under the write lock, so points are appended in time order on this replica
+        t = int(at if at is not None else time.time())
+        month = datetime.fromtimestamp(t).strftime("%Y-%m")
+        latest = db.execute("SELECT last FROM chunks WHERE ngo_id = ? ORDER BY month DESC LIMIT 1",
+                            (ngo["ngo_id"],)).fetchone()
+        if latest and _unpack(latest[0]) == values:
+            db.execute("ROLLBACK")
+            return False
+        head = db.execute("SELECT last_t, last, data FROM chunks WHERE ngo_id = ? AND month = ?",
+                          (ngo["ngo_id"], month)).fetchone()
+        if head:
+            # SQLite's || yields TEXT, so the (month-sized) blob is extended here
+            point = encode_point(t, values, head[0], _unpack(head[1]))
+            db.execute("UPDATE chunks SET points = points + 1, last_t = ?, last = ?, data = ? "
+                       "WHERE ngo_id = ? AND month = ?",
+                       (t, _pack(values), head[2] + point, ngo["ngo_id"], month))
+        else:
+            db.execute("INSERT INTO chunks VALUES (?, ?, 1, ?, ?, ?)",
+                       (ngo["ngo_id"], month, t, _pack(values), encode_point(t, values)))
+        db.execute("COMMIT")
+        return True
+    finally:
+        db.close()
+
+
+@on_write("analysis")
+def _scored(ngo):
+    record(ngo)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READ
+# ═══════════════════════════════════════════════════════════════════════════════
+def history(ngo_id, since=None):
+    """{"at": array('d') epoch seconds, field: array('d') scores} for points at/after since."""
+    month = datetime.fromtimestamp(since).strftime("%Y-%m") if since else ""
+    db = _db()
+    try:
+        blobs = [r[0] for r in db.execute(
+            "SELECT data FROM chunks WHERE ngo_id = ? AND month >= ? ORDER BY month", (ngo_id, month))]
+    finally:
+        db.close()
+    out = {"at": array("d"), **{f: array("d") for f in FIELDS}}
+    for blob in blobs:
+        times, cols = decode(blob)
+        start = 0
+        if since:
+            while start < len(times) and times[start] < since:
+                start += 1
+        out["at"].extend(float(x) for x in times[start:])
+        for f, col in zip(FIELDS, cols):
+            out[f].extend(v / SCALE for v in col[start:])
+    return out
+
+
+def latest_before(ngo_id, t):
+    """Scores as of time t (the last point at or before it), or None."""
+    month = datetime.fromtimestamp(t).strftime("%Y-%m")
+    db = _db()
+    try:
+        rows = db.execute("SELECT data FROM chunks WHERE ngo_id = ? AND month <= ? "
+                          "ORDER BY month DESC LIMIT 2", (ngo_id, month)).fetchall()
+    finally:
+        db.close()
+    for (blob,) in rows:                # current month first, then the one before
+        times, cols = decode(blob)
+        idx = next((i for i in range(len(times) - 1, -1, -1) if times[i] <= t), None)
+        if idx is not None:
+            return {f: col[idx] / SCALE for f, col in zip(FIELDS, cols)}
+    return None
+
+
+def change(ngo_id, field="transparency_score", days=30):
+    """(now, delta over the window) — delta is None when there is no earlier point."""
+    now_t = time.time()
+    now, then = latest_before(ngo_id, now_t), latest_before(ngo_id, now_t - days * 86400)
+    if now is None:
+        return None, None
+    if then is None:                    # NGO is newer than the window: compare to its first run
+        first = history(ngo_id, now_t - days * 86400)
+        then = {field: first[field][0]} if len(first[field]) else None
+    return now[field], (round(now[field] - then[field], 2) if then else None)
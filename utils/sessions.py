@@ -0,0 +1,170 @@
+"""
+utils/sessions.py — NSITN v2.0
+Per-session memory accounting, caps and idle-session eviction.
+
+Every rerun — full page or fragment — touch()es the process-wide registry
+with its own session state (fragments that don't change the state just call
+seen()): the state is measured (deep size of every value), chat history is
+capped at NSITN_CHAT_MAX turns, and a session above NSITN_SESSION_MAX_KB
+sheds cached data (render timings, finished payment data, older chat turns).
+While a session is on a page that doesn't show the chat, its touch() spills
+the chat history to DATA_DIR/sessions/<id>.json and keeps an empty list in
+memory, so a session left idle anywhere but the chat page holds no history;
+the touch() of its next chat rerun reads it back.
+
+The registry keeps only plain per-session numbers (bytes, last seen, user,
+spilled) — never a session's state. A session's state is read and changed
+only by its own touch(), so one session's rerun can never move another
+session's data. A sweep, run at most once a minute, forgets sessions idle
+for NSITN_SESSION_EXPIRE seconds and removes their spill files.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from utils.store import DATA_DIR
+
+SPILL_DIR      = os.path.join(DATA_DIR, "sessions")
+CHAT_MAX       = int(os.environ.get("NSITN_CHAT_MAX", "50"))
+SESSION_MAX    = int(os.environ.get("NSITN_SESSION_MAX_KB", "512")) * 1024
+SESSION_EXPIRE = float(os.environ.get("NSITN_SESSION_EXPIRE", "86400"))
+SWEEP_EVERY    = 60
+
+
+def deep_size(obj, seen=None):
+    """Approximate retained bytes of obj and everything it references (shared objects once)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, s), seen) for s in obj.__slots__ if hasattr(obj, s))
+    return size
+
+
+def append_chat(history, turn):
+    """Append a (question, answer) turn, keeping only the last CHAT_MAX."""
+    history.append(turn)
+    if len(history) > CHAT_MAX:
+        del history[:len(history) - CHAT_MAX]
+
+
+def _spill_path(session_id):
+    return os.path.join(SPILL_DIR, f"{session_id}.json")
+
+
+class SessionRegistry:
+    def __init__(self):
+        self._lock       = threading.Lock()
+        self.sessions    = {}           # session_id → info dict
+        self._last_sweep = 0.0
+
+    # ── per rerun ──
+    def touch(self, session_id, state, chat_visible=True):
+        """Account for (and cap) this session's own state; chat_visible=False spills its chat."""
+        now = time.time()
+        with self._lock:
+            info = self.sessions.setdefault(session_id, {"spilled": False, "bytes": 0})
+            spilled = info["spilled"]
+        history = state.get("chat_history")
+        if isinstance(history, list):
+            if chat_visible and spilled:
+                history = self._restore(session_id) + history
+                spilled = False
+            elif not chat_visible and history:
+                self._spill(session_id, history)
+                history, spilled = [], True
+            state["chat_history"] = history[-CHAT_MAX:]
+
+        size = self.measure(state)
+        if size > SESSION_MAX:
+            self.shed(state)
+            size = self.measure(state)
+        user = state.get("user")
+        with self._lock:
+            info.update(last_seen=now, bytes=size, spilled=spilled,
+                        user=user["email"] if user else None)
+        if now - self._last_sweep >= SWEEP_EVERY:
+            self.sweep(now)
+        return size
+
+    def seen(self, session_id):
+        """Cheap keep-alive for fragment reruns that leave the state's size alone."""
+        with self._lock:
+            info = self.sessions.get(session_id)
+            if info is not None:
+                info["last_seen"] = time.time()
+
+    @staticmethod
+    def measure(state):
+        seen = set()
+        return sum(deep_size(state[k], seen) for k in list(state.keys()))
+
+    @staticmethod
+    def shed(state):
+        """Drop what can be rebuilt, then halve the chat history."""
+        state.pop("_timings", None)
+        if state.get("payment_stage") is None:
+            state["payment_data"] = None
+        history = state.get("chat_history")
+        if isinstance(history, list):
+            state["chat_history"] = history[len(history) // 2:]
+
+    # ── spill files — only ever called from the owning session's touch() ──
+    @staticmethod
+    def _spill(session_id, history):
+        """Append history to the session's spill file (a file already there holds older turns)."""
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        path = _spill_path(session_id)
+        older = SessionRegistry._restore(session_id, remove=False)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump((older + list(history))[-CHAT_MAX:], f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _restore(session_id, remove=True):
+        try:
+            with open(_spill_path(session_id), encoding="utf-8") as f:
+                history = [tuple(t) for t in json.load(f)]
+        except FileNotFoundError:
+            return []
+        if remove:
+            os.remove(_spill_path(session_id))
+        return history
+
+    # ── background-ish maintenance (piggybacks on reruns) ──
+    def sweep(self, now=None):
+        """Forget expired sessions. Never touches any session's state."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_sweep = now
+            expired = [sid for sid, info in self.sessions.items()
+                       if now - info.get("last_seen", now) >= SESSION_EXPIRE]
+            for session_id in expired:
+                if self.sessions.pop(session_id)["spilled"] and os.path.exists(_spill_path(session_id)):
+                    os.remove(_spill_path(session_id))
+
+    # ── admin view ──
+    def summary(self):
+        now = time.time()
+        with self._lock:
+            rows = [{"session": sid[:8], "user": info.get("user") or "—",
+                     "kb": round(info["bytes"] / 1024, 1),
+                     "idle_s": int(now - info.get("last_seen", now)),
+                     "spilled": info["spilled"]}
+                    for sid, info in self.sessions.items()]
+        rows.sort(key=lambda r: r["kb"], reverse=True)
+        return {"sessions": len(rows), "total_kb": round(sum(r["kb"] for r in rows), 1),
+                "spilled": sum(r["spilled"] for r in rows), "rows": rows}
@@ -0,0 +1,147 @@
+"""
+utils/snapshot.py — NSITN v2.0
+Copy-on-write published snapshot of approved NGOs for browse traffic.
+
+A publisher writes {stats, approved NGOs + impact summaries + recent
+outcomes} to a new file and os.replace()s it over the old one, so the file
+is always complete. It reads data_manager under the same table locks the
+writers take, so no table is read halfway through a rewrite.
+Readers parse the current file straight from disk once per published
+version and swap a single reference — browse reads take no locks and never
+see a half-written row. The snapshot can be up to a TTL stale: anything
+that moves money re-reads the NGO live. When the snapshot is older than NSITN_SNAPSHOT_TTL
+seconds (default 30) a background thread republishes it.
+
+    python -m utils.snapshot      # publish now (e.g. from cron)
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from utils.data_manager import get_approved_ngos, get_ngo_impact_summary, get_platform_stats
+from utils.archive import recent
+from utils.store import DATA_DIR, lock, table_lock
+from utils.records import NGORecord
+
+SNAPSHOT_PATH = os.path.join(DATA_DIR, "snapshot", "approved.json")
+SNAPSHOT_TTL  = float(os.environ.get("NSITN_SNAPSHOT_TTL", "30"))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PUBLISH
+# ═══════════════════════════════════════════════════════════════════════════════
+def _tables(*names):
+    """Hold several table locks (sorted, like admin_decisions) for one consistent read."""
+    stack = ExitStack()
+    for name in sorted(names):
+        stack.enter_context(table_lock(name))
+    return stack
+
+
+def publish_snapshot(path=SNAPSHOT_PATH):
+    """Build and atomically publish a new snapshot. Returns its published_at."""
+    # Short locks per read, never across the whole build — writers only wait one read
+    with table_lock("ngos"):
+        approved = get_approved_ngos()
+    ngos = []
+    for n in approved:
+        row = dict(n)
+        with _tables("donations", "allocations", "outcomes"):
+            row["impact"] = get_ngo_impact_summary(n["ngo_id"])
+        row["recent_outcomes"] = recent(n["ngo_id"], "outcomes", 8)
+        ngos.append(row)
+    with _tables("users", "ngos", "donations", "allocations", "outcomes"):
+        stats = get_platform_stats()
+    published_at = time.time()
+    payload = {"published_at": published_at, "stats": stats, "ngos": ngos}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return published_at
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# READ
+# ═══════════════════════════════════════════════════════════════════════════════
+class Snapshot:
+    __slots__ = ("published_at", "stats", "ngos", "by_id", "orders")
+
+    def __init__(self, data):
+        self.published_at = data["published_at"]
+        self.stats        = data["stats"]
+        self.ngos         = NGORecord.many(data["ngos"])     # parsed once per published version
+        self.by_id        = {n["ngo_id"]: n for n in self.ngos}
+        # Browse sort orders, computed once per published version
+        self.orders = {
+            "transparency": sorted(self.ngos, key=lambda x: x.transparency_score, reverse=True),
+            "risk":         sorted(self.ngos, key=lambda x: x.risk_percent),
+            "name":         sorted(self.ngos, key=lambda x: x.name),
+        }
+
+    @property
+    def age(self):
+        return time.time() - self.published_at
+
+
+class SnapshotReader:
+    def __init__(self, path=SNAPSHOT_PATH, ttl=SNAPSHOT_TTL):
+        self.path       = path
+        self.ttl        = ttl
+        self._current   = None          # (file identity, Snapshot) — swapped as one reference
+        self._refresher = threading.Lock()
+
+    def _load(self):
+        st_ = os.stat(self.path)
+        ident = (st_.st_ino, st_.st_mtime_ns, st_.st_size)
+        current = self._current
+        if current and current[0] == ident:
+            return current[1]
+        with open(self.path, encoding="utf-8") as f:
+            st_ = os.fstat(f.fileno())  # identity of the file actually opened, not the one stat()ed
+            snap = Snapshot(json.load(f))
+        self._current = ((st_.st_ino, st_.st_mtime_ns, st_.st_size), snap)
+        return snap
+
+    def _refresh(self):
+        try:
+            with lock("snapshot"):      # one publisher across replicas
+                try:
+                    if self._load().age < self.ttl:
+                        return          # someone else just published
+                except FileNotFoundError:
+                    pass
+                publish_snapshot(self.path)
+        finally:
+            self._refresher.release()
+
+    def get(self):
+        try:
+            snap = self._load()
+        except FileNotFoundError:
+            if self._refresher.acquire():
+                self._refresh()
+            return self._load()
+        if snap.age >= self.ttl and self._refresher.acquire(blocking=False):
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return snap
+
+
+_reader = SnapshotReader()
+
+def get_snapshot():
+    return _reader.get()
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    publish_snapshot()
+    print(f"✅ Published {SNAPSHOT_PATH}")
@@ -0,0 +1,159 @@
+"""
+utils/warmup.py — NSITN v2.0
+Boot-time cache warmer for the hot read paths, guided by a view histogram.
+
+NGO detail views are counted in memory and flushed to a small SQLite
+histogram (every FLUSH_EVERY views or FLUSH_SECONDS). At server boot a
+background thread loads the browse snapshot (approved NGOs, platform stats,
+impact summaries, recent outcomes), the leaderboards and the facet index,
+then the forecast history arrays of the WARM_TOP most-viewed NGOs, so the
+first visitors after a deploy hit warm caches. Every step only fills a
+cache that a page reads back — nothing is re-scored or written. Counts are
+halved once per deploy (DECAY_EVERY, across all replicas) so the histogram
+follows what is popular now.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from utils.store import DATA_DIR, lock
+
+VIEWS_PATH    = os.path.join(DATA_DIR, "views.sqlite")
+WARM_TOP      = int(os.environ.get("NSITN_WARM_TOP", "50"))
+FLUSH_EVERY   = 50
+FLUSH_SECONDS = 30
+DECAY         = 0.5
+DECAY_EVERY   = 3600                    # replicas booting within this window share one decay
+
+log = logging.getLogger(__name__)
+
+
+def _db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db = sqlite3.connect(VIEWS_PATH, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS views (ngo_id TEXT PRIMARY KEY, n REAL, last REAL)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_views_n ON views (n DESC)")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+    return db
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# VIEW HISTOGRAM
+# ═══════════════════════════════════════════════════════════════════════════════
+_pending, _pending_lock, _last_flush = Counter(), threading.Lock(), [time.time()]
+
+
+def record_view(ngo_id):
+    """Count one NGO page view (buffered; one SQLite write per FLUSH_EVERY views)."""
+    with _pending_lock:
+        _pending[ngo_id] += 1
+        due = sum(_pending.values()) >= FLUSH_EVERY or time.time() - _last_flush[0] >= FLUSH_SECONDS
+    if due:
+        flush_views()
+
+
+def flush_views():
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.time()
+    if not batch:
+        return
+    db = _db()
+    try:
+        db.executemany("INSERT INTO views VALUES (?, ?, ?) ON CONFLICT(ngo_id) "
+                       "DO UPDATE SET n = n + excluded.n, last = excluded.last",
+                       [(ngo_id, n, time.time()) for ngo_id, n in batch.items()])
+    finally:
+        db.close()
+
+
+def hottest(n=WARM_TOP):
+    db = _db()
+    try:
+        return [r[0] for r in db.execute("SELECT ngo_id FROM views ORDER BY n DESC LIMIT ?", (n,))]
+    finally:
+        db.close()
+
+
+def decay(factor=DECAY, every=DECAY_EVERY):
+    """Halve the counts — once per deploy: a replica booting soon after another skips it."""
+    with lock("views-decay"):
+        db = _db()
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'decayed_at'").fetchone()
+            if row and time.time() - row[0] < every:
+                return False
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE views SET n = n * ?", (factor,))
+            db.execute("DELETE FROM views WHERE n < 0.5")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('decayed_at', ?)", (time.time(),))
+            db.execute("COMMIT")
+            return True
+        finally:
+            db.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# WARMER
+# ═══════════════════════════════════════════════════════════════════════════════
+class CacheWarmer:
+    """Runs warm() once in a daemon thread; .status is shown to admins."""
+
+    def __init__(self, top=WARM_TOP):
+        self.top         = top
+        self.status      = {"state": "pending", "warmed": 0, "seconds": 0.0, "errors": 0}
+
+    def start(self):
+        threading.Thread(target=self.warm, name="cache-warmer", daemon=True).start()
+        return self
+
+    def _step(self, fn, *args):
+        try:
+            result = fn(*args)
+            self.status["warmed"] += 1
+            return result
+        except Exception:
+            self.status["errors"] += 1
+            log.exception("Cache warm step %s%s failed", getattr(fn, "__name__", fn), args)
+            return None
+
+    def warm(self):
+        from utils.snapshot import get_snapshot
+        from utils import leaderboard, facets, forecast
+
+        t0 = time.perf_counter()
+        self.status["state"] = "running"
+        hot = hottest(self.top)
+        decay()
+
+        # Shared structures first — every visitor needs these
+        snap = self._step(get_snapshot)
+        if snap is not None:
+            self._step(facets.get_index, snap)
+        self._step(leaderboard.top, "overall", 5)
+
+        # Then per-NGO data, most viewed first (fill up with the leaderboard if history is thin)
+        if len(hot) < self.top:
+            top = self._step(leaderboard.top, "overall", self.top) or []
+            hot += [r["ngo_id"] for r in top if r["ngo_id"] not in hot]
+        # Impact summaries and recent outcomes already ride in the snapshot; what a
+        # detail page still builds per NGO is the forecast history (needs numpy)
+        if forecast.available():
+            for ngo_id in hot[:self.top]:
+                self._step(forecast.prepare, ngo_id)
+
+        self.status.update(state="done", seconds=round(time.perf_counter() - t0, 2))
+        log.info("Cache warm: %(warmed)d steps, %(errors)d errors in %(seconds)ss", self.status)
+        return self.status
+
+
+if __name__ == "__main__":
+    from utils.data_manager import init_storage
+    init_storage()
+    print(CacheWarmer().warm())